@@ -12,13 +12,33 @@ bcrypt = Bcrypt(app)
 
 import server
 import models
+import compress
+import events
+import jobs
+import bulk
+import api
+import reports
+import migrate
+import timeline
+import routing
+import holds
+import sessions
+import profiling
+import metrics
 from models import db
 
 # Get app from this function, easy for testing
 def get_app(option):
     app.config['LOGGING_LEVEL'] = logging.INFO
     if option == "TEST":
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db/test.db'
+        # in memory, one database per process. TEST_DATABASE_URL can
+        # name a file or another server, e.g. sqlite:///db/test.db
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+        app.config['JOBS_EAGER'] = True
+        app.config['RATELIMIT_ENABLED'] = False
+        # the fewest rounds bcrypt allows, hashing dominates the tests
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
     else:
     # app configuration
         if 'CLEARDB_DATABASE_URL' in os.environ:
@@ -35,10 +55,48 @@ def get_app(option):
             # use local db if develop locally
             app.config['SQLALCHEMY_DATABASE_URI'] = \
                 'sqlite:///db/development.db'
+        if 'REPLICA_DATABASE_URLS' in os.environ:
+            # comma separated, e.g. followers of the heroku database
+            app.config['SQLALCHEMY_REPLICAS'] = \
+                os.environ['REPLICA_DATABASE_URLS'].split(',')
+        if 'TENANT_DATABASE_URLS' in os.environ:
+            # comma separated name=uri, and email domain=name
+            app.config['TENANT_DATABASES'] = dict(
+                item.split('=', 1) for item in
+                os.environ['TENANT_DATABASE_URLS'].split(','))
+            app.config['TENANT_DOMAINS'] = dict(
+                item.split('=', 1) for item in
+                os.environ.get('TENANT_DOMAINS', '').split(',') if item)
+        if 'SESSION_STORE' in os.environ:
+            # 'memory' or 'sqlite', sessions stay out of the cookie
+            app.config['SESSION_STORE'] = os.environ['SESSION_STORE']
+        if 'METRICS_DIR' in os.environ:
+            # shared by the gunicorn workers, /metrics adds them up
+            app.config['METRICS_DIR'] = os.environ['METRICS_DIR']
+        if 'METRICS_TOKEN' in os.environ:
+            app.config['METRICS_TOKEN'] = os.environ['METRICS_TOKEN']
+        # pages stream their events only when a worker is not held by it
+        app.config['EVENTS_STREAM'] = \
+            os.environ.get('WORKER_CLASS', 'sync') != 'sync'
+        if 'MIGRATE_TIME_ZONE' in os.environ:
+            # the web servers' time zone, for flask migrate
+            app.config['MIGRATE_TIME_ZONE'] = os.environ['MIGRATE_TIME_ZONE']
+        if 'DATABASE_POOL_SIZE' in os.environ:
+            # async workers run many requests, and connections, at once
+            app.config['SQLALCHEMY_POOL_SIZE'] = \
+                int(os.environ['DATABASE_POOL_SIZE'])
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = 'please, tell nobody... Shhhh'
+    bcrypt.init_app(app)
+    sessions.init_app(app)
+    routing.init_app(app)
     db.init_app(app)
+    db.dispose_tenant_engines()
     app.app_context().push()
     with app.app_context():
         db.create_all()
+    jobs.queue.init_app(app)
+    # cached timelines belong to whatever database was configured before
+    timeline.timelines.clear()
+    holds.book.clear()
     return app
@@ -0,0 +1,146 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+from flask import request, jsonify, Response, stream_with_context, abort
+from flask_login import login_required, current_user
+from werkzeug.exceptions import NotFound
+from models import db, Resource
+from server import available_resources, book, convert_str_to_time, \
+    valid_user_time, get_free_slots, place_hold, confirm_hold
+from holds import release_hold
+from changes import write_changes
+from bulk import is_admin
+from events import reservation_data
+from ratelimit import limit
+from . import app
+
+######################################################################
+# JSON versions of search and booking for scripts and the async
+# workers (see gunicorn_config.py), they share the checks of the pages
+######################################################################
+def window_args(data):
+    '''(start, end) from date, start and duration, ValueError if bad.'''
+    try:
+        return convert_str_to_time(data['date'], data['start'],
+                                   data['duration'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Time Input Invalid")
+
+def resource_data(resource):
+    return {'id': resource.id,
+            'name': resource.name,
+            'available_start': resource.available_start,
+            'available_end': resource.available_end}
+
+######################################################################
+# Available resources, /api/search?date=yyyy-m-d&start=hh:mm
+# &duration=hh:mm
+######################################################################
+@app.route('/api/search', methods=['GET'])
+@login_required
+@limit('search', methods=('GET',))
+def api_search():
+    try:
+        start, end = window_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    message = valid_user_time(start, end, current_user)
+    if message != "":
+        return jsonify(error=message), 409
+    return jsonify(resources=[resource_data(resource) for resource
+                              in available_resources(start, end)])
+
+# same view as the page's free slot lookup, it already speaks json
+app.add_url_rule('/api/resources/<int:id>/free_slots', 'api_free_slots',
+                 get_free_slots, methods=['GET'])
+
+######################################################################
+# Book a resource, json or form body with date, start and duration
+######################################################################
+@app.route('/api/resources/<int:id>/reservations', methods=['POST'])
+@login_required
+def api_book(id):
+    resource = db.session.query(Resource).get(id)
+    if resource is None:
+        raise NotFound("resource with id '{}' was not found.".format(id))
+    data = request.get_json(silent=True) or request.form.to_dict(flat=True)
+    try:
+        start, end = window_args(data)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    reservation, message = \
+        book(resource, current_user, start, end, data['duration'])
+    if reservation is None:
+        return jsonify(error=message), 409
+    return jsonify(reservation=reservation_data(reservation)), 201
+
+######################################################################
+# Hold a window for HOLD_TTL seconds, then confirm or release it
+######################################################################
+def hold_data(hold):
+    return {'id': hold.id,
+            'resource_id': hold.resource_id,
+            'start_time': hold.start_time.strftime('%Y-%m-%d %H:%M'),
+            'end_time': hold.end_time.strftime('%Y-%m-%d %H:%M'),
+            'expires_at': hold.expires_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+@app.route('/api/resources/<int:id>/holds', methods=['POST'])
+@login_required
+def api_hold(id):
+    resource = db.session.query(Resource).get(id)
+    if resource is None:
+        raise NotFound("resource with id '{}' was not found.".format(id))
+    data = request.get_json(silent=True) or request.form.to_dict(flat=True)
+    try:
+        start, end = window_args(data)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    hold, message = place_hold(resource, current_user, start, end)
+    if hold is None:
+        return jsonify(error=message), 409
+    return jsonify(hold=hold_data(hold)), 201
+
+@app.route('/api/holds/<int:id>/confirm', methods=['POST'])
+@login_required
+def api_confirm_hold(id):
+    reservation, message = confirm_hold(id, current_user)
+    if reservation is None:
+        return jsonify(error=message), 409
+    return jsonify(reservation=reservation_data(reservation)), 201
+
+@app.route('/api/holds/<int:id>', methods=['DELETE'])
+@login_required
+def api_release_hold(id):
+    if not release_hold(id, current_user.id):
+        raise NotFound("hold with id '{}' was not found.".format(id))
+    return '', 204
+
+######################################################################
+# Change log for mirrors, /changes?since=seq[&limit=n], admins only.
+# Start from since=0 after a full export, then pass back "next".
+######################################################################
+@app.route('/changes', methods=['GET'])
+@login_required
+def changes():
+    if not is_admin(current_user):
+        abort(403)
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', app.config['CHANGES_PAGE_SIZE'],
+                                 type=int),
+                app.config['CHANGES_PAGE_SIZE'])
+    if since < 0 or limit < 1:
+        return jsonify(error="since and limit should be positive"), 400
+    return Response(stream_with_context(write_changes(since, limit)),
+                    mimetype='application/json')
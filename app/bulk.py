@@ -0,0 +1,438 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import csv
+import io
+import json
+import click
+from datetime import datetime
+from flask import request, jsonify, Response, stream_with_context, abort
+from flask_login import login_required, current_user
+from sqlalchemy import Integer, String, DateTime, bindparam
+from werkzeug.exceptions import NotFound
+from models import db, Resource, User, Reservation, Tag, Tag_Resource, \
+    EpochDateTime
+from server import valid_resource_time
+from timeline import timelines
+from jobs import defer
+from ics import bump_all_versions
+from changes import record_reset
+from . import app
+
+# --------------------- Bulk configuration ---------------------------
+# rows written per executemany, memory use is bounded by this
+app.config.setdefault('BULK_CHUNK_SIZE', 1000)
+# only the first errors are reported back, the rest are counted
+app.config.setdefault('BULK_MAX_ERRORS', 100)
+# users allowed to use admin only endpoints
+app.config.setdefault('ADMIN_EMAILS', [])
+# --------------------- End of Bulk configuration --------------------
+
+class Spec(object):
+    '''
+    How one table is exported and imported. natural_key identifies a
+    row that comes without an id, foreign_keys are checked per chunk.
+    '''
+    def __init__(self, model, columns, natural_key=None, foreign_keys=None,
+                 validate=None):
+        self.model = model
+        self.table = model.__table__
+        self.columns = columns
+        self.natural_key = natural_key
+        self.foreign_keys = foreign_keys or {}
+        self.validate = validate
+
+
+def validate_resource(row):
+    message = valid_resource_time(row['available_start'] or '',
+                                  row['available_end'] or '')
+    if message == "" and not row['name']:
+        message = "name can't be empty"
+    if message != "":
+        raise ValueError(message)
+    if row['last_reserve_time'] is None:
+        row['last_reserve_time'] = datetime.now()
+
+def validate_tag(row):
+    if not row['value']:
+        raise ValueError("value can't be empty")
+    row['value'] = row['value'].lower()
+
+def validate_reservation(row):
+    if row['start_time'] is None or row['end_time'] is None:
+        raise ValueError("start_time and end_time are required")
+    if row['start_time'] > row['end_time']:
+        raise ValueError("End must later than Start")
+    if row['create_time'] is None:
+        row['create_time'] = datetime.now()
+
+TABLES = {
+    'resources': Spec(
+        Resource,
+        ['id', 'name', 'owner_id', 'available_start', 'available_end',
+         'last_reserve_time'],
+        foreign_keys={'owner_id': User},
+        validate=validate_resource),
+    'tags': Spec(
+        Tag,
+        ['id', 'value'],
+        natural_key=('value',),
+        validate=validate_tag),
+    'tag_resources': Spec(
+        Tag_Resource,
+        ['id', 'resource_id', 'tag_id'],
+        natural_key=('resource_id', 'tag_id'),
+        foreign_keys={'resource_id': Resource, 'tag_id': Tag}),
+    'reservations': Spec(
+        Reservation,
+        ['id', 'resource_id', 'resource_name', 'user_id', 'start_time',
+         'end_time', 'create_time', 'duration'],
+        foreign_keys={'resource_id': Resource, 'user_id': User},
+        validate=validate_reservation),
+}
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+######################################################################
+# Value conversion
+######################################################################
+DATETIME_FORMATS = ['%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                    '%Y-%m-%d %H:%M']
+
+def parse_datetime(value):
+    value = value.replace('T', ' ')
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("invalid datetime '{}'".format(value))
+
+def parse_value(column, value):
+    if value is None or value == '':
+        return None
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, (DateTime, EpochDateTime)):
+        if isinstance(value, datetime):
+            return value
+        return parse_datetime(value)
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    if isinstance(column.type, String) and column.type.length and \
+        len(value) > column.type.length:
+        raise ValueError("{} longer than {}".format(column.name,
+                                                   column.type.length))
+    return value
+
+def format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return value
+
+def parse_row(spec, raw):
+    row = {}
+    for name in spec.columns:
+        try:
+            row[name] = parse_value(spec.table.c[name], raw.get(name))
+        except ValueError as e:
+            raise ValueError("{}: {}".format(name, e))
+    if spec.validate:
+        spec.validate(row)
+    return row
+
+######################################################################
+# Export, one row at a time so memory does not grow with the table
+######################################################################
+def export_rows(name, fmt):
+    spec = TABLES[name]
+    query = db.session.query(*[spec.table.c[col] for col in spec.columns]) \
+        .order_by(spec.table.c.id).yield_per(app.config['BULK_CHUNK_SIZE'])
+    if fmt == 'csv':
+        buf = io.BytesIO()
+        writer = csv.writer(buf)
+        writer.writerow(spec.columns)
+        for row in query:
+            writer.writerow([
+                value.encode('utf-8') if isinstance(value, unicode) else value
+                for value in (format_value(v) for v in row)])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+    else:
+        for row in query:
+            yield json.dumps(dict(zip(spec.columns,
+                                      [format_value(v) for v in row]))) + '\n'
+
+######################################################################
+# Import
+######################################################################
+def read_rows(fp, fmt):
+    '''
+    Yields (line number, dict) without reading the whole input.
+    '''
+    if fmt == 'csv':
+        reader = csv.DictReader(fp)
+        for raw in reader:
+            yield reader.line_num, raw
+    else:
+        for number, line in enumerate(fp, 1):
+            if line.strip():
+                try:
+                    raw = json.loads(line)
+                except ValueError as e:
+                    yield number, e
+                    continue
+                yield number, raw
+
+
+class ImportResult(object):
+
+    def __init__(self, max_errors):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def serialize(self):
+        return {'inserted': self.inserted,
+                'updated': self.updated,
+                'skipped': self.skipped,
+                'error_count': self.error_count,
+                'errors': self.errors}
+
+
+def import_rows(name, fp, fmt, chunk_size=None, max_errors=None):
+    spec = TABLES[name]
+    chunk_size = chunk_size or app.config['BULK_CHUNK_SIZE']
+    result = ImportResult(max_errors or app.config['BULK_MAX_ERRORS'])
+    kind = 'reservation' if name == 'reservations' else 'resource'
+    chunk = []
+    for line, raw in read_rows(fp, fmt):
+        if isinstance(raw, Exception):
+            result.error(line, str(raw))
+            continue
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError("not a json object")
+            chunk.append((line, parse_row(spec, raw)))
+        except (ValueError, TypeError, AttributeError) as e:
+            result.error(line, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            flush_chunk(spec, chunk, result, kind)
+            chunk = []
+    if chunk:
+        flush_chunk(spec, chunk, result, kind)
+    if name == 'reservations' and result.inserted + result.updated:
+        timelines.clear()
+        defer('rebuild_usage')
+    return result
+
+def existing_values(column, values):
+    values = set(v for v in values if v is not None)
+    if not values:
+        return set()
+    return set(v for (v,) in db.session.query(column)
+                                    .filter(column.in_(values)))
+
+def record_import(kind):
+    '''
+    Tell mirrors and feeds that rows of kind changed, in the transaction
+    of every write. Mirrors can't follow row by row, they download the
+    kind again, and one that did so mid-import sees the next reset.
+    '''
+    record_reset(kind)
+    if kind == 'reservation':
+        bump_all_versions()
+
+def flush_chunk(spec, chunk, result, kind):
+    table = spec.table
+    # drop rows pointing at missing parents, one query per foreign key
+    for column, model in spec.foreign_keys.items():
+        found = existing_values(model.__table__.c.id,
+                                [row[column] for line, row in chunk])
+        valid = []
+        for line, row in chunk:
+            if row[column] is None or row[column] not in found:
+                result.error(line, "{} '{}' does not exist".format(
+                    column, row[column]))
+            else:
+                valid.append((line, row))
+        chunk = valid
+    ids = existing_values(table.c.id, [row['id'] for line, row in chunk])
+    keys = set()
+    if spec.natural_key:
+        keys = set(
+            tuple(key) for key in db.session.query(
+                *[table.c[col] for col in spec.natural_key])
+            .filter(table.c[spec.natural_key[0]].in_(
+                set(row[spec.natural_key[0]] for line, row in chunk))))
+    updates, inserts = [], []
+    for line, row in chunk:
+        if row['id'] in ids:
+            updates.append((line, row))
+            continue
+        if spec.natural_key:
+            key = tuple(row[col] for col in spec.natural_key)
+            if key in keys:
+                result.skipped += 1
+                continue
+            keys.add(key)
+        inserts.append((line, row))
+    if not updates and not inserts:
+        return
+    try:
+        execute_chunk(spec, [row for line, row in updates],
+                      [row for line, row in inserts])
+        record_import(kind)
+        db.session.commit()
+        result.updated += len(updates)
+        result.inserted += len(inserts)
+    except Exception:
+        db.session.rollback()
+        # find the offending rows one at a time
+        for rows, is_update in ((updates, True), (inserts, False)):
+            for line, row in rows:
+                try:
+                    if is_update:
+                        execute_chunk(spec, [row], [])
+                    else:
+                        execute_chunk(spec, [], [row])
+                    record_import(kind)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    result.error(line, str(e.args[0] if e.args else e))
+                else:
+                    if is_update:
+                        result.updated += 1
+                    else:
+                        result.inserted += 1
+
+def execute_chunk(spec, updates, inserts):
+    table = spec.table
+    if updates:
+        statement = table.update() \
+            .where(table.c.id == bindparam('_id')) \
+            .values(dict((col, bindparam(col))
+                         for col in spec.columns if col != 'id'))
+        db.session.execute(statement, [
+            dict([('_id', row['id'])] +
+                 [(col, row[col]) for col in spec.columns if col != 'id'])
+            for row in updates])
+    # executemany needs every row to have the same keys, rows without an
+    # id get theirs from the database
+    with_id = [row for row in inserts if row['id'] is not None]
+    without_id = [dict((col, row[col]) for col in spec.columns if col != 'id')
+                  for row in inserts if row['id'] is None]
+    if with_id:
+        db.session.execute(table.insert(), with_id)
+    if without_id:
+        db.session.execute(table.insert(), without_id)
+
+def import_format(filename, fmt):
+    if fmt is None and filename and '.' in filename:
+        fmt = filename.rsplit('.', 1)[1].lower()
+    if fmt not in FORMATS:
+        raise ValueError("format should be one of " + ", ".join(FORMATS))
+    return fmt
+
+######################################################################
+#  H T T P
+######################################################################
+def is_admin(user):
+    return user.is_authenticated and \
+        user.email in app.config['ADMIN_EMAILS']
+
+######################################################################
+# Export a table, /export/<table>?format=csv|jsonl
+######################################################################
+@app.route('/export/<name>', methods=['GET'])
+@login_required
+def export_table(name):
+    if not is_admin(current_user):
+        abort(403)
+    if name not in TABLES:
+        raise NotFound("table '{}' was not found.".format(name))
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify(error="format should be one of " +
+                       ", ".join(FORMATS)), 400
+    response = Response(stream_with_context(export_rows(name, fmt)),
+                        mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename={}.{}'.format(name, fmt)
+    return response
+
+######################################################################
+# Import a table from the uploaded 'file'
+######################################################################
+@app.route('/import/<name>', methods=['POST'])
+@login_required
+def import_table(name):
+    if not is_admin(current_user):
+        abort(403)
+    if name not in TABLES:
+        raise NotFound("table '{}' was not found.".format(name))
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify(error="file is required"), 400
+    try:
+        fmt = import_format(upload.filename, request.form.get('format'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    result = import_rows(name, upload.stream, fmt)
+    return jsonify(**result.serialize())
+
+######################################################################
+#  C L I
+######################################################################
+@app.cli.command('export')
+@click.argument('name', type=click.Choice(sorted(TABLES)))
+@click.argument('output', type=click.File('wb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)),
+              default='csv')
+def export_command(name, output, fmt):
+    '''Export a table as csv or jsonl.'''
+    for chunk in export_rows(name, fmt):
+        output.write(chunk)
+
+@app.cli.command('import')
+@click.argument('name', type=click.Choice(sorted(TABLES)))
+@click.argument('input', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)))
+@click.option('--chunk-size', type=int)
+def import_command(name, input, fmt, chunk_size):
+    '''Import a csv or jsonl file into a table.'''
+    try:
+        fmt = import_format(input.name, fmt)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    result = import_rows(name, input, fmt, chunk_size)
+    for error in result.errors:
+        click.echo('line {line}: {error}'.format(**error), err=True)
+    click.echo('inserted {}, updated {}, skipped {}, errors {}'.format(
+        result.inserted, result.updated, result.skipped, result.error_count))
@@ -0,0 +1,100 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import json
+from datetime import datetime
+from models import db, Change
+from . import app
+
+# --------------------- Change log configuration ---------------------
+# changes returned by one /changes request unless it asks for fewer
+app.config.setdefault('CHANGES_PAGE_SIZE', 1000)
+# rows fetched per round trip while streaming
+app.config.setdefault('CHANGES_FETCH_SIZE', 200)
+# --------------------- End of Change log configuration --------------
+
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+######################################################################
+# Recording, the caller commits together with the change. Deleting a
+# resource deletes its reservations, that is one resource delete.
+######################################################################
+def record(kind, op, row_id=None, data=None):
+    db.session.add(Change(kind=kind, op=op, row_id=row_id,
+                          data=json.dumps(data) if data is not None
+                          else None,
+                          created_at=datetime.now()))
+
+def record_resource(resource, op):
+    '''Record resource, flushed so it has an id, after op.'''
+    data = None
+    if op != 'delete':
+        data = {'name': resource.name,
+                'owner_id': resource.owner_id,
+                'available_start': resource.available_start,
+                'available_end': resource.available_end,
+                'tags': [tag.value for tag in resource.tags]}
+    record('resource', op, resource.id, data)
+
+def record_reservation(reservation, op):
+    data = None
+    if op != 'delete':
+        data = {'resource_id': reservation.resource_id,
+                'resource_name': reservation.resource_name,
+                'user_id': reservation.user_id,
+                'start_time': reservation.start_time.strftime(TIME_FORMAT),
+                'end_time': reservation.end_time.strftime(TIME_FORMAT),
+                'duration': reservation.duration}
+    record('reservation', op, reservation.id, data)
+
+def record_reset(kind):
+    '''Rows of kind changed in bulk, mirrors should download them again.'''
+    record(kind, 'reset')
+
+######################################################################
+# Reading
+######################################################################
+def change_data(change):
+    return {'seq': change.seq,
+            'kind': change.kind,
+            'op': change.op,
+            'id': change.row_id,
+            'data': json.loads(change.data) if change.data else None,
+            'time': change.created_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+def changes_since(since, limit):
+    '''
+    Changes after seq since, oldest first, streamed from the primary
+    key. On databases that commit concurrently a later seq may become
+    visible first, the sqlite default writes one transaction at a time.
+    '''
+    return db.session.query(Change) \
+        .filter(Change.seq > since) \
+        .order_by(Change.seq) \
+        .limit(limit) \
+        .yield_per(app.config['CHANGES_FETCH_SIZE'])
+
+def write_changes(since, limit):
+    '''
+    Yield {"changes": [...], "next": seq, "more": bool}, next is the
+    since of the following request.
+    '''
+    yield '{"changes": ['
+    count, last = 0, since
+    for change in changes_since(since, limit):
+        yield (',' if count else '') + json.dumps(change_data(change))
+        count, last = count + 1, change.seq
+    yield '], "next": {}, "more": {}}}'.format(
+        last, json.dumps(count == limit))
@@ -0,0 +1,175 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import threading
+import time
+import zlib
+from flask import request
+from . import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --------------------- Compression configuration --------------------
+app.config.setdefault('COMPRESS_ENABLED', True)
+app.config.setdefault('COMPRESS_MIMETYPES', [
+    'text/html', 'text/css', 'text/xml', 'text/plain',
+    'application/json', 'application/javascript',
+    'application/atom+xml', 'application/rss+xml'])
+# responses smaller than this are sent as is, gzip overhead is ~20 bytes
+app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+# 1 is fastest, 9 is smallest. 6 is zlib's default trade off.
+app.config.setdefault('COMPRESS_LEVEL', 6)
+# brotli quality goes 0 - 11, 11 is far too slow for dynamic pages.
+app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+# --------------------- End of Compression configuration -------------
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+        _stats.update({
+            'responses': 0,
+            'skipped': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'wall_seconds': 0.0})
+
+def get_stats():
+    '''
+    Snapshot of the compression counters, wall_seconds is the wall clock
+    time spent inside the compressors. It includes waits for the GIL,
+    python 2 can't tell one thread's cpu time.
+    '''
+    with _stats_lock:
+        return dict(_stats)
+
+def _record(bytes_in, bytes_out, wall_seconds):
+    with _stats_lock:
+        _stats['responses'] += 1
+        _stats['bytes_in'] += bytes_in
+        _stats['bytes_out'] += bytes_out
+        _stats['wall_seconds'] += wall_seconds
+
+def _record_skip():
+    with _stats_lock:
+        _stats['skipped'] += 1
+
+reset_stats()
+
+######################################################################
+# Pick an encoding from the Accept-Encoding header
+######################################################################
+def choose_encoding(accept_encodings):
+    gzip_q = accept_encodings['gzip']
+    br_q = accept_encodings['br'] if brotli is not None else 0
+    if br_q > 0 and br_q >= gzip_q:
+        return 'br'
+    if gzip_q > 0:
+        return 'gzip'
+    return None
+
+def _compressor(encoding):
+    if encoding == 'br':
+        return brotli.Compressor(quality=app.config['COMPRESS_BR_LEVEL'])
+    # wbits of 16 + MAX_WBITS asks zlib for a gzip header and trailer
+    return zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED,
+                            16 + zlib.MAX_WBITS)
+
+def _finish(compressor, encoding):
+    if encoding == 'br':
+        return compressor.finish()
+    return compressor.flush()
+
+def compress_bytes(data, encoding):
+    started = time.time()
+    compressor = _compressor(encoding)
+    body = compressor.process(data) if encoding == 'br' \
+        else compressor.compress(data)
+    body += _finish(compressor, encoding)
+    _record(len(data), len(body), time.time() - started)
+    return body
+
+def compress_stream(chunks, encoding):
+    '''
+    Compress an iterable of chunks lazily, used for streamed responses
+    so the body never has to be buffered in memory.
+    '''
+    compressor = _compressor(encoding)
+    bytes_in, bytes_out, seconds = 0, 0, 0.0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        started = time.time()
+        out = compressor.process(chunk) if encoding == 'br' \
+            else compressor.compress(chunk)
+        seconds += time.time() - started
+        bytes_in += len(chunk)
+        if out:
+            bytes_out += len(out)
+            yield out
+    started = time.time()
+    out = _finish(compressor, encoding)
+    seconds += time.time() - started
+    bytes_out += len(out)
+    _record(bytes_in, bytes_out, seconds)
+    yield out
+
+def _should_compress(response):
+    if not app.config['COMPRESS_ENABLED']:
+        return False
+    if response.status_code < 200 or response.status_code >= 300 \
+        or response.status_code == 204:
+        return False
+    # send_file and static files set direct_passthrough, they are either
+    # already compressed (images, fonts) or better served by the proxy.
+    if response.direct_passthrough:
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    if response.mimetype not in app.config['COMPRESS_MIMETYPES']:
+        return False
+    return True
+
+######################################################################
+# Compress the response body when the client supports it
+######################################################################
+@app.after_request
+def compress_response(response):
+    if not _should_compress(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            _record_skip()
+            return response
+        response.set_data(compress_bytes(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # the compressed body is a different representation of the resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
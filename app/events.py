@@ -0,0 +1,168 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import json
+import threading
+import time
+from collections import deque
+from flask import request, jsonify, Response, url_for
+from flask_login import login_required
+from werkzeug.exceptions import NotFound
+from models import db, Resource
+from tenants import current_tenant
+from . import app
+
+# --------------------- Events configuration -------------------------
+# events kept per channel for clients that reconnect or poll
+app.config.setdefault('EVENTS_HISTORY', 100)
+# seconds between keep alive comments on an idle stream
+app.config.setdefault('EVENTS_HEARTBEAT', 15)
+# a stream is closed after this many seconds and the browser reconnects
+# with Last-Event-ID, so a worker is never held forever
+app.config.setdefault('EVENTS_STREAM_TIMEOUT', 300)
+# how long a long-poll request waits for an event
+app.config.setdefault('EVENTS_POLL_TIMEOUT', 25)
+# pages only open a stream with async workers, every open page would
+# hold a sync worker. Without it they show what was there on load
+app.config.setdefault('EVENTS_STREAM', False)
+# --------------------- End of Events configuration ------------------
+
+RESET = 'reset'
+
+
+class Hub(object):
+    '''
+    In-process publish/subscribe hub. Each channel keeps a bounded
+    history of (id, event, data), subscribers remember the last id they
+    saw and block until something newer shows up. Event ids are unique
+    across channels of one process.
+    '''
+    def __init__(self, history=100):
+        self.history = history
+        self.last_id = 0
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def _channel(self, name):
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = {
+                'events': deque(maxlen=self.history),
+                'evicted': 0,
+                'cond': threading.Condition(self._lock)}
+        return channel
+
+    def publish(self, name, event, data):
+        with self._lock:
+            channel = self._channel(name)
+            self.last_id += 1
+            if len(channel['events']) == channel['events'].maxlen:
+                channel['evicted'] = channel['events'][0][0]
+            channel['events'].append((self.last_id, event, data))
+            channel['cond'].notify_all()
+            return self.last_id
+
+    def since(self, name, last_id):
+        '''
+        Events newer than last_id. A client that missed evicted events,
+        or holds an id from before a restart, gets a single reset event
+        and should reload its view.
+        '''
+        channel = self._channel(name)
+        if last_id > self.last_id or last_id < channel['evicted']:
+            return [(self.last_id, RESET, {})]
+        return [e for e in channel['events'] if e[0] > last_id]
+
+    def wait(self, name, last_id, timeout):
+        deadline = time.time() + timeout
+        with self._lock:
+            channel = self._channel(name)
+            while True:
+                events = self.since(name, last_id)
+                remaining = deadline - time.time()
+                if events or remaining <= 0:
+                    return events
+                channel['cond'].wait(remaining)
+
+
+hub = Hub(app.config['EVENTS_HISTORY'])
+
+def resource_channel(id):
+    tenant = current_tenant()
+    if tenant is None:
+        return 'resource:{}'.format(id)
+    return '{}:resource:{}'.format(tenant, id)
+
+def events_url_for(id):
+    '''
+    The stream a resource page should follow, None when pages don't
+    stream.
+    '''
+    if not app.config['EVENTS_STREAM']:
+        return None
+    return url_for('resource_events', id=id)
+
+def reservation_data(reservation):
+    return {'id': reservation.id,
+            'start_time': reservation.start_time.strftime('%Y-%m-%d %H:%M'),
+            'end_time': reservation.end_time.strftime('%Y-%m-%d %H:%M'),
+            'duration': reservation.duration}
+
+def format_event(event_id, event, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event_id, event, json.dumps(data))
+
+def stream_events(name, last_id, heartbeat, timeout):
+    deadline = time.time() + timeout
+    # reconnect quickly once the stream is closed on purpose
+    yield 'retry: 3000\n\n'
+    while time.time() < deadline:
+        events = hub.wait(name, last_id,
+                          min(heartbeat, max(deadline - time.time(), 0)))
+        if not events:
+            yield ': keep-alive\n\n'
+        for event_id, event, data in events:
+            last_id = event_id
+            yield format_event(event_id, event, data)
+
+######################################################################
+# Live reservation changes of a resource, as Server-Sent Events or as
+# a long-poll with ?poll=1&last_id=N
+######################################################################
+@app.route('/resources/<int:id>/events', methods=['GET'])
+@login_required
+def resource_events(id):
+    exists = db.session.query(Resource.id).filter(Resource.id == id).first()
+    if exists is None:
+        raise NotFound("resource with id '{}' was not found.".format(id))
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_id', hub.last_id, type=int)
+    if request.args.get('poll'):
+        events = hub.wait(resource_channel(id), last_id,
+                          app.config['EVENTS_POLL_TIMEOUT'])
+        return jsonify(
+            last_id=events[-1][0] if events else last_id,
+            events=[{'id': event_id, 'event': event, 'data': data}
+                    for event_id, event, data in events])
+    response = Response(
+        stream_events(resource_channel(id), last_id,
+                      app.config['EVENTS_HEARTBEAT'],
+                      app.config['EVENTS_STREAM_TIMEOUT']),
+        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # ask nginx style proxies not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,189 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import heapq
+import math
+import threading
+from datetime import datetime, timedelta
+from models import db, Hold
+from jobs import job, queue
+from tenants import tenant_key
+from . import app
+
+# --------------------- Hold configuration ---------------------------
+# seconds a hold keeps a window for its user
+app.config.setdefault('HOLD_TTL', 120)
+# seconds between purges of expired holds from the database
+app.config.setdefault('HOLD_PURGE_INTERVAL', 600)
+# --------------------- End of Hold configuration --------------------
+
+
+class HoldBook(object):
+    '''
+    Holds placed by this process, by resource, with a heap of expiry
+    times so expired ones are dropped without a scan. Holds of other
+    processes are only in the hold table. A hold released elsewhere may
+    linger here until it expires, it then only turns people away early.
+    '''
+    def __init__(self):
+        self._holds = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expires, key, hold_id = heapq.heappop(self._heap)
+            holds = self._holds.get(key)
+            if holds is not None:
+                holds.pop(hold_id, None)
+                if not holds:
+                    del self._holds[key]
+
+    def add(self, hold):
+        # ids of different tenants collide, so keys carry the tenant
+        key = tenant_key(hold.resource_id)
+        with self._lock:
+            self._holds.setdefault(key, {})[hold.id] = \
+                (tenant_key(hold.user_id), hold.start_time, hold.end_time,
+                 hold.expires_at)
+            heapq.heappush(self._heap, (hold.expires_at, key, hold.id))
+
+    def remove(self, resource_id, hold_id):
+        with self._lock:
+            holds = self._holds.get(tenant_key(resource_id), {})
+            holds.pop(hold_id, None)
+
+    def remove_resource(self, resource_id):
+        with self._lock:
+            self._holds.pop(tenant_key(resource_id), None)
+
+    def remove_user(self, user_id):
+        user = tenant_key(user_id)
+        with self._lock:
+            for holds in self._holds.values():
+                for hold_id, hold in holds.items():
+                    if hold[0] == user:
+                        del holds[hold_id]
+
+    def conflict(self, resource_id, start, end, user_id, now):
+        '''
+        When the latest hold of another user on [start, end) expires,
+        None if there is none.
+        '''
+        user = tenant_key(user_id)
+        with self._lock:
+            self._expire(now)
+            expires = [hold_expires for hold_user, hold_start, hold_end,
+                       hold_expires in self._holds.get(
+                           tenant_key(resource_id), {}).values()
+                       if hold_user != user and hold_end > start
+                       and hold_start < end]
+        return max(expires) if expires else None
+
+    def clear(self):
+        with self._lock:
+            self._holds.clear()
+            del self._heap[:]
+
+
+book = HoldBook()
+
+def held_until(resource_id, start, end, user_id, now=None):
+    '''
+    When another user's hold on the window expires, None if it is not
+    held. This process's holds answer first, the indexed hold table
+    covers the other processes.
+    '''
+    now = now or datetime.now()
+    expires = book.conflict(resource_id, start, end, user_id, now)
+    if expires is not None:
+        return expires
+    return db.session.query(Hold.expires_at) \
+        .filter(Hold.resource_id == resource_id) \
+        .filter(Hold.end_time > start) \
+        .filter(Hold.start_time < end) \
+        .filter(Hold.expires_at > now) \
+        .filter(Hold.user_id != user_id) \
+        .order_by(Hold.expires_at.desc()) \
+        .limit(1).scalar()
+
+def held_message(expires, now=None):
+    seconds = (expires - (now or datetime.now())).total_seconds()
+    return "That time is held by another user, try again in {} seconds" \
+        .format(int(math.ceil(max(seconds, 1))))
+
+def add_hold(resource_id, user_id, start, end, now=None):
+    '''
+    Hold the window for user_id, replacing their other holds, a user
+    books one thing at a time. The caller checks the window first.
+    '''
+    now = now or datetime.now()
+    db.session.query(Hold).filter(Hold.user_id == user_id) \
+        .delete(synchronize_session=False)
+    hold = Hold(resource_id=resource_id, user_id=user_id,
+                start_time=start, end_time=end,
+                expires_at=now + timedelta(seconds=app.config['HOLD_TTL']))
+    db.session.add(hold)
+    db.session.commit()
+    book.remove_user(user_id)
+    book.add(hold)
+    return hold
+
+def take_hold(hold_id, user_id, now=None):
+    '''
+    Delete the user's hold if it is still valid and return it, None
+    otherwise. The caller commits together with what replaces it.
+    '''
+    now = now or datetime.now()
+    hold = db.session.query(Hold).filter(Hold.id == hold_id) \
+        .filter(Hold.user_id == user_id) \
+        .filter(Hold.expires_at > now).first()
+    if hold is None:
+        return None
+    # the conditional delete decides between two confirms of one hold
+    deleted = db.session.query(Hold).filter(Hold.id == hold_id) \
+        .filter(Hold.expires_at > now) \
+        .delete(synchronize_session=False)
+    if deleted != 1:
+        return None
+    book.remove(hold.resource_id, hold.id)
+    return hold
+
+def release_hold(hold_id, user_id):
+    hold = db.session.query(Hold).filter(Hold.id == hold_id) \
+        .filter(Hold.user_id == user_id).first()
+    if hold is None:
+        return False
+    db.session.delete(hold)
+    db.session.commit()
+    book.remove(hold.resource_id, hold.id)
+    return True
+
+def delete_holds(resource_id):
+    '''Delete every hold on the resource, the caller commits.'''
+    db.session.query(Hold).filter(Hold.resource_id == resource_id) \
+        .delete(synchronize_session=False)
+
+def forget_holds(resource_id):
+    # after delete_holds committed
+    book.remove_resource(resource_id)
+
+@job('purge_holds')
+def purge_holds():
+    db.session.query(Hold).filter(Hold.expires_at <= datetime.now()) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+
+queue.every(app.config['HOLD_PURGE_INTERVAL'], 'purge_holds')
@@ -0,0 +1,211 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import time
+from datetime import date, datetime, timedelta
+from flask import request, Response, stream_with_context, url_for, abort
+from flask_login import current_user
+from sqlalchemy import func
+from itsdangerous import URLSafeSerializer, BadSignature
+from werkzeug.exceptions import NotFound
+from models import db, Resource, User, Reservation
+from tenants import current_tenant, use_tenant
+from . import app
+
+# --------------------- iCalendar configuration ----------------------
+# days of past reservations kept in a feed
+app.config.setdefault('ICS_PAST_DAYS', 30)
+# rows fetched per round trip while streaming
+app.config.setdefault('ICS_FETCH_SIZE', 500)
+# --------------------- End of iCalendar configuration ---------------
+
+######################################################################
+# Versions, bumped in the transaction that takes reservations out of a
+# feed. Bookings only add rows with a higher id, the ETag names the
+# highest id in the feed so booking doesn't write to hot rows
+######################################################################
+def bump_versions(resource_ids=(), user_ids=()):
+    '''
+    Invalidate the feeds of these resources and users, the caller
+    commits together with the change.
+    '''
+    for model, ids in ((Resource, resource_ids), (User, user_ids)):
+        ids = sorted(set(ids))
+        if ids:
+            db.session.query(model).filter(model.id.in_(ids)) \
+                .update({model.version: model.version + 1},
+                        synchronize_session=False)
+
+def bump_all_versions():
+    for model in (Resource, User):
+        db.session.query(model) \
+            .update({model.version: model.version + 1},
+                    synchronize_session=False)
+
+######################################################################
+# Feed urls, calendar clients can't log in so the url carries a token
+######################################################################
+def serializer():
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='ics')
+
+def feed_url(kind, id):
+    # the token names the tenant too, the feed is read without a session
+    tenant = current_tenant()
+    token = [kind, id] if tenant is None else [kind, id, tenant]
+    return url_for('{}_ics'.format(kind), id=id,
+                   token=serializer().dumps(token), _external=True)
+
+def authorized(kind, id):
+    if 'token' not in request.args:
+        return current_user.is_authenticated and \
+            (kind == 'resource' or current_user.id == id)
+    try:
+        token = serializer().loads(request.args['token'])
+    except BadSignature:
+        return False
+    if token[:2] != [kind, id]:
+        return False
+    try:
+        use_tenant(token[2] if len(token) > 2 else None)
+    except KeyError:
+        return False
+    return True
+
+######################################################################
+# Writer
+######################################################################
+def escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;') \
+        .replace(',', '\\,').replace('\n', '\\n')
+
+def fold(line):
+    '''
+    Lines longer than 75 octets continue on the next line after a
+    space, RFC 5545 3.1.
+    '''
+    line = line.encode('utf-8') if isinstance(line, unicode) else line
+    parts = []
+    while len(line) > 75:
+        cut = 75 if not parts else 74
+        # don't split a utf-8 sequence
+        while cut > 0 and (ord(line[cut]) & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return '\r\n '.join(parts) + '\r\n'
+
+def utc(value):
+    # naive local time to an iCalendar UTC date-time
+    return datetime.utcfromtimestamp(time.mktime(value.timetuple())) \
+        .strftime('%Y%m%dT%H%M%SZ')
+
+def write_calendar(name, rows, summary):
+    '''
+    Yield the calendar a line at a time. rows are (id, resource_name,
+    start_time, end_time, create_time).
+    '''
+    host = request.host
+    base = request.host_url
+    yield fold('BEGIN:VCALENDAR')
+    yield fold('VERSION:2.0')
+    yield fold('PRODID:-//open-everything//reservations//EN')
+    yield fold('X-WR-CALNAME:' + escape(name))
+    for id, resource_name, start, end, created in rows:
+        yield fold('BEGIN:VEVENT')
+        yield fold('UID:reservation-{}@{}'.format(id, host))
+        yield fold('DTSTAMP:' + utc(created or start))
+        yield fold('DTSTART:' + utc(start))
+        yield fold('DTEND:' + utc(end))
+        yield fold('SUMMARY:' + escape(summary(id, resource_name)))
+        yield fold('URL:{}reservations/{}'.format(base, id))
+        yield fold('END:VEVENT')
+    yield fold('END:VCALENDAR')
+
+def feed_start():
+    return datetime.combine(
+        date.today() - timedelta(days=app.config['ICS_PAST_DAYS']),
+        datetime.min.time())
+
+def latest_reservation(criterion, since):
+    # a subquery, read in the same round trip as the version
+    return db.session.query(func.max(Reservation.id)) \
+        .filter(criterion).filter(Reservation.end_time > since).as_scalar()
+
+def feed_response(kind, id, version, latest, since, name, criterion,
+                  summary):
+    '''
+    304 when the client has this version of the feed, otherwise stream
+    it from one range query on the (..., end_time) index.
+    '''
+    # the window moves daily, so the day is part of the version
+    etag = '{}-{}-{}.{}-{}'.format(kind, id, version, latest or 0,
+                                   since.date().isoformat())
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        rows = db.session.query(Reservation.id, Reservation.resource_name,
+                                Reservation.start_time, Reservation.end_time,
+                                Reservation.create_time) \
+            .filter(criterion) \
+            .filter(Reservation.end_time > since) \
+            .order_by(Reservation.start_time) \
+            .yield_per(app.config['ICS_FETCH_SIZE'])
+        response = Response(
+            stream_with_context(write_calendar(name, rows, summary)),
+            mimetype='text/calendar')
+        response.headers['Content-Disposition'] = \
+            'inline; filename={}-{}.ics'.format(kind, id)
+    response.set_etag(etag)
+    # clients may keep it but must revalidate, which costs one lookup
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+######################################################################
+# Feeds, /resources/<id>/reservations.ics and /users/<id>/reservations.ics
+######################################################################
+@app.route('/resources/<int:id>/reservations.ics', methods=['GET'])
+def resource_ics(id):
+    if not authorized('resource', id):
+        abort(403)
+    since = feed_start()
+    criterion = Reservation.resource_id == id
+    row = db.session.query(Resource.version,
+                           latest_reservation(criterion, since),
+                           Resource.name) \
+        .filter(Resource.id == id).first()
+    if row is None:
+        raise NotFound("resource with id '{}' was not found.".format(id))
+    version, latest, name = row
+    return feed_response('resource', id, version, latest, since, name,
+                         criterion,
+                         lambda id, resource_name: 'Reservation ' + str(id))
+
+@app.route('/users/<int:id>/reservations.ics', methods=['GET'])
+def user_ics(id):
+    if not authorized('user', id):
+        abort(403)
+    since = feed_start()
+    criterion = Reservation.user_id == id
+    row = db.session.query(User.version,
+                           latest_reservation(criterion, since)) \
+        .filter(User.id == id).first()
+    if row is None:
+        raise NotFound("user with id '{}' was not found.".format(id))
+    version, latest = row
+    return feed_response('user', id, version, latest, since,
+                         'My reservations', criterion,
+                         lambda id, resource_name:
+                             'Reservation with ' + (resource_name or ''))
@@ -0,0 +1,331 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from flask import has_app_context
+from tenants import current_tenant, use_tenant, tenant_names
+from . import app
+
+# --------------------- Job queue configuration ----------------------
+app.config.setdefault('JOBS_DATABASE',
+                      os.path.join(app.root_path, 'db', 'jobs.db'))
+app.config.setdefault('JOBS_WORKERS', 2)
+# enqueue refuses new jobs past this many pending ones (backpressure)
+app.config.setdefault('JOBS_MAX_PENDING', 1000)
+app.config.setdefault('JOBS_MAX_ATTEMPTS', 3)
+# first retry waits this many seconds, doubled on every further attempt
+app.config.setdefault('JOBS_RETRY_DELAY', 5)
+app.config.setdefault('JOBS_POLL_INTERVAL', 0.5)
+# a running job not finished after this many seconds is assumed lost
+app.config.setdefault('JOBS_LOCK_TIMEOUT', 300)
+# run jobs inline in the caller, used by the tests
+app.config.setdefault('JOBS_EAGER', False)
+# --------------------- End of Job queue configuration ---------------
+
+log = logging.getLogger(__name__)
+
+# payload key of the tenant a job runs for
+TENANT_KEY = '_tenant'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL,
+    payload TEXT NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_at REAL NOT NULL,
+    locked_at REAL,
+    last_error TEXT,
+    dedupe_key VARCHAR(200) UNIQUE
+);
+CREATE INDEX IF NOT EXISTS ix_job_status_run_at ON job (status, run_at);
+'''
+
+
+class QueueFull(Exception):
+    '''
+    Raised by enqueue when the number of pending jobs passed
+    JOBS_MAX_PENDING.
+    '''
+    pass
+
+
+class JobQueue(object):
+    '''
+    In-process background worker pool backed by a sqlite job table.
+    Jobs survive restarts, failed jobs are retried with exponential
+    backoff and periodic jobs are scheduled without cron.
+    '''
+    def __init__(self):
+        self.handlers = {}
+        self.periodic = []
+        self.threads = []
+        self.path = None
+        self.eager = False
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stop_at_exit = False
+
+    def init_app(self, app):
+        self.path = app.config['JOBS_DATABASE']
+        self.eager = app.config['JOBS_EAGER']
+        self.workers = app.config['JOBS_WORKERS']
+        self.max_pending = app.config['JOBS_MAX_PENDING']
+        self.max_attempts = app.config['JOBS_MAX_ATTEMPTS']
+        self.retry_delay = app.config['JOBS_RETRY_DELAY']
+        self.poll_interval = app.config['JOBS_POLL_INTERVAL']
+        self.lock_timeout = app.config['JOBS_LOCK_TIMEOUT']
+        if not self.eager:
+            self.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_table(self):
+        conn = self.connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    ##################################################################
+    # Registration
+    ##################################################################
+    def register(self, name, func):
+        self.handlers[name] = func
+
+    def job(self, name):
+        def decorator(func):
+            self.register(name, func)
+            return func
+        return decorator
+
+    def every(self, seconds, name, payload=None, per_tenant=True):
+        '''
+        Enqueue job 'name' every 'seconds', for every tenant unless the
+        job has nothing to do with their data. The dedupe key makes sure
+        several processes only enqueue one job per period.
+        '''
+        self.periodic.append((seconds, name, payload or {}, per_tenant))
+
+    ##################################################################
+    # Producer side
+    ##################################################################
+    def enqueue(self, name, payload=None, delay=0, max_attempts=None,
+                dedupe_key=None):
+        if name not in self.handlers:
+            raise KeyError('Unknown job: ' + name)
+        conn = self.connect()
+        try:
+            if dedupe_key is None:
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM job WHERE status = 'pending'"
+                    ).fetchone()[0]
+                if pending >= self.max_pending:
+                    raise QueueFull('{} jobs pending'.format(pending))
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO job (name, payload, max_attempts, '
+                'run_at, dedupe_key) VALUES (?, ?, ?, ?, ?)',
+                (name, json.dumps(payload or {}),
+                 max_attempts or self.max_attempts,
+                 time.time() + delay, dedupe_key))
+            return cursor.lastrowid if cursor.rowcount else None
+        finally:
+            conn.close()
+
+    def defer(self, name, **payload):
+        '''
+        Run job 'name' in the background. Falls back to running it in
+        the caller when the queue is eager or full, so a side effect is
+        never lost. The job runs for the caller's tenant.
+        '''
+        if current_tenant() is not None:
+            payload[TENANT_KEY] = current_tenant()
+        if not self.eager:
+            try:
+                return self.enqueue(name, payload)
+            except QueueFull:
+                log.warning('job queue full, running %s inline', name)
+        self.run_handler(name, payload)
+
+    def pending_count(self):
+        conn = self.connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM job WHERE status = 'pending'"
+                ).fetchone()[0]
+        finally:
+            conn.close()
+
+    ##################################################################
+    # Consumer side
+    ##################################################################
+    def run_handler(self, name, payload):
+        payload = dict(payload)
+        tenant = payload.pop(TENANT_KEY, None)
+        if has_app_context() and tenant == current_tenant():
+            return self.handlers[name](**payload)
+        with app.app_context():
+            use_tenant(tenant)
+            return self.handlers[name](**payload)
+
+    def claim(self):
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM job WHERE status = 'pending' AND run_at <= ? "
+                "ORDER BY run_at LIMIT 1", (time.time(),)).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job SET status = 'running', locked_at = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (time.time(), row['id']))
+            conn.execute('COMMIT')
+            return row
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def run_one(self):
+        row = self.claim()
+        if row is None:
+            return False
+        conn = self.connect()
+        try:
+            try:
+                self.run_handler(row['name'], json.loads(row['payload']))
+            except Exception:
+                attempts = row['attempts'] + 1
+                error = traceback.format_exc()
+                log.error('job %s #%d failed: %s', row['name'], row['id'],
+                          error)
+                if attempts >= row['max_attempts']:
+                    conn.execute(
+                        "UPDATE job SET status = 'failed', last_error = ? "
+                        "WHERE id = ?", (error, row['id']))
+                else:
+                    backoff = self.retry_delay * 2 ** (attempts - 1)
+                    conn.execute(
+                        "UPDATE job SET status = 'pending', locked_at = NULL, "
+                        "run_at = ?, last_error = ? WHERE id = ?",
+                        (time.time() + backoff, error, row['id']))
+            else:
+                conn.execute('DELETE FROM job WHERE id = ?', (row['id'],))
+        finally:
+            conn.close()
+        return True
+
+    def run_pending(self):
+        count = 0
+        while self.run_one():
+            count += 1
+        return count
+
+    def schedule_periodic(self, now=None):
+        '''Enqueue the periodic jobs due next.'''
+        now = now or time.time()
+        for seconds, name, payload, per_tenant in self.periodic:
+            slot = int(now // seconds)
+            self.enqueue(name, payload,
+                         delay=(slot + 1) * seconds - now,
+                         dedupe_key='{}:{}'.format(name, slot))
+            for tenant in (tenant_names() if per_tenant else ()):
+                self.enqueue(name, dict(payload, **{TENANT_KEY: tenant}),
+                             delay=(slot + 1) * seconds - now,
+                             dedupe_key='{}:{}:{}'.format(name, tenant, slot))
+
+    def requeue_lost(self):
+        conn = self.connect()
+        try:
+            conn.execute(
+                "UPDATE job SET status = 'pending', locked_at = NULL "
+                "WHERE status = 'running' AND locked_at < ?",
+                (time.time() - self.lock_timeout,))
+        finally:
+            conn.close()
+
+    ##################################################################
+    # Worker threads
+    ##################################################################
+    def start(self):
+        with self._lock:
+            if self.threads:
+                return
+            self.create_table()
+            self.requeue_lost()
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          args=(i == 0,),
+                                          name='job-worker-{}'.format(i))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            # stop the workers before the interpreter tears modules down,
+            # registered once however often the queue is restarted
+            if not self._stop_at_exit:
+                atexit.register(self.stop, 5)
+                self._stop_at_exit = True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def _work(self, scheduler):
+        while not self._stop.is_set():
+            try:
+                if scheduler:
+                    self.schedule_periodic()
+                if self.run_one():
+                    continue
+            except Exception:
+                log.exception('job worker error')
+            self._stop.wait(self.poll_interval)
+
+
+queue = JobQueue()
+job = queue.job
+defer = queue.defer
+
+######################################################################
+# Remove jobs that ran out of attempts after a week
+######################################################################
+@job('purge_failed_jobs')
+def purge_failed_jobs(max_age=7 * 24 * 3600):
+    conn = queue.connect()
+    try:
+        conn.execute(
+            "DELETE FROM job WHERE status = 'failed' AND run_at < ?",
+            (time.time() - max_age,))
+    finally:
+        conn.close()
+
+queue.every(24 * 3600, 'purge_failed_jobs', per_tenant=False)
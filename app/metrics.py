@@ -0,0 +1,404 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import bisect
+import errno
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from flask import request, g, Response, abort
+from flask_login import current_user
+from timeparse import to_minutes
+from . import app
+
+# --------------------- Metrics configuration ------------------------
+app.config.setdefault('METRICS_ENABLED', True)
+# a scraper sends 'Authorization: Bearer <token>', admins get in
+# without it
+app.config.setdefault('METRICS_TOKEN', None)
+# upper bounds of the histogram buckets, in seconds
+app.config.setdefault('METRICS_LATENCY_BUCKETS',
+                      (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                       2.5, 5.0, 10.0))
+app.config.setdefault('METRICS_BCRYPT_BUCKETS',
+                      (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0))
+# every worker process writes its values to a file of this directory,
+# /metrics adds them up. The files of exited workers are folded into
+# one, gunicorn_config.py empties it when gunicorn starts. None reports
+# the serving process only.
+app.config.setdefault('METRICS_DIR', None)
+# seconds between two writes of a worker's file
+app.config.setdefault('METRICS_WRITE_INTERVAL', 5)
+# --------------------- End of Metrics configuration -----------------
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = []
+
+######################################################################
+# Counters, gauges and histograms. An update holds the metric's lock
+# for a couple of dict operations, nothing else is done under it.
+######################################################################
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def collect_from(self, func):
+        '''
+        func returns [(labels, value)] when the metric is read, for
+        values another module already keeps.
+        '''
+        self._collectors.append(func)
+        return func
+
+    def values(self):
+        '''{label values: value} of this process.'''
+        with self._lock:
+            values = dict((key, self.copy(value))
+                          for key, value in self._values.items())
+        for func in self._collectors:
+            for labels, value in func():
+                key = self.key(labels)
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def copy(self, value):
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    '''
+    Observations counted in the buckets of a config key, the bucket
+    bounds are read once per process.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        Metric.__init__(self, name, help, labels)
+        self.buckets_key = buckets
+        self.buckets = None
+
+    def observe(self, value, **labels):
+        if self.buckets is None:
+            self.buckets = tuple(app.config[self.buckets_key])
+        # value <= bound falls in bound's bucket, the last one is +Inf
+        i = bisect.bisect_left(self.buckets, value)
+        key = self.key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = \
+                    [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][i] += 1
+            counts[1] += value
+
+    def copy(self, value):
+        return [list(value[0]), value[1]]
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+
+class Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.time() - self.start, **self.labels)
+
+
+######################################################################
+# Metrics of the whole app, modules add their own next to the code
+######################################################################
+request_latency = Histogram(
+    'http_request_duration_seconds',
+    'Time until a response is returned, by Flask endpoint.',
+    ('endpoint',), 'METRICS_LATENCY_BUCKETS')
+requests_total = Counter(
+    'http_requests_total', 'Responses by Flask endpoint and status.',
+    ('endpoint', 'status'))
+requests_in_flight = Gauge(
+    'http_requests_in_flight', 'Requests being handled.')
+booking_rejections = Counter(
+    'booking_rejections_total',
+    'Bookings and holds turned away, by the check that failed: hold, '
+    'valid_res or valid_user_time.',
+    ('check',))
+bcrypt_latency = Histogram(
+    'bcrypt_duration_seconds',
+    'Time spent hashing and checking passwords.',
+    ('op',), 'METRICS_BCRYPT_BUCKETS')
+cache_lookups = Counter(
+    'cache_lookups_total', 'Cache lookups by cache and hit or miss.',
+    ('cache', 'result'))
+
+@cache_lookups.collect_from
+def collect_time_cache():
+    info = to_minutes.cache_info()
+    return [({'cache': 'to_minutes', 'result': 'hit'}, info['hits']),
+            ({'cache': 'to_minutes', 'result': 'miss'}, info['misses'])]
+
+######################################################################
+# Snapshots, written by every worker and added up
+######################################################################
+def snapshot():
+    metrics = {}
+    for metric in registry:
+        metrics[metric.name] = {
+            'kind': metric.kind,
+            'help': metric.help,
+            'labels': metric.labels,
+            'buckets': getattr(metric, 'buckets', None),
+            'values': [[list(key), value] for key, value
+                       in metric.values().items()]}
+    return {'pid': os.getpid(), 'metrics': metrics}
+
+def load_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def save_snapshot(path, data):
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    # a reader sees the old file or the new one, never half of it
+    os.rename(temp, path)
+
+def worker_path(directory, pid):
+    return os.path.join(directory, 'metrics-{}.json'.format(pid))
+
+def write_snapshot(directory):
+    save_snapshot(worker_path(directory, os.getpid()), snapshot())
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def read_snapshots(directory):
+    '''
+    This process's snapshot and the files of the other workers. The
+    counters of workers that are gone are added to one file for all of
+    them and their own files removed, their gauges no longer hold.
+    '''
+    snapshots = [snapshot()]
+    exited_path = os.path.join(directory, 'metrics-exited.json')
+    # one reader at a time, or two would add up the same dead worker
+    with open(os.path.join(directory, 'metrics-lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = load_snapshot(exited_path) or {'pid': None, 'metrics': {}}
+        dead = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            data = None if path == exited_path else load_snapshot(path)
+            if data is None or data['pid'] == os.getpid():
+                continue
+            if is_running(data['pid']):
+                snapshots.append(data)
+                continue
+            data['metrics'] = dict(
+                (name, metric) for name, metric in data['metrics'].items()
+                if metric['kind'] != 'gauge')
+            exited = as_snapshot(merge([exited, data]))
+            dead.append(path)
+        if dead:
+            save_snapshot(exited_path, exited)
+            for path in dead:
+                os.remove(path)
+    snapshots.append(exited)
+    return snapshots
+
+def merge(snapshots):
+    '''{name: (metric, {label values: value})} added up.'''
+    merged = {}
+    for data in snapshots:
+        for name, metric in data['metrics'].items():
+            _, values = merged.setdefault(name, (metric, {}))
+            for key, value in metric['values']:
+                key = tuple(key)
+                if key not in values:
+                    values[key] = value
+                elif metric['kind'] == 'histogram':
+                    total = values[key]
+                    values[key] = [[a + b for a, b in zip(total[0], value[0])],
+                                   total[1] + value[1]]
+                else:
+                    values[key] = values[key] + value
+            if metric['kind'] == 'histogram' and metric['buckets']:
+                merged[name][0]['buckets'] = metric['buckets']
+    return merged
+
+def as_snapshot(merged):
+    '''What merge added up, in the form of a snapshot.'''
+    return {'pid': None, 'metrics': dict(
+        (name, dict(metric, values=[[list(key), value]
+                                    for key, value in values.items()]))
+        for name, (metric, values) in merged.items())}
+
+######################################################################
+# Prometheus text format
+######################################################################
+def escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value))
+                          for name, value in zip(names, values)) + '}'
+
+def format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+def exposition(merged):
+    lines = []
+    for name in sorted(merged):
+        metric, values = merged[name]
+        lines.append('# HELP {} {}'.format(name, metric['help']))
+        lines.append('# TYPE {} {}'.format(name, metric['kind']))
+        labels = tuple(metric['labels'])
+        for key in sorted(values):
+            value = values[key]
+            if metric['kind'] != 'histogram':
+                lines.append('{}{} {}'.format(
+                    name, format_labels(labels, key), format_value(value)))
+                continue
+            counts, total = value
+            cumulative = 0
+            bounds = list(metric['buckets']) + [float('inf')]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + ('le',),
+                                        key + (format_value(float(bound)),)),
+                    cumulative))
+            lines.append('{}_sum{} {}'.format(
+                name, format_labels(labels, key), format_value(total)))
+            lines.append('{}_count{} {}'.format(
+                name, format_labels(labels, key), cumulative))
+    return '\n'.join(lines) + '\n'
+
+######################################################################
+# Every request is timed. Streamed bodies are sent after teardown, the
+# long lived /events streams don't count as in flight.
+######################################################################
+_last_write = [0]
+_write_lock = threading.Lock()
+
+def endpoint():
+    return request.url_rule.endpoint if request.url_rule is not None \
+        else 'unmatched'
+
+@app.before_request
+def start_request():
+    if app.config['METRICS_ENABLED']:
+        g.metrics_start = time.time()
+        requests_in_flight.inc()
+
+@app.after_request
+def count_response(response):
+    if g.get('metrics_start') is not None:
+        g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request(exception=None):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    requests_in_flight.dec()
+    request_latency.observe(time.time() - start, endpoint=endpoint())
+    requests_total.inc(endpoint=endpoint(),
+                       status=g.pop('metrics_status', 500))
+    directory = app.config['METRICS_DIR']
+    if directory and time.time() - _last_write[0] >= \
+        app.config['METRICS_WRITE_INTERVAL'] and \
+        _write_lock.acquire(False):
+        try:
+            _last_write[0] = time.time()
+            write_snapshot(directory)
+        finally:
+            _write_lock.release()
+
+######################################################################
+# /metrics
+######################################################################
+def allowed():
+    token = app.config['METRICS_TOKEN']
+    if token is not None and request.headers.get('Authorization') == \
+        'Bearer ' + token:
+        return True
+    # bulk.is_admin, bulk can't be imported this early
+    return current_user.is_authenticated and \
+        current_user.email in app.config['ADMIN_EMAILS']
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    if not allowed():
+        abort(403)
+    directory = app.config['METRICS_DIR']
+    snapshots = read_snapshots(directory) if directory else [snapshot()]
+    return Response(exposition(merge(snapshots)), mimetype=None,
+                    content_type=CONTENT_TYPE)
@@ -0,0 +1,295 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import time
+import click
+from sqlalchemy import inspect, text, select, func, MetaData, Table, Column, \
+    Integer, BigInteger, String
+from models import db
+from tenants import tenant_names
+from . import app
+
+# --------------------- Migration configuration ----------------------
+# time zone of the web servers, e.g. 'Europe/Paris', that naive DATETIME
+# values were stored in. postgresql and mysql read them in the time zone
+# of their session, None leaves it alone and assumes that is the same.
+# sqlite reads them in the time zone of this process
+app.config.setdefault('MIGRATE_TIME_ZONE', None)
+# --------------------- End of Migration configuration ---------------
+
+class MigrationError(Exception):
+    pass
+
+# columns that moved from naive local DATETIME to EpochDateTime
+EPOCH_COLUMNS = [
+    ('reservation', 'start_time'),
+    ('reservation', 'end_time'),
+    ('reservation', 'create_time'),
+    ('resource', 'last_reserve_time'),
+]
+
+# the stored values are the web server's local time, the databases read
+# them in their session's time zone, see MIGRATE_TIME_ZONE
+CONVERT_SQL = {
+    'sqlite': [
+        "UPDATE {table} SET {column} = "
+        "CAST(strftime('%s', {column}, 'utc') AS INTEGER) "
+        "WHERE typeof({column}) = 'text'"],
+    'postgresql': [
+        "ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT "
+        "USING EXTRACT(EPOCH FROM {column}::timestamptz)::bigint"],
+    'mysql': [
+        "ALTER TABLE {table} ADD COLUMN {column}_epoch BIGINT",
+        "UPDATE {table} SET {column}_epoch = UNIX_TIMESTAMP({column})",
+        "ALTER TABLE {table} DROP COLUMN {column}",
+        "ALTER TABLE {table} CHANGE {column}_epoch {column} BIGINT"],
+}
+
+# sets the session's time zone to :zone for the conversion, and back
+TIME_ZONE_SQL = {
+    'postgresql': ("SELECT set_config('TimeZone', :zone, true)", None),
+    'mysql': ("SET time_zone = :zone", "SET time_zone = DEFAULT"),
+}
+
+def convert_times_to_epoch(engine):
+    '''
+    Rewrite existing DATETIME values as UTC epoch seconds. Safe to run
+    more than once, converted columns are left alone.
+    '''
+    dialect = engine.dialect.name
+    if dialect not in CONVERT_SQL:
+        raise ValueError("don't know how to migrate " + dialect)
+    inspector = inspect(engine)
+    for table, column in EPOCH_COLUMNS:
+        if dialect != 'sqlite':
+            types = dict((col['name'], col['type'])
+                         for col in inspector.get_columns(table))
+            if isinstance(types[column], Integer):
+                continue
+        with engine.begin() as conn:
+            zone = app.config['MIGRATE_TIME_ZONE']
+            set_zone, reset_zone = TIME_ZONE_SQL.get(dialect, (None, None))
+            if zone and set_zone:
+                conn.execute(text(set_zone), zone=zone)
+            try:
+                for sql in CONVERT_SQL[dialect]:
+                    conn.execute(text(sql.format(table=table,
+                                                 column=column)))
+            finally:
+                # the connection goes back to the pool
+                if zone and reset_zone:
+                    conn.execute(text(reset_zone))
+
+def index_ddl(index, dialect):
+    '''
+    CREATE INDEX for a model's index that doesn't take the table offline,
+    postgresql builds it CONCURRENTLY. InnoDB and sqlite need nothing
+    special.
+    '''
+    columns = ', '.join(column.name for column in index.columns)
+    return 'CREATE {}INDEX {}{} ON {} ({})'.format(
+        'UNIQUE ' if index.unique else '',
+        'CONCURRENTLY ' if dialect == 'postgresql' else '',
+        index.name, index.table.name, columns)
+
+def create_missing_indexes(engine, names=None):
+    '''
+    create_all only creates indexes together with a new table, add the
+    ones declared on the models since, or only those in names.
+    '''
+    inspector = inspect(engine)
+    created = []
+    for table in db.Model.metadata.sorted_tables:
+        existing = set(index['name'] for index in
+                       inspector.get_indexes(table.name))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing or \
+                (names is not None and index.name not in names):
+                continue
+            with engine.connect() as conn:
+                if engine.dialect.name == 'postgresql':
+                    # CONCURRENTLY can't run inside a transaction
+                    conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                conn.execute(text(index_ddl(index, engine.dialect.name)))
+            created.append(index.name)
+    return created
+
+def add_missing_columns(engine, columns):
+    '''
+    Add (table, column) pairs declared on the models but not in the
+    database yet, with their server default so existing rows get one.
+    '''
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    for table_name, name in columns:
+        existing = set(col['name'] for col in inspector.get_columns(table_name))
+        if name in existing:
+            continue
+        column = db.Model.metadata.tables[table_name].c[name]
+        ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+            preparer.quote(table_name), preparer.quote(name),
+            column.type.compile(engine.dialect))
+        if column.server_default is not None:
+            ddl += " DEFAULT '{}'".format(column.server_default.arg)
+        if not column.nullable:
+            ddl += ' NOT NULL'
+        with engine.begin() as conn:
+            conn.execute(text(ddl))
+        added.append('{}.{}'.format(table_name, name))
+    return added
+
+######################################################################
+# Backfills, small transactions so the tables stay usable meanwhile
+######################################################################
+def merge_duplicate_tags(engine, batch_size=1000):
+    '''
+    Point the resources of duplicated tag values at the oldest tag and
+    drop the others. Returns the number of tags dropped.
+    '''
+    dropped = 0
+    while True:
+        with engine.begin() as conn:
+            duplicates = conn.execute(text(
+                "SELECT value, MIN(id) FROM tag GROUP BY value "
+                "HAVING COUNT(*) > 1 LIMIT :limit"), limit=batch_size) \
+                .fetchall()
+            for value, keep in duplicates:
+                conn.execute(text(
+                    "UPDATE tag_resource SET tag_id = :keep WHERE tag_id IN "
+                    "(SELECT id FROM tag WHERE value = :value AND id <> :keep)"),
+                    keep=keep, value=value)
+                dropped += conn.execute(text(
+                    "DELETE FROM tag WHERE value = :value AND id <> :keep"),
+                    keep=keep, value=value).rowcount
+        if not duplicates:
+            return dropped
+
+def delete_duplicate_tag_resources(engine, batch_size=1000):
+    '''
+    Keep the oldest row of every (tag_id, resource_id) pair. Returns the
+    number of rows deleted.
+    '''
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            pairs = conn.execute(text(
+                "SELECT tag_id, resource_id, MIN(id) FROM tag_resource "
+                "GROUP BY tag_id, resource_id HAVING COUNT(*) > 1 "
+                "LIMIT :limit"), limit=batch_size).fetchall()
+            for tag_id, resource_id, keep in pairs:
+                deleted += conn.execute(text(
+                    "DELETE FROM tag_resource WHERE tag_id = :tag_id AND "
+                    "resource_id = :resource_id AND id <> :keep"),
+                    tag_id=tag_id, resource_id=resource_id, keep=keep).rowcount
+        if not pairs:
+            return deleted
+
+def check_unique_emails(engine):
+    # two accounts can't be merged automatically, someone has to decide
+    users = db.Model.metadata.tables['user']
+    with engine.connect() as conn:
+        emails = [email for (email,) in conn.execute(
+            select([users.c.email]).group_by(users.c.email)
+            .having(func.count() > 1))]
+    if emails:
+        raise MigrationError("users share an email: " + ", ".join(emails))
+
+def create_lookup_indexes(engine):
+    check_unique_emails(engine)
+    create_missing_indexes(engine)
+
+######################################################################
+# Versioned migrations, applied in order and recorded in schema_version
+######################################################################
+metadata = MetaData()
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100)),
+    Column('applied_at', BigInteger))
+
+# (version, name, upgrade(engine)), every upgrade is safe to run on a
+# database created by create_all, where it has nothing left to do
+MIGRATIONS = [
+    (1, 'epoch times', convert_times_to_epoch),
+    (2, 'reservation indexes', lambda engine: create_missing_indexes(
+        engine, ['ix_reservation_resource_end', 'ix_reservation_user_end'])),
+    (3, 'merge duplicate tags', merge_duplicate_tags),
+    (4, 'delete duplicate tag resources', delete_duplicate_tag_resources),
+    (5, 'lookup indexes', create_lookup_indexes),
+    (6, 'reservation start index', lambda engine: create_missing_indexes(
+        engine, ['ix_reservation_start'])),
+    (7, 'feed versions', lambda engine: add_missing_columns(
+        engine, [('resource', 'version'), ('user', 'version')])),
+    (8, 'upcoming reservation and hold indexes',
+     lambda engine: create_missing_indexes(
+         engine, ['ix_reservation_end', 'ix_hold_user'])),
+]
+
+def applied_versions(engine):
+    metadata.create_all(engine)
+    with engine.connect() as conn:
+        return set(version for (version,) in
+                   conn.execute(select([schema_version.c.version])))
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [migration for migration in MIGRATIONS
+            if migration[0] not in applied]
+
+def upgrade(engine, echo=None):
+    '''
+    Apply the pending migrations in order. A failed one stops the run and
+    stays pending, the ones before it remain recorded.
+    '''
+    applied = []
+    for version, name, upgrade_step in pending_migrations(engine):
+        if echo:
+            echo('{} {}'.format(version, name))
+        upgrade_step(engine)
+        with engine.begin() as conn:
+            conn.execute(schema_version.insert(), version=version, name=name,
+                         applied_at=int(time.time()))
+        applied.append(version)
+    return applied
+
+def databases():
+    '''(name, engine) of the default database and every tenant's.'''
+    yield 'default', db.engine
+    for tenant in tenant_names():
+        yield tenant, db.get_tenant_engine(app, tenant)
+
+@app.cli.command('migrate')
+def migrate_command():
+    '''Bring the database schemas up to date.'''
+    for name, engine in databases():
+        click.echo('{}:'.format(name))
+        try:
+            applied = upgrade(engine, echo=click.echo)
+        except MigrationError as e:
+            raise click.ClickException('{}: {}'.format(name, e))
+        click.echo('applied {} migration(s)'.format(len(applied)))
+
+@app.cli.command('migrate_status')
+def migrate_status_command():
+    '''List the migrations not applied yet.'''
+    for name, engine in databases():
+        click.echo('{}:'.format(name))
+        pending = pending_migrations(engine)
+        for version, migration, _ in pending:
+            click.echo('{} {}'.format(version, migration))
+        if not pending:
+            click.echo('up to date')
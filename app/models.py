@@ -13,17 +13,51 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 ######################################################################
-from flask_sqlalchemy import SQLAlchemy
+import calendar
+import time
 from datetime import datetime
+from sqlalchemy.types import TypeDecorator, BigInteger
+from routing import RoutingSQLAlchemy
+from metrics import bcrypt_latency
 from . import bcrypt
 
-db = SQLAlchemy()
+# reads of replica_reads views go to a replica when one is configured
+db = RoutingSQLAlchemy()
+
+class EpochDateTime(TypeDecorator):
+    '''
+    A point in time stored as UTC seconds since the epoch.
+    The application keeps working with naive datetimes in the server's
+    local time, they are converted on the way in and out so rows written
+    by servers in different time zones still order and compare correctly,
+    and range filters are plain integer comparisons on an index.
+    Aware datetimes are accepted as well.
+    '''
+    impl = BigInteger
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, (int, long)):
+            return value
+        if value.tzinfo is not None:
+            return calendar.timegm(value.utctimetuple())
+        return int(time.mktime(value.timetuple()))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return datetime.fromtimestamp(value)
 
 class Tag_Resource(db.Model):
     '''
     Tag Resource relationship. Used to link resource to tag
     '''
     __tablename__ = "tag_resource"
+    # a resource is tagged once per tag, tags of a resource
+    __table_args__ = (
+        db.Index('ix_tag_resource_tag_resource', 'tag_id', 'resource_id',
+                 unique=True),
+        db.Index('ix_tag_resource_resource', 'resource_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'))
     tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'))
@@ -45,13 +79,20 @@ class Resource(db.Model):
     resource and owner have 1 to 1 relationship.
     '''
     __tablename__ = "resource"
+    # resources of a user
+    __table_args__ = (
+        db.Index('ix_resource_owner', 'owner_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     # time should be hh:mm in 24 hour format
     available_start = db.Column(db.String(5))
     available_end = db.Column(db.String(5))
-    last_reserve_time = db.Column(db.DateTime)
+    last_reserve_time = db.Column(EpochDateTime)
+    # bumped when reservations leave the resource's calendar feed, see ics
+    version = db.Column(db.Integer, nullable=False, default=0,
+                        server_default='0')
     tags = db.relationship('Tag', secondary="tag_resource", lazy='dynamic')
     reservations = db.relationship('Reservation', backref='resource',
                                 lazy='dynamic')
@@ -77,14 +118,23 @@ class Reservation(db.Model):
     reservation and user have 1 to 1 relationship.
     '''
     __tablename__ = "reservation"
+    # upcoming reservations of a resource or a user, see valid_res
+    __table_args__ = (
+        db.Index('ix_reservation_resource_end', 'resource_id', 'end_time'),
+        db.Index('ix_reservation_user_end', 'user_id', 'end_time'),
+        # reservations in a period, see reports
+        db.Index('ix_reservation_start', 'start_time'),
+        # upcoming reservations of every resource, see available_resources
+        db.Index('ix_reservation_end', 'end_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'))
     resource_name = db.Column(db.String(100))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     # duration should be calculate from these column
-    start_time = db.Column(db.DateTime)
-    end_time = db.Column(db.DateTime)
-    create_time = db.Column(db.DateTime)
+    start_time = db.Column(EpochDateTime)
+    end_time = db.Column(EpochDateTime)
+    create_time = db.Column(EpochDateTime)
     duration = db.Column(db.String(5))
 
     def deserialize(self, data):
@@ -109,6 +159,9 @@ class Tag(db.Model):
     tag and resources have many to many relationship.
     '''
     __tablename__ = "tag"
+    __table_args__ = (
+        db.Index('ix_tag_value', 'value', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     # lower case letters
     value = db.Column(db.String(20))
@@ -127,10 +180,17 @@ class User(db.Model):
     user and reservation have 1 to many relationship.
     '''
     __tablename__ = 'user'
+    # login and register look users up by email
+    __table_args__ = (
+        db.Index('ix_user_email', 'email', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100))
     passhash = db.Column(db.String(150))
     authenticated = db.Column(db.Boolean, default=False)
+    # bumped when reservations leave the user's calendar feed, see ics
+    version = db.Column(db.Integer, nullable=False, default=0,
+                        server_default='0')
     reservations = db.relationship('Reservation', backref='user',
                                 lazy='dynamic')
     resources = db.relationship('Resource', backref='user',
@@ -138,7 +198,8 @@ class User(db.Model):
 
     def __init__(self, email, password):
         self.email = email
-        self.passhash = bcrypt.generate_password_hash(password)
+        with bcrypt_latency.time(op='hash'):
+            self.passhash = bcrypt.generate_password_hash(password)
 
     def is_active(self):
         return True
@@ -153,4 +214,70 @@ class User(db.Model):
         return self.authenticated
 
     def is_correct_pw(self, password):
-        return bcrypt.check_password_hash(self.passhash, password)
+        with bcrypt_latency.time(op='check'):
+            return bcrypt.check_password_hash(self.passhash, password)
+
+
+class Hold(db.Model):
+    '''
+    A user's claim on a resource window while they finish booking it,
+    nobody else can book or hold the window until expires_at.
+    '''
+    __tablename__ = "hold"
+    __table_args__ = (
+        db.Index('ix_hold_resource_end', 'resource_id', 'end_time'),
+        # a user's hold is replaced by their next one
+        db.Index('ix_hold_user', 'user_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    resource_id = db.Column(db.Integer, db.ForeignKey('resource.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    start_time = db.Column(EpochDateTime)
+    end_time = db.Column(EpochDateTime)
+    expires_at = db.Column(EpochDateTime)
+
+
+class Change(db.Model):
+    '''
+    An entry of the append-only change log, written in the transaction
+    of the change it records. seq only grows, see changes.
+    '''
+    __tablename__ = "change_log"
+    # never hand out the seq of a removed row again
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = db.Column(db.Integer, primary_key=True)
+    # 'resource' or 'reservation'
+    kind = db.Column(db.String(20))
+    # 'insert', 'update', 'delete' or 'reset' after a bulk import
+    op = db.Column(db.String(10))
+    row_id = db.Column(db.Integer)
+    # json of the row after the change, empty for delete and reset
+    data = db.Column(db.Text)
+    created_at = db.Column(EpochDateTime)
+
+
+class HourlyUsage(db.Model):
+    '''
+    Rollup of the minutes a resource is booked in each hour of a day,
+    rebuilt a day at a time by reports.refresh_days.
+    '''
+    __tablename__ = "hourly_usage"
+    day = db.Column(db.Date, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    resource_id = db.Column(db.Integer, primary_key=True,
+                            autoincrement=False)
+    minutes = db.Column(db.Integer)
+
+
+class DailyUserUsage(db.Model):
+    '''
+    Rollup of a user's reservations of a resource on a day, a
+    reservation counts on the day it starts.
+    '''
+    __tablename__ = "daily_user_usage"
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    resource_id = db.Column(db.Integer, primary_key=True,
+                            autoincrement=False)
+    reservations = db.Column(db.Integer)
+    minutes = db.Column(db.Integer)
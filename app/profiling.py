@@ -0,0 +1,282 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import cProfile
+import gc
+import itertools
+import marshal
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from collections import Counter, deque
+from flask import request, jsonify, Response, abort, g
+from flask_login import login_required, current_user
+from werkzeug.exceptions import NotFound
+from bulk import is_admin
+from . import app
+
+# --------------------- Profiling configuration ----------------------
+app.config.setdefault('PROFILING_ENABLED', True)
+# admins send it with 'cpu', 'memory' or 'cpu,memory' to profile one
+# request, requests without it pay a single header lookup
+app.config.setdefault('PROFILING_HEADER', 'X-Profile')
+# seconds between stack samples
+app.config.setdefault('PROFILING_INTERVAL', 0.005)
+# longest window of POST /profiles/window, in seconds
+app.config.setdefault('PROFILING_MAX_WINDOW', 60)
+# profiles kept for download, the oldest go first
+app.config.setdefault('PROFILING_KEEP', 20)
+# types listed in a memory profile
+app.config.setdefault('PROFILING_TOP_TYPES', 30)
+# --------------------- End of Profiling configuration ---------------
+
+ROOT = os.path.dirname(app.root_path)
+
+
+class Sampler(threading.Thread):
+    '''
+    Samples the stacks of one thread, or of all others, every interval
+    seconds and counts them in flamegraph's collapsed format.
+    '''
+    def __init__(self, interval, thread_id=None):
+        threading.Thread.__init__(self, name='profile-sampler')
+        self.daemon = True
+        self.interval = interval
+        self.thread_id = thread_id
+        self.counts = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        own = threading.current_thread().ident
+        while not self._done.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_id is not None and
+                                        thread_id != self.thread_id):
+                    continue
+                self.counts[collapse(frame)] += 1
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in sorted(self.counts.items()))
+
+def frame_name(frame):
+    code = frame.f_code
+    return '{}:{}'.format(os.path.relpath(code.co_filename, ROOT)
+                          if code.co_filename.startswith(ROOT)
+                          else os.path.basename(code.co_filename),
+                          code.co_name)
+
+def collapse(frame):
+    '''The stack of frame, outermost first, separated by ';'.'''
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class MemorySnapshot(object):
+    '''
+    Live objects by type and the peak resident size. Python 2 has no
+    tracemalloc, the growth per type points at what a request keeps.
+    '''
+    def __init__(self):
+        self.counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+        self.maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def report(self, before, top):
+        grown = sorted(((count - before.counts[name], name)
+                        for name, count in self.counts.items()
+                        if count != before.counts[name]), reverse=True)
+        lines = ['maxrss_kb {} (+{})'.format(
+            self.maxrss, self.maxrss - before.maxrss)]
+        lines.extend('{} {:+d}'.format(name, delta)
+                     for delta, name in grown[:top])
+        return '\n'.join(lines) + '\n'
+
+
+######################################################################
+# Captured profiles
+######################################################################
+class Profile(object):
+
+    def __init__(self, id, label):
+        self.id = id
+        self.label = label
+        self.started = time.time()
+        self.seconds = None
+        # marshalled pstats, collapsed stacks and memory report
+        self.pstats = None
+        self.collapsed = None
+        self.memory = None
+
+    def serialize(self):
+        return {'id': self.id,
+                'label': self.label,
+                'started': time.strftime('%Y-%m-%d %H:%M:%S',
+                                         time.localtime(self.started)),
+                'seconds': self.seconds,
+                'downloads': [kind for kind in ('pstats', 'collapsed',
+                                                'memory')
+                              if getattr(self, kind) is not None]}
+
+
+class ProfileStore(object):
+
+    def __init__(self):
+        self._profiles = deque()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def new(self, label):
+        with self._lock:
+            return Profile(next(self._ids), label)
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.append(profile)
+            while len(self._profiles) > app.config['PROFILING_KEEP']:
+                self._profiles.popleft()
+
+    def get(self, id):
+        with self._lock:
+            for profile in self._profiles:
+                if profile.id == id:
+                    return profile
+
+    def all(self):
+        with self._lock:
+            return list(self._profiles)
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profiles = ProfileStore()
+
+def finish(profile, profiler=None, sampler=None, memory=None):
+    profile.seconds = round(time.time() - profile.started, 4)
+    if profiler is not None:
+        profiler.disable()
+        profile.pstats = marshal.dumps(pstats.Stats(profiler).stats)
+    if sampler is not None:
+        sampler.stop()
+        profile.collapsed = sampler.collapsed()
+    if memory is not None:
+        profile.memory = MemorySnapshot().report(
+            memory, app.config['PROFILING_TOP_TYPES'])
+    profiles.add(profile)
+
+######################################################################
+# One request, profiled when an admin sends the header
+######################################################################
+@app.before_request
+def start_profile():
+    if not app.config['PROFILING_ENABLED']:
+        return
+    modes = request.headers.get(app.config['PROFILING_HEADER'])
+    if modes is None or not is_admin(current_user):
+        return
+    modes = set(mode.strip() for mode in modes.lower().split(','))
+    profile = profiles.new('{} {}'.format(request.method, request.path))
+    memory = MemorySnapshot() if 'memory' in modes else None
+    profiler = sampler = None
+    if 'cpu' in modes or 'memory' not in modes:
+        sampler = Sampler(app.config['PROFILING_INTERVAL'],
+                          threading.current_thread().ident)
+        sampler.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    g.profile = (profile, profiler, sampler, memory)
+
+@app.after_request
+def stop_profile(response):
+    # streamed bodies are generated after this, they are not included
+    if g.get('profile') is not None:
+        profile = g.profile[0]
+        finish(*g.pop('profile'))
+        response.headers['X-Profile-Id'] = str(profile.id)
+    return response
+
+@app.teardown_request
+def drop_profile(exception=None):
+    # after_request doesn't run for an unhandled error, the profiler
+    # must not stay on for the thread's next requests
+    if g.get('profile') is not None:
+        finish(*g.pop('profile'))
+
+######################################################################
+# A window, stacks of every thread for some seconds, admins only
+######################################################################
+def profile_window(seconds):
+    profile = profiles.new('window {}s'.format(seconds))
+    memory = MemorySnapshot()
+    sampler = Sampler(app.config['PROFILING_INTERVAL'])
+    sampler.start()
+    timer = threading.Timer(seconds, finish,
+                            (profile, None, sampler, memory))
+    timer.daemon = True
+    timer.start()
+    return profile
+
+@app.route('/profiles/window', methods=['POST'])
+@login_required
+def start_window():
+    if not is_admin(current_user):
+        abort(403)
+    seconds = request.args.get('seconds', 10, type=float)
+    if not 0 < seconds <= app.config['PROFILING_MAX_WINDOW']:
+        return jsonify(error="seconds should be between 0 and {}".format(
+            app.config['PROFILING_MAX_WINDOW'])), 400
+    profile = profile_window(seconds)
+    return jsonify(id=profile.id, ready_in=seconds), 202
+
+######################################################################
+# Downloads, /profiles and /profiles/<id>.pstats|collapsed|memory
+######################################################################
+DOWNLOADS = {'pstats': 'application/octet-stream',
+             'collapsed': 'text/plain',
+             'memory': 'text/plain'}
+
+@app.route('/profiles', methods=['GET'])
+@login_required
+def list_profiles():
+    if not is_admin(current_user):
+        abort(403)
+    return jsonify(profiles=[profile.serialize()
+                             for profile in reversed(profiles.all())])
+
+@app.route('/profiles/<int:id>.<kind>', methods=['GET'])
+@login_required
+def download_profile(id, kind):
+    if not is_admin(current_user):
+        abort(403)
+    profile = profiles.get(id)
+    if kind not in DOWNLOADS or profile is None or \
+        getattr(profile, kind) is None:
+        raise NotFound("profile '{}.{}' was not found.".format(id, kind))
+    response = Response(getattr(profile, kind), mimetype=DOWNLOADS[kind])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=profile-{}.{}'.format(id, kind)
+    return response
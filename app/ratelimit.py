@@ -0,0 +1,181 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, render_template, make_response
+from flask_login import current_user
+from tenants import tenant_key
+from . import app
+
+# --------------------- Rate limit configuration ---------------------
+app.config.setdefault('RATELIMIT_ENABLED', True)
+# endpoint -> (requests, seconds), applied per user and per ip
+app.config.setdefault('RATELIMITS', {
+    'search': (30, 60),
+    'login': (10, 60),
+    'register': (5, 60)})
+# endpoint -> (requests in flight, requests allowed to wait for a slot)
+app.config.setdefault('CONCURRENCY_LIMITS', {
+    'search': (4, 8),
+    'login': (4, 8)})
+# how long a queued request waits for a slot before it is shed
+app.config.setdefault('CONCURRENCY_QUEUE_TIMEOUT', 2)
+# use the client address from X-Forwarded-For, only behind a proxy
+# (e.g. the heroku router) that sets it
+app.config.setdefault('RATELIMIT_TRUST_PROXY', False)
+# --------------------- End of Rate limit configuration --------------
+
+
+class MemoryStore(object):
+    '''
+    Token buckets kept in process memory. The least recently used keys
+    are dropped past max_keys so a scan over many ips can't grow it
+    without bound. Any object with the same take() can replace it,
+    e.g. one backed by redis to share limits across workers.
+    '''
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, now=None):
+        '''
+        Take one token from bucket 'key' refilled at 'rate' tokens per
+        second. Returns 0 when allowed, otherwise the seconds to wait.
+        '''
+        now = now or time.time()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class ConcurrencyLimiter(object):
+    '''
+    At most 'limit' requests run at once, up to 'queue' more wait for a
+    slot and anything beyond that is rejected straight away.
+    '''
+    def __init__(self, limit, queue):
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+store = MemoryStore()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name):
+    with _limiters_lock:
+        if name not in _limiters:
+            limit, queue = app.config['CONCURRENCY_LIMITS'][name]
+            _limiters[name] = ConcurrencyLimiter(limit, queue)
+        return _limiters[name]
+
+def reset():
+    store.clear()
+    with _limiters_lock:
+        _limiters.clear()
+
+def client_ip():
+    if app.config['RATELIMIT_TRUST_PROXY'] and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or 'unknown'
+
+def rejected(code, retry_after):
+    response = make_response(render_template(
+        '404.html',
+        code=code,
+        index_page=not current_user.is_authenticated), code)
+    response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
+def check_rate(name):
+    count, seconds = app.config['RATELIMITS'][name]
+    rate = float(count) / seconds
+    keys = ['{}:ip:{}'.format(name, client_ip())]
+    if current_user.is_authenticated:
+        keys.append('{}:user:{}'.format(
+            name, tenant_key(current_user.id)))
+    return max(store.take(key, rate, count) for key in keys)
+
+######################################################################
+# Decorator for expensive views, only 'methods' are limited
+######################################################################
+def limit(name, methods=('POST',)):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not app.config['RATELIMIT_ENABLED'] or \
+                request.method not in methods:
+                return view(*args, **kwargs)
+            if name in app.config['RATELIMITS']:
+                wait = check_rate(name)
+                if wait > 0:
+                    return rejected(429, wait)
+            if name not in app.config['CONCURRENCY_LIMITS']:
+                return view(*args, **kwargs)
+            limiter = get_limiter(name)
+            if not limiter.acquire(app.config['CONCURRENCY_QUEUE_TIMEOUT']):
+                return rejected(503, 1)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
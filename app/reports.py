@@ -0,0 +1,223 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import click
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from flask import request, jsonify, abort
+from flask_login import login_required, current_user
+from sqlalchemy import func
+from models import db, Resource, User, Reservation, HourlyUsage, \
+    DailyUserUsage
+from jobs import job
+from server import JOB_TIME_FORMAT
+from bulk import is_admin
+from timeparse import parse_date, to_minutes
+from . import app
+
+# --------------------- Reports configuration ------------------------
+# period reported when no from / to is given
+app.config.setdefault('REPORTS_DEFAULT_DAYS', 30)
+app.config.setdefault('REPORTS_MAX_DAYS', 366)
+app.config.setdefault('REPORTS_TOP_USERS', 10)
+# --------------------- End of Reports configuration -----------------
+
+# valid_res keeps a reservation inside one day's availability, so the
+# reservations touching a day started at most a day before it
+MAX_RESERVATION_SPAN = timedelta(days=1)
+
+######################################################################
+# Rollups
+######################################################################
+def days_between(first, last):
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+def hour_minutes(start, end):
+    '''
+    (hour, minutes) for every hour [start, end) touches.
+    '''
+    while start < end:
+        next_hour = start.replace(minute=0, second=0, microsecond=0) + \
+            timedelta(hours=1)
+        stop = min(next_hour, end)
+        yield start.hour, int((stop - start).total_seconds() // 60)
+        start = stop
+
+def refresh_days(days):
+    '''
+    Rebuild the rollups of 'days' from the reservations, one columnar
+    query and one transaction per day. Reservations of deleted
+    resources, still waiting for their purge job, are left out.
+    '''
+    for day in days:
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        earliest = day_start - MAX_RESERVATION_SPAN
+        rows = db.session.query(Reservation.resource_id,
+                                Reservation.user_id,
+                                Reservation.start_time,
+                                Reservation.end_time) \
+            .join(Resource, Resource.id == Reservation.resource_id) \
+            .filter(Reservation.start_time >= earliest) \
+            .filter(Reservation.start_time < day_end) \
+            .filter(Reservation.end_time > day_start)
+        hourly = defaultdict(int)
+        daily = defaultdict(lambda: [0, 0])
+        for resource_id, user_id, start, end in rows:
+            for hour, minutes in hour_minutes(max(start, day_start),
+                                              min(end, day_end)):
+                hourly[(hour, resource_id)] += minutes
+            if start >= day_start:
+                totals = daily[(user_id, resource_id)]
+                totals[0] += 1
+                totals[1] += int((end - start).total_seconds() // 60)
+        db.session.query(HourlyUsage).filter(HourlyUsage.day == day) \
+            .delete(synchronize_session=False)
+        db.session.query(DailyUserUsage).filter(DailyUserUsage.day == day) \
+            .delete(synchronize_session=False)
+        if hourly:
+            db.session.execute(HourlyUsage.__table__.insert(), [
+                {'day': day, 'hour': hour, 'resource_id': resource_id,
+                 'minutes': minutes}
+                for (hour, resource_id), minutes in hourly.items()])
+        if daily:
+            db.session.execute(DailyUserUsage.__table__.insert(), [
+                {'day': day, 'user_id': user_id, 'resource_id': resource_id,
+                 'reservations': count, 'minutes': minutes}
+                for (user_id, resource_id), (count, minutes)
+                in daily.items()])
+        db.session.commit()
+
+def rebuild_usage():
+    '''
+    Rebuild every rollup, for existing databases and after imports.
+    Returns the number of days covered.
+    '''
+    first, last = db.session.query(func.min(Reservation.start_time),
+                                   func.max(Reservation.end_time)).one()
+    db.session.query(HourlyUsage).delete(synchronize_session=False)
+    db.session.query(DailyUserUsage).delete(synchronize_session=False)
+    db.session.commit()
+    if first is None:
+        return 0
+    days = days_between(first.date(), last.date())
+    refresh_days(days)
+    return len(days)
+
+@job('refresh_usage')
+def refresh_usage(start, end):
+    # the days a reservation from start to end touches changed
+    start = datetime.strptime(start, JOB_TIME_FORMAT)
+    end = datetime.strptime(end, JOB_TIME_FORMAT)
+    refresh_days(days_between(start.date(),
+                              max(start, end - timedelta(microseconds=1))
+                              .date()))
+
+@job('rebuild_usage')
+def rebuild_usage_job():
+    rebuild_usage()
+
+######################################################################
+# Reports, from the rollups only
+######################################################################
+def utilization(first, last):
+    '''
+    Booked minutes over available minutes of every resource between
+    first and last (inclusive), busiest first.
+    '''
+    booked = dict(db.session.query(HourlyUsage.resource_id,
+                                   func.sum(HourlyUsage.minutes))
+                  .filter(HourlyUsage.day.between(first, last))
+                  .group_by(HourlyUsage.resource_id))
+    days = (last - first).days + 1
+    results = []
+    for id, name, open_, close in db.session.query(
+            Resource.id, Resource.name,
+            Resource.available_start, Resource.available_end):
+        available = (to_minutes(close) - to_minutes(open_)) * days
+        minutes = int(booked.get(id) or 0)
+        results.append({
+            'resource_id': id,
+            'name': name,
+            'booked_minutes': minutes,
+            'available_minutes': available,
+            'utilization': round(float(minutes) / available, 4)
+                           if available > 0 else None})
+    results.sort(key=lambda x: x['utilization'], reverse=True)
+    return results
+
+def heatmap(first, last, resource_id=None):
+    '''
+    Booked minutes by weekday (Monday first) and hour, 7 lists of 24.
+    '''
+    query = db.session.query(HourlyUsage.day, HourlyUsage.hour,
+                             func.sum(HourlyUsage.minutes)) \
+        .filter(HourlyUsage.day.between(first, last))
+    if resource_id is not None:
+        query = query.filter(HourlyUsage.resource_id == resource_id)
+    grid = [[0] * 24 for _ in range(7)]
+    for day, hour, minutes in query.group_by(HourlyUsage.day,
+                                             HourlyUsage.hour):
+        grid[day.weekday()][hour] += int(minutes)
+    return grid
+
+def top_users(first, last, limit):
+    minutes = func.sum(DailyUserUsage.minutes)
+    rows = db.session.query(User.id, User.email,
+                            func.sum(DailyUserUsage.reservations), minutes) \
+        .join(DailyUserUsage, DailyUserUsage.user_id == User.id) \
+        .filter(DailyUserUsage.day.between(first, last)) \
+        .group_by(User.id, User.email) \
+        .order_by(minutes.desc()) \
+        .limit(limit)
+    return [{'user_id': id, 'email': email,
+             'reservations': int(count), 'minutes': int(total)}
+            for id, email, count, total in rows]
+
+######################################################################
+# Usage report, /reports/usage[?from=yyyy-m-d][&to=yyyy-m-d]
+# [&resource_id=n], admins only
+######################################################################
+@app.route('/reports/usage', methods=['GET'])
+@login_required
+def usage_report():
+    if not is_admin(current_user):
+        abort(403)
+    try:
+        last = parse_date(request.args['to']) if 'to' in request.args \
+            else date.today()
+        first = parse_date(request.args['from']) if 'from' in request.args \
+            else last - timedelta(days=app.config['REPORTS_DEFAULT_DAYS'] - 1)
+        resource_id = request.args.get('resource_id', type=int)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if first > last or (last - first).days >= app.config['REPORTS_MAX_DAYS']:
+        return jsonify(error="from should be before to, at most {} days"
+                       .format(app.config['REPORTS_MAX_DAYS'])), 400
+    return jsonify(**{
+        'from': first.isoformat(),
+        'to': last.isoformat(),
+        'utilization': utilization(first, last),
+        'heatmap': heatmap(first, last, resource_id),
+        'top_users': top_users(first, last,
+                               app.config['REPORTS_TOP_USERS'])})
+
+######################################################################
+#  C L I
+######################################################################
+@app.cli.command('rollup_usage')
+def rollup_usage_command():
+    '''Rebuild the usage rollups from all reservations.'''
+    click.echo('rolled up {} day(s)'.format(rebuild_usage()))
@@ -0,0 +1,208 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import random
+import threading
+import time
+from functools import wraps
+from flask import request, session, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, NullPool
+from sqlalchemy.sql.expression import UpdateBase
+from tenants import current_tenant
+from metrics import Gauge
+from . import app
+
+# --------------------- Replica configuration ------------------------
+# database uris of read replicas, empty sends everything to the primary
+app.config.setdefault('SQLALCHEMY_REPLICAS', [])
+# seconds a user reads from the primary after their own write, should
+# be longer than the replicas lag behind
+app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+# --------------------- End of Replica configuration -----------------
+
+BIND_PREFIX = '_replica'
+# session key holding when the user may read from a replica again
+STICKY_KEY = '_primary_until'
+
+def init_app(app):
+    '''
+    Register the replicas as binds, call it before db.init_app. No
+    table lives on those binds, they are only picked by RoutingSession.
+    '''
+    binds = dict((key, uri) for key, uri in
+                 (app.config.get('SQLALCHEMY_BINDS') or {}).items()
+                 if not key.startswith(BIND_PREFIX))
+    for i, uri in enumerate(app.config['SQLALCHEMY_REPLICAS']):
+        binds['{}{}'.format(BIND_PREFIX, i)] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds or None
+
+def replica_keys(app):
+    return ['{}{}'.format(BIND_PREFIX, i)
+            for i in range(len(app.config['SQLALCHEMY_REPLICAS']))]
+
+def reading_from_replica():
+    return has_request_context() and getattr(request, 'use_replica', False)
+
+
+class RoutingSession(SignallingSession):
+    '''
+    Sends everything of a tenant to the tenant's database. Otherwise
+    the queries of views marked with replica_reads go to one replica,
+    picked once per session, and flushes and bulk updates or deletes to
+    the primary.
+    '''
+    def __init__(self, db, **options):
+        self._db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        tenant = current_tenant()
+        if tenant is not None:
+            return self._db.get_tenant_engine(self.app, tenant)
+        if not self._flushing and not isinstance(clause, UpdateBase) and \
+            reading_from_replica():
+            if not hasattr(self, '_replica_key'):
+                keys = replica_keys(self.app)
+                self._replica_key = random.choice(keys) if keys else None
+            if self._replica_key is not None:
+                return self._db.get_engine(self.app, bind=self._replica_key)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, *args, **kwargs):
+        SQLAlchemy.__init__(self, *args, **kwargs)
+        self._tenant_engines = {}
+        self._tenant_lock = threading.Lock()
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def get_tenant_engine(self, app, tenant):
+        '''
+        The engine of tenant's database, created with its own pool on
+        first use together with any missing tables.
+        '''
+        uri = app.config['TENANT_DATABASES'][tenant]
+        engine = self._tenant_engines.get((tenant, uri))
+        if engine is not None:
+            return engine
+        with self._tenant_lock:
+            engine = self._tenant_engines.get((tenant, uri))
+            if engine is None:
+                engine = self.create_tenant_engine(app, tenant, uri)
+                self.Model.metadata.create_all(engine)
+                self._tenant_engines[(tenant, uri)] = engine
+        return engine
+
+    def create_tenant_engine(self, app, tenant, uri):
+        info = make_url(uri)
+        options = {'convert_unicode': True}
+        self.apply_driver_hacks(app, info, options)
+        # in memory sqlite keeps its single connection
+        if options.get('poolclass', QueuePool) in (QueuePool, NullPool):
+            options.update(
+                poolclass=QueuePool,
+                pool_size=app.config['TENANT_POOL_SIZES'].get(
+                    tenant, app.config['TENANT_POOL_SIZE']),
+                max_overflow=app.config['TENANT_MAX_OVERFLOW'],
+                pool_timeout=app.config['TENANT_POOL_TIMEOUT'])
+            if info.drivername == 'sqlite':
+                # pooled connections are handed from thread to thread
+                options.setdefault('connect_args', {})
+                options['connect_args']['check_same_thread'] = False
+        if app.config['SQLALCHEMY_ECHO']:
+            options['echo'] = True
+        return create_engine(info, **options)
+
+    def engines(self, app):
+        '''(name, engine) of the primary, the replicas and the tenants.'''
+        engines = [('default', self.get_engine(app))]
+        engines.extend((key, self.get_engine(app, bind=key))
+                       for key in replica_keys(app))
+        with self._tenant_lock:
+            engines.extend((tenant, engine) for (tenant, uri), engine
+                           in self._tenant_engines.items())
+        return engines
+
+    def dispose_tenant_engines(self):
+        with self._tenant_lock:
+            for engine in self._tenant_engines.values():
+                engine.dispose()
+            self._tenant_engines.clear()
+
+
+######################################################################
+# Connections in use of every pool, read by /metrics
+######################################################################
+pool_checked_out = Gauge('db_pool_checked_out',
+                         'Connections handed out by the pool.',
+                         ('database',))
+pool_size = Gauge('db_pool_size', 'Connections the pool keeps open.',
+                  ('database',))
+
+def queue_pools():
+    state = app.extensions.get('sqlalchemy')
+    if state is None:
+        return []
+    # sqlite files and in memory databases have no QueuePool to report
+    return [(name, engine.pool) for name, engine in state.db.engines(app)
+            if isinstance(engine.pool, QueuePool)]
+
+@pool_checked_out.collect_from
+def collect_checked_out():
+    return [({'database': name}, pool.checkedout())
+            for name, pool in queue_pools()]
+
+@pool_size.collect_from
+def collect_pool_size():
+    return [({'database': name}, pool.size())
+            for name, pool in queue_pools()]
+
+
+def mark_write(*args):
+    if has_request_context():
+        request.wrote_primary = True
+
+event.listen(RoutingSession, 'after_flush', mark_write)
+event.listen(RoutingSession, 'after_bulk_update', mark_write)
+event.listen(RoutingSession, 'after_bulk_delete', mark_write)
+
+######################################################################
+# Decorator for read only GET views
+######################################################################
+def replica_reads(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        request.use_replica = request.method in ('GET', 'HEAD') and \
+            session.get(STICKY_KEY, 0) <= time.time()
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.after_request
+def stick_to_primary(response):
+    '''
+    Read your writes: after a user changed something their next reads
+    come from the primary until the replicas have caught up.
+    '''
+    if getattr(request, 'wrote_primary', False) and \
+        app.config['SQLALCHEMY_REPLICAS']:
+        session[STICKY_KEY] = time.time() + \
+            app.config['REPLICA_STICKY_SECONDS']
+    return response
@@ -0,0 +1,93 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+from datetime import datetime
+from models import db, Resource, Reservation, Tag, Tag_Resource
+
+
+class Row(object):
+    '''
+    Read only copy of a few columns for listing pages. Selecting columns
+    skips building ORM instances and the session never tracks them, the
+    templates read the same attribute names either way.
+    '''
+    __slots__ = ()
+    model = None
+    # the columns selected, in __slots__ order
+    fields = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def columns(cls):
+        return [getattr(cls.model, name) for name in cls.fields]
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.id)
+
+
+class TagRow(Row):
+    fields = __slots__ = ('id', 'value')
+    model = Tag
+
+
+class ResourceRow(Row):
+    fields = ('id', 'name', 'owner_id', 'available_start', 'available_end',
+              'last_reserve_time')
+    __slots__ = fields + ('tags',)
+    model = Resource
+
+
+class ReservationRow(Row):
+    fields = __slots__ = ('id', 'resource_id', 'resource_name', 'user_id',
+                          'start_time', 'end_time', 'duration')
+    model = Reservation
+
+
+def resource_rows(criteria=(), order_by=None, tags=True):
+    '''
+    ResourceRows matching criteria. With tags, their tags are loaded by
+    one more query instead of one per resource.
+    '''
+    query = db.session.query(*ResourceRow.columns()).filter(*criteria)
+    if order_by is not None:
+        query = query.order_by(order_by)
+    rows = [ResourceRow(*values) for values in query]
+    if not tags:
+        return rows
+    by_resource = dict((row.id, []) for row in rows)
+    ids = db.session.query(Resource.id).filter(*criteria)
+    for resource_id, tag_id, value in db.session.query(
+            Tag_Resource.resource_id, Tag.id, Tag.value) \
+            .join(Tag, Tag.id == Tag_Resource.tag_id) \
+            .filter(Tag_Resource.resource_id.in_(ids.subquery())) \
+            .order_by(Tag_Resource.id):
+        if resource_id in by_resource:
+            by_resource[resource_id].append(TagRow(tag_id, value))
+    for row in rows:
+        row.tags = by_resource[row.id]
+    return rows
+
+def upcoming_rows(criteria=(), now=None):
+    '''
+    ReservationRows matching criteria not over yet, soonest first.
+    '''
+    query = db.session.query(*ReservationRow.columns()) \
+        .filter(*criteria) \
+        .filter(Reservation.end_time > (now or datetime.now())) \
+        .order_by(Reservation.start_time)
+    return [ReservationRow(*values) for values in query]
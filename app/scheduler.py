@@ -0,0 +1,58 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import heapq
+from datetime import datetime, timedelta
+
+######################################################################
+# Times a resource can't be booked because it is outside its daily
+# available_start - available_end window
+######################################################################
+def closed_intervals(open_minutes, close_minutes, first_day, last_day):
+    intervals = []
+    day = first_day
+    while day <= last_day:
+        midnight = datetime.combine(day, datetime.min.time())
+        intervals.append((midnight, midnight + timedelta(minutes=open_minutes)))
+        intervals.append((midnight + timedelta(minutes=close_minutes),
+                          midnight + timedelta(days=1)))
+        day += timedelta(days=1)
+    return intervals
+
+######################################################################
+# Earliest windows of 'duration' free in every busy list
+######################################################################
+def earliest_common_slots(busy_lists, window_start, window_end, duration,
+                          limit):
+    '''
+    busy_lists holds one list of (start, end) per participant, each
+    sorted by start. They are merged lazily with a k-way heap, so the
+    sweep stops as soon as 'limit' candidates are found. Returns up to
+    'limit' (start, end, free_until) tuples, earliest first.
+    '''
+    candidates = []
+    cursor = window_start
+    for start, end in heapq.merge(*busy_lists):
+        if cursor >= window_end or len(candidates) >= limit:
+            break
+        if end <= cursor:
+            continue
+        gap_end = min(start, window_end)
+        if gap_end - cursor >= duration:
+            candidates.append((cursor, cursor + duration, gap_end))
+        cursor = max(cursor, end)
+    if len(candidates) < limit and window_end - cursor >= duration:
+        candidates.append((cursor, cursor + duration, window_end))
+    return candidates
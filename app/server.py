@@ -13,26 +13,44 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 ######################################################################
-import flask, re
 from flask import redirect, jsonify, request, json, url_for, make_response, \
-    render_template
+    render_template, abort
 from flask_login import login_required, login_user, current_user, logout_user
 from werkzeug.contrib.atom import AtomFeed
 from werkzeug.exceptions import NotFound
-from datetime import datetime, timedelta
-from models import db, Resource, User, Reservation, Tag
+from sqlalchemy import func, select, exists, literal, and_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from datetime import date, datetime, timedelta
+from models import db, Resource, User, Reservation, Tag, Tag_Resource, \
+    HourlyUsage, DailyUserUsage
+from jobs import job, defer
+from scheduler import closed_intervals, earliest_common_slots
+from events import hub, resource_channel, reservation_data, \
+    events_url_for
+from ratelimit import limit
+from timeline import timelines
+from routing import replica_reads
+from rows import resource_rows, upcoming_rows
+from ics import bump_versions, feed_url
+from holds import held_until, held_message, add_hold, take_hold, \
+    delete_holds, forget_holds
+from changes import record_resource, record_reservation
+from metrics import booking_rejections
+from tenants import tenant_for_email, use_tenant, remember_tenant, \
+    forget_tenant
+from timeparse import to_minutes, parse_date, parse_window, window_minutes, \
+    valid_availability, availability_windows, fitting_windows
 from . import app, login_manager
 
 # --------------------- App configuration ---------------------------
+# resources with more reservations than this have them purged by a job
+app.config.setdefault('DELETE_INLINE_LIMIT', 5000)
+app.config.setdefault('DELETE_BATCH_SIZE', 1000)
+
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     db.session.remove()
 
-@app.before_request
-def make_session_permanent():
-    flask.session.permanent = True
-    app.permanent_session_lifetime = timedelta(minutes=10)
-
 @app.teardown_request
 def session_clear(exception=None):
     db.session.remove()
@@ -67,6 +85,7 @@ def page_not_found(e):
 # Register a user
 ######################################################################
 @app.route('/register', methods=['GET','POST'])
+@limit('register')
 def register():
     if request.method == 'GET':
         #print "register template"
@@ -76,6 +95,8 @@ def register():
             button="Register",
             index_page=True)
     data = request.form.to_dict(flat=True)
+    # users live in their tenant's database
+    use_tenant(tenant_for_email(data['email']))
     user = db.session.query(User).filter_by(email=data['email']).first()
     if user is not None:
         return render_template(
@@ -86,6 +107,13 @@ def register():
     db.session.add(user)
     try:
         db.session.commit()
+    except IntegrityError:
+        # registered by a concurrent request, ix_user_email caught it
+        db.session.rollback()
+        return render_template(
+            'login.html',
+            message="Please Register, Email already taken",
+            button="Register")
     except:
         db.session.rollback()
     #print 'User successfully registered'
@@ -95,6 +123,7 @@ def register():
 # Login a user
 ######################################################################
 @app.route('/login', methods=['GET','POST'])
+@limit('login')
 def login():
     if request.method == 'GET':
         if current_user.is_authenticated:
@@ -105,6 +134,11 @@ def login():
             button="Login",
             index_page=True)
     data = request.form.to_dict(flat=True)
+    # whoever was logged in belongs to the session's tenant, not to the
+    # one of the email
+    logout_user()
+    forget_tenant()
+    use_tenant(tenant_for_email(data['email']))
     user = db.session.query(User).filter_by(email=data['email']).first()
     if user is None or not user.is_correct_pw(data['password']):
         #print 'Username or Password is invalid'
@@ -120,6 +154,7 @@ def login():
     except:
         db.session.rollback()
     login_user(user)
+    remember_tenant()
     #print 'Logged in successfully'
     return redirect(url_for('.list'))
 
@@ -137,6 +172,7 @@ def logout():
     except:
         db.session.rollback()
     logout_user()
+    forget_tenant()
     return redirect(url_for('.login'))
 # --------------------- End of User management -----------------------
 
@@ -154,6 +190,7 @@ def index():
 ######################################################################
 @app.route('/home', methods=['GET'])
 @login_required
+@replica_reads
 def list():
     '''
     the landing page,
@@ -165,16 +202,15 @@ def list():
     (3) resources that the user owns, each linked to its URL
     (4) a link to create a new resource
     '''
-    resources = [res for res in db.session.query(Resource).all()]
-    resources.sort(key=lambda x: x.last_reserve_time, reverse=True)
+    resources = resource_rows(
+        order_by=Resource.last_reserve_time.desc())
     user = current_user
-    my_reservation = \
-        [res for res in user.reservations if res.end_time > datetime.now()]
-    my_reservation.sort(key=lambda x: x.start_time)
+    my_reservation = upcoming_rows([Reservation.user_id == user.id])
     return render_template(
         "list.html",
+        ics_url=feed_url('user', user.id),
         my_reservation=my_reservation,
-        my_resources=user.resources,
+        my_resources=resource_rows([Resource.owner_id == user.id]),
         resources=resources)
 
 ######################################################################
@@ -214,6 +250,8 @@ def add_resource():
         resource.tags.append(tag)
     db.session.add(resource)
     try:
+        db.session.flush()
+        record_resource(resource, 'insert')
         db.session.commit()
     except:
         db.session.rollback()
@@ -224,16 +262,17 @@ def add_resource():
 ######################################################################
 @app.route('/resources/<int:id>', methods=['GET'])
 @login_required
+@replica_reads
 def get_resources(id):
     resource = db.session.query(Resource).get(id)
     if not resource:
         raise NotFound("resource with id '{}' was not found.".format(id))
     owner = current_user.id == resource.owner_id
-    reservations = \
-        [res for res in resource.reservations if res.end_time <= datetime.now()]
-    num_past_reservations = len(reservations)
+    num_past_reservations = resource.reservations \
+        .filter(Reservation.end_time <= datetime.now()).count()
     return render_template(
         "view.html",
+        ics_url=feed_url('resource', id),
         resource=resource,
         owner=owner,
         num_past=num_past_reservations)
@@ -296,6 +335,7 @@ def update_resources(id):
         if tag not in resource.tags:
             resource.tags.append(tag)
     db.session.add(resource)
+    record_resource(resource, 'update')
     try:
         db.session.commit()
     except:
@@ -310,15 +350,53 @@ def update_resources(id):
 def delete_resources(id):
     resource = db.session.query(Resource).get(id)
     if resource is not None and resource.owner_id == current_user.id:
-        for res in resource.reservations:
-            db.session.delete(res)
-        db.session.delete(resource)
+        count = db.session.query(func.count(Reservation.id)) \
+            .filter(Reservation.resource_id == id).scalar()
+        if count > app.config['DELETE_INLINE_LIMIT']:
+            # reservations point at the resource, it stays until the job
+            # has deleted them and then deletes it
+            defer('delete_reservations', resource_id=id,
+                  batch_size=app.config['DELETE_BATCH_SIZE'])
+            return redirect(url_for('.list'))
+        user_ids = reservation_user_ids(Reservation.resource_id == id)
+        db.session.query(Reservation) \
+            .filter(Reservation.resource_id == id) \
+            .delete(synchronize_session=False)
+        bump_versions(user_ids=user_ids)
+        delete_resource_rows(resource)
         try:
             db.session.commit()
-        except:
+        except SQLAlchemyError:
             db.session.rollback()
+            app.logger.exception("resource %s could not be deleted", id)
+            abort(500)
+        timelines.invalidate(user_ids)
+        resource_deleted(id)
     return redirect(url_for('.list'))
 
+def delete_resource_rows(resource):
+    '''
+    Delete the tags, rollups and holds of a resource without
+    reservations, then the resource. The caller commits.
+    '''
+    db.session.query(Tag_Resource) \
+        .filter(Tag_Resource.resource_id == resource.id) \
+        .delete(synchronize_session=False)
+    for rollup in (HourlyUsage, DailyUserUsage):
+        db.session.query(rollup) \
+            .filter(rollup.resource_id == resource.id) \
+            .delete(synchronize_session=False)
+    delete_holds(resource.id)
+    db.session.query(Resource) \
+        .filter(Resource.id == resource.id) \
+        .delete(synchronize_session=False)
+    record_resource(resource, 'delete')
+
+def resource_deleted(id):
+    # everything that follows a committed resource delete
+    forget_holds(id)
+    hub.publish(resource_channel(id), 'resource_deleted', {'id': id})
+
 ######################################################################
 # Get a reservation
 ######################################################################
@@ -339,17 +417,26 @@ def add_res(id):
     resource = db.session.query(Resource).get(id)
     if resource is None:
         raise NotFound("resource with id '{}' was not found.".format(id))
-    reservations = \
-        [res for res in resource.reservations if res.end_time > datetime.now()]
-    reservations.sort(key=lambda x: x.start_time)
+    reservations = upcoming(resource.reservations)
+    free_slots_url = url_for('.get_free_slots', id=id)
+    events_url = events_url_for(id)
+    holds_url = url_for('api_hold', id=id)
     if request.method == 'GET':
         return render_template(
             'form_res.html',
             action="Add Reservation",
             button="Save",
             message="",
-            results=reservations)
+            results=reservations,
+            free_slots_url=free_slots_url,
+            events_url=events_url,
+            holds_url=holds_url)
     data = request.form.to_dict(flat=True)
+    if data.get('hold_id', '').isdigit():
+        reservation, message = confirm_hold(int(data['hold_id']), current_user)
+        if reservation is not None:
+            return redirect(url_for('.list'))
+        # the hold is gone, book the submitted times the usual way
     try:
         data['start_time'], data['end_time'] = \
             convert_str_to_time(data['date'], data['start'], data['duration'])
@@ -360,32 +447,97 @@ def add_res(id):
             action="Add Reservation",
             button="Save",
             message="Time Input Invalid",
-            results=reservations)
-    message = valid_res(data['start_time'], data['end_time'], resource)
-    if message == "":
-        message = \
-            valid_user_time(data['start_time'], data['end_time'], current_user)
+            results=reservations,
+            free_slots_url=free_slots_url,
+            events_url=events_url,
+            holds_url=holds_url)
+    reservation, message = \
+        book(resource, current_user, data['start_time'], data['end_time'],
+             data['duration'])
     if message != "":
+        # suggest what is still open that day instead of another guess
+        day = data['start_time'].date()
         return render_template(
             'form_res.html',
             action="Add Reservation",
             button="Save",
             message=message,
-            results=reservations)
-    data['user_id'] = current_user.id
-    data['resource_id'] = id
-    data['resource_name'] = resource.name
-    resource.last_reserve_time = datetime.now()
-    reservation = Reservation()
-    reservation.deserialize(data)
-    db.session.add(reservation)
-    db.session.add(resource)
-    try:
-        db.session.commit()
-    except:
-        db.session.rollback()
+            results=reservations,
+            free_slots=find_free_slots(resource, day, day),
+            free_slots_url=free_slots_url,
+            events_url=events_url,
+            holds_url=holds_url)
     return redirect(url_for('.list'))
 
+######################################################################
+# Free time windows of a resource, ?date=yyyy-m-d[&end_date=yyyy-m-d]
+# [&duration=hh:mm]
+######################################################################
+@app.route('/resources/<int:id>/free_slots', methods=['GET'])
+@login_required
+def get_free_slots(id):
+    resource = db.session.query(Resource).get(id)
+    if resource is None:
+        raise NotFound("resource with id '{}' was not found.".format(id))
+    try:
+        first_day = parse_date(request.args['date'])
+        last_day = parse_date(
+            request.args.get('end_date', request.args['date']))
+        min_duration = to_minutes(request.args.get('duration', '00:00'))
+    except Exception as e:
+        return jsonify(error="Time Input Invalid"), 400
+    if last_day < first_day or \
+        (last_day - first_day).days >= MAX_FREE_SLOT_DAYS:
+        return jsonify(error="Date range should be within {} days"
+                       .format(MAX_FREE_SLOT_DAYS)), 400
+    slots = find_free_slots(resource, first_day, last_day)
+    return jsonify(
+        resource_id=id,
+        slots=[slot for slot in slots if slot['minutes'] >= min_duration])
+
+######################################################################
+# Earliest common free windows of several resources and the user,
+# ?resource=<id>&resource=<id>&date=yyyy-m-d[&end_date=yyyy-m-d]
+# &duration=hh:mm[&limit=n]
+######################################################################
+@app.route('/schedule', methods=['GET'])
+@login_required
+def schedule():
+    ids = sorted(set(request.args.getlist('resource', type=int)))
+    try:
+        first_day = parse_date(request.args['date'])
+        last_day = parse_date(
+            request.args.get('end_date', request.args['date']))
+        duration = timedelta(minutes=to_minutes(request.args['duration']))
+        limit = int(request.args.get('limit', 5))
+    except Exception as e:
+        return jsonify(error="Time Input Invalid"), 400
+    if not ids or duration <= timedelta(0) or limit <= 0:
+        return jsonify(error="Resources and a duration are required"), 400
+    if last_day < first_day or \
+        (last_day - first_day).days >= MAX_FREE_SLOT_DAYS:
+        return jsonify(error="Date range should be within {} days"
+                       .format(MAX_FREE_SLOT_DAYS)), 400
+    resources = db.session.query(Resource) \
+        .filter(Resource.id.in_(ids)).all()
+    if len(resources) != len(ids):
+        raise NotFound("resource with id '{}' was not found.".format(
+            sorted(set(ids) - set(res.id for res in resources))[0]))
+    window_start = max(datetime.combine(first_day, datetime.min.time()),
+                       datetime.now())
+    window_end = datetime.combine(last_day + timedelta(days=1),
+                                  datetime.min.time())
+    slots = earliest_common_slots(
+        busy_intervals(resources, current_user, window_start, window_end,
+                       first_day, last_day),
+        window_start, window_end, duration, limit)
+    return jsonify(
+        resource_ids=ids,
+        slots=[{'start': start.strftime('%Y-%m-%d %H:%M'),
+                'end': end.strftime('%Y-%m-%d %H:%M'),
+                'free_until': free_until.strftime('%Y-%m-%d %H:%M')}
+               for start, end, free_until in slots])
+
 ######################################################################
 # Get reservations for one resource
 ######################################################################
@@ -395,12 +547,12 @@ def get_res_for_resource(id):
     resource = db.session.query(Resource).get(id)
     if resource is None:
         raise NotFound("resource with id '{}' was not found.".format(id))
-    reservations = \
-        [res for res in resource.reservations if res.end_time > datetime.now()]
+    reservations = upcoming_rows([Reservation.resource_id == id])
     return render_template(
         "list_res.html",
         reservations=reservations,
-        resource=resource)
+        resource=resource,
+        events_url=events_url_for(id))
 
 ######################################################################
 # Delete a reservation
@@ -410,11 +562,21 @@ def get_res_for_resource(id):
 def delete_res(id):
     reservation = db.session.query(Reservation).get(id)
     if reservation and reservation.user_id == current_user.id:
+        resource_id = reservation.resource_id
+        start = reservation.start_time.strftime(JOB_TIME_FORMAT)
+        end = reservation.end_time.strftime(JOB_TIME_FORMAT)
         db.session.delete(reservation)
+        bump_versions([resource_id], [current_user.id])
+        record_reservation(reservation, 'delete')
         try:
             db.session.commit()
         except:
             db.session.rollback()
+        else:
+            timelines.remove(current_user.id, id)
+            defer('refresh_usage', start=start, end=end)
+            hub.publish(resource_channel(resource_id), 'reservation_deleted',
+                        {'id': id})
     return redirect(url_for('.list'))
 
 ######################################################################
@@ -422,11 +584,14 @@ def delete_res(id):
 ######################################################################
 @app.route('/tags/<int:id>', methods=['GET'])
 @login_required
+@replica_reads
 def get_resources_with_tag(id):
     tag = db.session.query(Tag).get(id)
     if not tag:
         raise NotFound("tag with id '{}' was not found.".format(id))
-    resources = tag.resources
+    resources = resource_rows(
+        [Resource.id.in_(db.session.query(Tag_Resource.resource_id)
+                         .filter(Tag_Resource.tag_id == id).subquery())])
     return render_template(
         "list_tag_resource.html",
         resources=resources,
@@ -437,15 +602,14 @@ def get_resources_with_tag(id):
 ######################################################################
 @app.route('/users/<int:id>', methods=['GET'])
 @login_required
+@replica_reads
 def get_user(id):
     user = db.session.query(User).get(id)
     if not user:
         raise NotFound("user with id '{}' was not found.".format(id))
-    resources = [res for res in user.resources]
-    resources.sort(key=lambda x: x.last_reserve_time, reverse=True)
-    reservations = \
-        [res for res in user.reservations if res.end_time > datetime.now()]
-    reservations.sort(key=lambda x: x.start_time)
+    resources = resource_rows([Resource.owner_id == id],
+                              order_by=Resource.last_reserve_time.desc())
+    reservations = upcoming_rows([Reservation.user_id == id])
     return render_template(
         "list_user_info.html",
         resources=resources,
@@ -456,13 +620,12 @@ def get_user(id):
 ######################################################################
 @app.route('/resources/<int:id>/rss', methods=['GET'])
 @login_required
+@replica_reads
 def generate_rss(id):
     resource = db.session.query(Resource).get(id)
     if not resource:
         raise NotFound("resource with id '{}' was not found.".format(id))
-    reservations = \
-        [res for res in resource.reservations if res.end_time > datetime.now()]
-    reservations.sort(key=lambda x: x.start_time)
+    reservations = upcoming(resource.reservations)
     name = "All reservations for {}".format(resource.name)
     feed = AtomFeed(name, feed_url=request.url,
                     url=request.host_url, author="JX")
@@ -481,6 +644,7 @@ def generate_rss(id):
 ######################################################################
 @app.route('/search', methods=['GET', 'POST'])
 @login_required
+@limit('search')
 def search_resource():
     if request.method == 'GET':
         return render_template(
@@ -508,65 +672,355 @@ def search_resource():
             button="Search",
             message="You already have a reservation during that time",
             results=[])
-    results = []
-    for res in db.session.query(Resource).all():
-        if valid_res(start, end, res) == "":
-            results.append(res)
     return render_template(
         'form_res.html',
         action="Search Resource",
         button="Search",
         message="",
-        results=results)
+        results=available_resources(start, end))
+
 
 
+######################################################################
+#  B A C K G R O U N D  J O B S
+######################################################################
+JOB_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+@job('touch_resource')
+def touch_resource(id, time):
+    reserve_time = datetime.strptime(time, JOB_TIME_FORMAT)
+    # only move forward, jobs may run out of order
+    db.session.query(Resource) \
+        .filter(Resource.id == id) \
+        .filter(Resource.last_reserve_time < reserve_time) \
+        .update({'last_reserve_time': reserve_time},
+                synchronize_session=False)
+    db.session.commit()
+
+@job('delete_reservations')
+def delete_reservations(resource_id, batch_size):
+    '''
+    Delete the reservations of a resource, then the resource. A
+    reservation booked meanwhile fails the last commit and the job is
+    retried.
+    '''
+    # small batches keep each transaction, and its locks, short
+    while True:
+        ids = [row.id for row in db.session.query(Reservation.id)
+               .filter(Reservation.resource_id == resource_id)
+               .limit(batch_size)]
+        if not ids:
+            break
+        user_ids = reservation_user_ids(Reservation.id.in_(ids))
+        db.session.query(Reservation) \
+            .filter(Reservation.id.in_(ids)) \
+            .delete(synchronize_session=False)
+        bump_versions(user_ids=user_ids)
+        db.session.commit()
+        timelines.invalidate(user_ids)
+    resource = db.session.query(Resource).get(resource_id)
+    if resource is None:
+        return
+    delete_resource_rows(resource)
+    db.session.commit()
+    resource_deleted(resource_id)
 
 ######################################################################
 #  H E L P E R  F U N C T I O N S
 ######################################################################
+def upcoming(reservations, now=None):
+    '''
+    Reservations of a dynamic relationship not over yet, soonest first.
+    '''
+    return reservations \
+        .filter(Reservation.end_time > (now or datetime.now())) \
+        .order_by(Reservation.start_time) \
+        .all()
+
+def overlapping(reservations, start, end):
+    # an integer range check on (resource_id|user_id, end_time)
+    return reservations \
+        .filter(Reservation.end_time > start) \
+        .filter(Reservation.start_time < end)
+
 def valid_res(start, end, resource):
     if start > end:
         return "End must later than Start"
-    res_start = [int(x) for x in resource.available_start.split(':')]
-    res_end = [int(x) for x in resource.available_end.split(':')]
     if start < datetime.now():
         return "Start time can't be in the past"
-    if (start.hour < res_start[0] or \
-        (start.hour == res_start[0] and start.minute < res_start[1])):
+    start_minutes, end_minutes = window_minutes(start, end)
+    if start_minutes < to_minutes(resource.available_start):
         return "Start time is before the resource available start"
-    if (end.hour > res_end[0] or \
-        (end.hour == res_end[0] and end.minute > res_end[1])):
+    if end_minutes > to_minutes(resource.available_end):
         return "End time is after the resource available end"
-    for reservation in resource.reservations:
-        if reservation.end_time > start and reservation.start_time < end:
-            return "Reservation in that period, check below"
+    if overlapping(resource.reservations, start, end).first() is not None:
+        return "Reservation in that period, check below"
     return ""
 
-def valid_user_time(start, end, user):
-    for reservation in user.reservations:
-        if reservation.end_time > start and reservation.start_time < end:
-            return "You can only make one reservation at a time"
+def valid_user_time(start, end, user, confirm=False):
+    '''
+    The cached timeline only answers on its own when it finds the window
+    free and confirm is not set. Another worker may have booked or
+    cancelled since, so a conflict, or any answer before booking, is
+    checked against the database.
+    '''
+    conflict = timelines.conflicts(user.id, start, end)
+    if confirm or conflict is not False:
+        conflict = overlapping(user.reservations, start, end).first() \
+            is not None
+    if conflict:
+        return "You can only make one reservation at a time"
     return ""
 
+def available_resources(start, end):
+    '''
+    ResourceRows open for the whole window and not booked in it, empty
+    for a window in the past.
+    '''
+    if start > end or start < datetime.now():
+        return []
+    # check every resource's availability in one pass, then drop the
+    # ones booked in that window with a single query
+    resources = resource_rows(tags=False)
+    start_minutes, end_minutes = window_minutes(start, end)
+    windows = availability_windows(
+        [(res.available_start, res.available_end) for res in resources])
+    # no DISTINCT, it would make the planner walk a resource index
+    # instead of the upcoming reservations on ix_reservation_end
+    booked = set(resource_id for (resource_id,) in
+                 db.session.query(Reservation.resource_id)
+                 .filter(Reservation.end_time > start)
+                 .filter(Reservation.start_time < end))
+    return [resources[i] for i in
+            fitting_windows(start_minutes, end_minutes, windows)
+            if resources[i].id not in booked]
+
+def book(resource, user, start, end, duration):
+    '''
+    Reserve resource for user from start to end, duration is the "hh:mm"
+    asked for. Returns the committed reservation and "", or None and
+    why it couldn't be made.
+    '''
+    message = valid_booking(resource, user, start, end)
+    if message != "":
+        return None, message
+    reservation = Reservation()
+    reservation.deserialize({
+        'user_id': user.id,
+        'resource_id': resource.id,
+        'resource_name': resource.name,
+        'start_time': start,
+        'end_time': end,
+        'duration': duration})
+    db.session.add(reservation)
+    try:
+        db.session.flush()
+        record_reservation(reservation, 'insert')
+        db.session.commit()
+    except:
+        db.session.rollback()
+        return None, "Reservation could not be saved, please try again"
+    reservation_saved(reservation)
+    return reservation, ""
+
+def valid_booking(resource, user, start, end):
+    '''
+    Error message for booking or holding the window, empty when it is
+    free. Other users' holds are checked first, they turn a request
+    away without touching the reservation table.
+    '''
+    expires = held_until(resource.id, start, end, user.id)
+    if expires is not None:
+        booking_rejections.inc(check='hold')
+        return held_message(expires)
+    message = valid_res(start, end, resource)
+    if message != "":
+        booking_rejections.inc(check='valid_res')
+        return message
+    message = valid_user_time(start, end, user, confirm=True)
+    if message != "":
+        booking_rejections.inc(check='valid_user_time')
+    return message
+
+def reservation_saved(reservation):
+    # everything that follows a committed reservation
+    timelines.add(reservation.user_id, reservation)
+    hub.publish(resource_channel(reservation.resource_id),
+                'reservation_added', reservation_data(reservation))
+    # the resource row is hot, bump its last_reserve_time off the
+    # request path
+    defer('touch_resource', id=reservation.resource_id,
+          time=reservation.create_time.strftime(JOB_TIME_FORMAT))
+    defer('refresh_usage',
+          start=reservation.start_time.strftime(JOB_TIME_FORMAT),
+          end=reservation.end_time.strftime(JOB_TIME_FORMAT))
+
+def place_hold(resource, user, start, end):
+    '''
+    Hold the window for user for HOLD_TTL seconds. Returns the hold and
+    "", or None and why it can't be held.
+    '''
+    message = valid_booking(resource, user, start, end)
+    if message != "":
+        return None, message
+    return add_hold(resource.id, user.id, start, end), ""
+
+def confirm_hold(hold_id, user):
+    '''
+    Turn the user's hold into a reservation. Nobody else could take
+    the window, but its start may have passed and the user may have
+    booked something else at that time since. The resource is checked
+    by one conditional insert.
+    '''
+    hold = take_hold(hold_id, user.id)
+    resource = hold and db.session.query(Resource).get(hold.resource_id)
+    if resource is None:
+        db.session.rollback()
+        return None, "Your hold has expired, please try again"
+    if hold.start_time < datetime.now():
+        booking_rejections.inc(check='valid_res')
+        message = "Start time can't be in the past"
+    else:
+        message = valid_user_time(hold.start_time, hold.end_time, user,
+                                  confirm=True)
+        if message != "":
+            booking_rejections.inc(check='valid_user_time')
+    if message != "":
+        db.session.rollback()
+        return None, message
+    minutes = int((hold.end_time - hold.start_time).total_seconds() // 60)
+    values = {
+        'resource_id': resource.id,
+        'resource_name': resource.name,
+        'user_id': user.id,
+        'start_time': hold.start_time,
+        'end_time': hold.end_time,
+        'create_time': datetime.now(),
+        'duration': '{:02d}:{:02d}'.format(minutes // 60, minutes % 60)}
+    if not insert_reservation_if_free(values):
+        db.session.rollback()
+        return None, "Reservation in that period, check below"
+    reservation = db.session.query(Reservation) \
+        .filter(Reservation.resource_id == resource.id) \
+        .filter(Reservation.start_time == hold.start_time) \
+        .filter(Reservation.user_id == user.id) \
+        .order_by(Reservation.id.desc()).first()
+    record_reservation(reservation, 'insert')
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        return None, "Reservation could not be saved, please try again"
+    reservation_saved(reservation)
+    return reservation, ""
+
+def insert_reservation_if_free(values):
+    '''
+    INSERT ... SELECT ... WHERE NOT EXISTS an overlapping reservation,
+    the check and the write are one statement on the resource index.
+    Returns whether the row was inserted.
+    '''
+    table = Reservation.__table__
+    taken = exists().where(and_(
+        table.c.resource_id == values['resource_id'],
+        table.c.end_time > values['start_time'],
+        table.c.start_time < values['end_time']))
+    columns = sorted(values)
+    row = select([literal(values[name], table.c[name].type)
+                  for name in columns]).where(~taken)
+    return db.session.execute(
+        table.insert().from_select(columns, row)).rowcount == 1
+
+def reservation_user_ids(*criteria):
+    return [user_id for (user_id,) in
+            db.session.query(Reservation.user_id).filter(*criteria).distinct()]
+
 def convert_str_to_time(d, s, du):
-    date = [int(x) for x in d.split('-')]
-    start = [int(x) for x in s.split(':')]
-    duration = [int(x) for x in du.split(':')]
-    end = [start[0]+duration[0], start[1]+duration[1]]
-    if end[1] == 60:
-        end[0], end[1] = end[0] + 1, 0
-    res_s = datetime(date[0], date[1], date[2], start[0], start[1])
-    res_e = datetime(date[0], date[1], date[2], end[0], end[1])
-    return res_s, res_e
+    return parse_window(d, s, du)
+
+MAX_FREE_SLOT_DAYS = 31
+
+def find_free_slots(resource, first_day, last_day, now=None):
+    '''
+    Free windows of the resource between first_day and last_day
+    (inclusive), within its daily available_start - available_end.
+    One range query, then a single sweep over the sorted reservations.
+    '''
+    now = now or datetime.now()
+    open_minutes = to_minutes(resource.available_start)
+    close_minutes = to_minutes(resource.available_end)
+    range_start = datetime.combine(first_day, datetime.min.time())
+    range_end = datetime.combine(last_day + timedelta(days=1),
+                                 datetime.min.time())
+    reservations = resource.reservations \
+        .filter(Reservation.end_time > max(range_start, now)) \
+        .filter(Reservation.start_time < range_end) \
+        .order_by(Reservation.start_time) \
+        .all()
+    windows = []
+    day = first_day
+    while day <= last_day:
+        midnight = datetime.combine(day, datetime.min.time())
+        windows.append((midnight + timedelta(minutes=open_minutes),
+                        midnight + timedelta(minutes=close_minutes)))
+        day += timedelta(days=1)
+    return [{'date': start.strftime('%Y-%m-%d'),
+             'start': start.strftime('%H:%M'),
+             'end': end.strftime('%H:%M'),
+             'minutes': int((end - start).total_seconds() // 60)}
+            for start, end in sweep_free_slots(windows, reservations, now)]
+
+def busy_intervals(resources, user, window_start, window_end,
+                   first_day, last_day):
+    '''
+    One sorted busy list per resource (its reservations plus the hours
+    it is closed) and one for the user's own reservations.
+    '''
+    busy = dict((res.id, closed_intervals(
+                    to_minutes(res.available_start),
+                    to_minutes(res.available_end),
+                    first_day, last_day))
+                for res in resources)
+    rows = db.session.query(Reservation.resource_id,
+                            Reservation.start_time,
+                            Reservation.end_time) \
+        .filter(Reservation.resource_id.in_(busy.keys())) \
+        .filter(Reservation.end_time > window_start) \
+        .filter(Reservation.start_time < window_end)
+    for resource_id, start, end in rows:
+        busy[resource_id].append((start, end))
+    mine = db.session.query(Reservation.start_time, Reservation.end_time) \
+        .filter(Reservation.user_id == user.id) \
+        .filter(Reservation.end_time > window_start) \
+        .filter(Reservation.start_time < window_end) \
+        .order_by(Reservation.start_time)
+    busy_lists = [sorted(intervals) for intervals in busy.values()]
+    busy_lists.append([(start, end) for start, end in mine])
+    return busy_lists
+
+def sweep_free_slots(windows, reservations, now):
+    '''
+    windows and reservations are both sorted by start time, so each
+    reservation is looked at about once whatever the number of days.
+    '''
+    slots = []
+    first = 0
+    for open_time, close_time in windows:
+        while first < len(reservations) and \
+            reservations[first].end_time <= open_time:
+            first += 1
+        cursor = max(open_time, now)
+        i = first
+        while i < len(reservations) and \
+            reservations[i].start_time < close_time:
+            reservation = reservations[i]
+            if reservation.start_time > cursor:
+                slots.append((cursor, reservation.start_time))
+            cursor = max(cursor, reservation.end_time)
+            i += 1
+        if cursor < close_time:
+            slots.append((cursor, close_time))
+    return slots
 
 def valid_resource_time(start, end):
-    if not re.match(r'\d{2}:\d{2}', start) \
-        or not re.match(r'\d{2}:\d{2}', end):
-        return "Input Invalid"
-    start_arr = [int(x) for x in start.split(':')]
-    end_arr = [int(x) for x in end.split(':')]
-    start_temp = datetime(2017, 5, 21, start_arr[0], start_arr[1])
-    end_temp = datetime(2017, 5, 21, end_arr[0], end_arr[1])
-    if start_temp >= end_temp:
-        return "Start time should be before End time"
-    return ""
+    return valid_availability(start, end)
@@ -0,0 +1,282 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask.sessions import SessionInterface, SecureCookieSessionInterface, \
+    SecureCookieSession, SessionMixin, session_json_serializer
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.datastructures import CallbackDict
+from jobs import job, queue
+from . import app
+
+# --------------------- Session configuration ------------------------
+# a session ends this long after its cookie was last written
+app.config.setdefault('SESSION_LIFETIME', timedelta(minutes=10))
+# fraction of the lifetime after which a request renews the cookie,
+# unchanged sessions are not written back before that. An idle user is
+# logged out between (1 - SESSION_REFRESH_AFTER) * SESSION_LIFETIME and
+# SESSION_LIFETIME after their last request
+app.config.setdefault('SESSION_REFRESH_AFTER', 0.5)
+# None keeps the session in the signed cookie, 'memory' or 'sqlite'
+# keep it on the server and only its id in the cookie
+app.config.setdefault('SESSION_STORE', None)
+# sessions kept by the memory store, the least recently used go first
+app.config.setdefault('SESSION_STORE_SIZE', 10000)
+app.config.setdefault('SESSION_SQLITE_PATH',
+                      os.path.join(app.root_path, 'db', 'sessions.db'))
+# seconds between purges of expired sessions from the sqlite store
+app.config.setdefault('SESSION_PURGE_INTERVAL', 3600)
+# --------------------- End of Session configuration -----------------
+
+def lifetime_seconds(app):
+    return app.permanent_session_lifetime.total_seconds()
+
+def needs_refresh(app, issued):
+    '''True when a cookie signed at issued (utc) is close to expiry.'''
+    if issued is None:
+        return True
+    age = (datetime.utcnow() - issued).total_seconds()
+    return age >= lifetime_seconds(app) * app.config['SESSION_REFRESH_AFTER']
+
+
+class SlidingSession(SecureCookieSession):
+    # when the cookie the session came from was signed
+    issued = None
+
+
+class SlidingSessionInterface(SecureCookieSessionInterface):
+    '''
+    Signed cookie sessions that expire SESSION_LIFETIME after the cookie
+    was signed. The cookie is written when the session changed or when
+    it is past SESSION_REFRESH_AFTER of its lifetime, not on every
+    response, so a request only extends the session from then on.
+    '''
+    session_class = SlidingSession
+
+    def open_session(self, app, request):
+        s = self.get_signing_serializer(app)
+        if s is None:
+            return None
+        val = request.cookies.get(app.session_cookie_name)
+        if not val:
+            return self.session_class()
+        try:
+            data, issued = s.loads(val, max_age=lifetime_seconds(app),
+                                   return_timestamp=True)
+        except BadSignature:
+            return self.session_class()
+        session = self.session_class(data)
+        session.issued = issued
+        return session
+
+    def get_expiration_time(self, app, session):
+        # every session slides, there are no browser session cookies
+        return datetime.utcnow() + app.permanent_session_lifetime
+
+    def should_set_cookie(self, app, session):
+        return session.modified or needs_refresh(app, session.issued)
+
+
+######################################################################
+# Server side stores, values are serialized sessions
+######################################################################
+class MemoryStore(object):
+    '''
+    Sessions of this process only, so every worker has its own. Fine
+    for a single process, use the sqlite store otherwise.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._sessions.pop(sid, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._sessions[sid] = entry
+            return entry[0]
+
+    def set(self, sid, value, expires):
+        with self._lock:
+            self._sessions.pop(sid, None)
+            self._sessions[sid] = (value, expires)
+            while len(self._sessions) > self.size:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def purge(self):
+        with self._lock:
+            now = time.time()
+            for sid, (value, expires) in self._sessions.items():
+                if expires <= now:
+                    del self._sessions[sid]
+
+
+class SqliteStore(object):
+    '''Sessions shared by the processes of one host.'''
+
+    def __init__(self, path):
+        self.path = path
+        conn = self.connect()
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS session ('
+                         'id VARCHAR(32) PRIMARY KEY, '
+                         'data TEXT NOT NULL, '
+                         'expires REAL NOT NULL)')
+        finally:
+            conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def get(self, sid):
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                'SELECT data FROM session WHERE id = ? AND expires > ?',
+                (sid, time.time())).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def set(self, sid, value, expires):
+        conn = self.connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO session (id, data, expires) '
+                         'VALUES (?, ?, ?)', (sid, value, expires))
+        finally:
+            conn.close()
+
+    def delete(self, sid):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM session WHERE id = ?', (sid,))
+        finally:
+            conn.close()
+
+    def purge(self):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM session WHERE expires <= ?',
+                         (time.time(),))
+        finally:
+            conn.close()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, issued=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.issued = issued
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    '''
+    Sessions kept in a store, the cookie only carries the signed session
+    id. Like SlidingSessionInterface it is renewed when close to expiry.
+    '''
+    salt = 'session-id'
+    serializer = session_json_serializer
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_signing_serializer(self, app):
+        if not app.secret_key:
+            return None
+        return URLSafeTimedSerializer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        s = self.get_signing_serializer(app)
+        if s is None:
+            return None
+        val = request.cookies.get(app.session_cookie_name)
+        if not val:
+            return ServerSession()
+        try:
+            sid, issued = s.loads(val, max_age=lifetime_seconds(app),
+                                  return_timestamp=True)
+        except BadSignature:
+            return ServerSession()
+        data = self.store.get(sid)
+        if data is None:
+            return ServerSession()
+        return ServerSession(self.serializer.loads(data), sid, issued)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                if session.sid is not None:
+                    self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+        refresh = needs_refresh(app, session.issued)
+        if not (session.modified or refresh):
+            return
+        if session.sid is None:
+            session.sid = uuid.uuid4().hex
+        self.store.set(session.sid, self.serializer.dumps(dict(session)),
+                       time.time() + lifetime_seconds(app))
+        if refresh:
+            response.set_cookie(
+                app.session_cookie_name,
+                self.get_signing_serializer(app).dumps(session.sid),
+                expires=datetime.utcnow() + app.permanent_session_lifetime,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app))
+
+
+def init_app(app):
+    '''Configure the sessions once, call it before serving requests.'''
+    app.permanent_session_lifetime = app.config['SESSION_LIFETIME']
+    store = app.config['SESSION_STORE']
+    if store == 'memory':
+        app.session_interface = ServerSideSessionInterface(
+            MemoryStore(app.config['SESSION_STORE_SIZE']))
+    elif store == 'sqlite':
+        app.session_interface = ServerSideSessionInterface(
+            SqliteStore(app.config['SESSION_SQLITE_PATH']))
+    elif store is None:
+        app.session_interface = SlidingSessionInterface()
+    else:
+        raise ValueError('Unknown session store: {}'.format(store))
+
+@job('purge_sessions')
+def purge_sessions():
+    store = getattr(app.session_interface, 'store', None)
+    if store is not None:
+        store.purge()
+
+queue.every(app.config['SESSION_PURGE_INTERVAL'], 'purge_sessions',
+            per_tenant=False)
@@ -0,0 +1,91 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+from flask import g, session, has_app_context
+from . import app
+
+# --------------------- Tenant configuration -------------------------
+# database uri of every tenant by name, empty keeps everybody in
+# SQLALCHEMY_DATABASE_URI
+app.config.setdefault('TENANT_DATABASES', {})
+# tenant of the users by email domain, unknown domains use the default
+# database
+app.config.setdefault('TENANT_DOMAINS', {})
+# connections each tenant may hold, a busy tenant waits on its own pool
+app.config.setdefault('TENANT_POOL_SIZE', 5)
+app.config.setdefault('TENANT_MAX_OVERFLOW', 5)
+# seconds to wait for a connection of the tenant's pool
+app.config.setdefault('TENANT_POOL_TIMEOUT', 10)
+# pool size of single tenants, by name, overriding TENANT_POOL_SIZE
+app.config.setdefault('TENANT_POOL_SIZES', {})
+# --------------------- End of Tenant configuration ------------------
+
+# session key holding the tenant of the logged in user
+SESSION_KEY = '_tenant'
+
+def tenant_names():
+    return sorted(app.config['TENANT_DATABASES'])
+
+def tenant_for_email(email):
+    '''Name of the tenant owning email's domain, None for the default.'''
+    domain = (email or '').rpartition('@')[2].lower()
+    tenant = app.config['TENANT_DOMAINS'].get(domain)
+    return tenant if tenant in app.config['TENANT_DATABASES'] else None
+
+def current_tenant():
+    return g.get('tenant') if has_app_context() else None
+
+def use_tenant(tenant):
+    '''
+    Send the queries of this app context to tenant's database, None for
+    the default one. Switching drops the database session, the objects
+    it loaded, e.g. the logged in user, come from the other database and
+    their ids mean other rows in this one.
+    '''
+    if tenant is not None and tenant not in app.config['TENANT_DATABASES']:
+        raise KeyError('Unknown tenant: ' + tenant)
+    if tenant != current_tenant():
+        # models imports this module through routing
+        from models import db
+        db.session.remove()
+    g.tenant = tenant
+
+def tenant_key(id):
+    '''
+    Key of an id in a process wide cache, ids of different tenants
+    collide.
+    '''
+    tenant = current_tenant()
+    return id if tenant is None else (tenant, id)
+
+@app.before_request
+def load_tenant():
+    tenant = session.get(SESSION_KEY)
+    if tenant is not None and tenant not in app.config['TENANT_DATABASES']:
+        # the tenant was removed, its user ids mean nothing anymore
+        session.clear()
+        tenant = None
+    g.tenant = tenant
+
+def remember_tenant():
+    '''Keep the current tenant for the user's next requests.'''
+    tenant = current_tenant()
+    if tenant is None:
+        forget_tenant()
+    else:
+        session[SESSION_KEY] = tenant
+
+def forget_tenant():
+    session.pop(SESSION_KEY, None)
@@ -0,0 +1,153 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from models import db, Reservation
+from tenants import tenant_key
+from metrics import cache_lookups
+from . import app
+
+# --------------------- Timeline cache configuration -----------------
+app.config.setdefault('TIMELINE_CACHE_ENABLED', True)
+# number of users whose timeline is kept
+app.config.setdefault('TIMELINE_CACHE_SIZE', 10000)
+# seconds before a timeline is reloaded, other worker processes don't
+# see this process's write-through updates
+app.config.setdefault('TIMELINE_CACHE_TTL', 60)
+# --------------------- End of Timeline cache configuration ----------
+
+
+class Timeline(object):
+    '''
+    A user's upcoming reservations sorted by start. max_ends[i] is the
+    latest end among the first i + 1 reservations, so one bisect answers
+    whether a window overlaps any of them. Updates build new lists and
+    swap them in, readers never see a half built index.
+    '''
+    __slots__ = ('horizon', 'expires', 'entries', 'index')
+
+    def __init__(self, entries, horizon, expires):
+        self.horizon = horizon
+        self.expires = expires
+        self._set(sorted(entries))
+
+    def _set(self, entries):
+        starts, max_ends = [], []
+        latest = None
+        for start, end, id in entries:
+            latest = end if latest is None else max(latest, end)
+            starts.append(start)
+            max_ends.append(latest)
+        self.entries = entries
+        self.index = (starts, max_ends)
+
+    def add(self, start, end, id):
+        entries = list(self.entries)
+        bisect.insort(entries, (start, end, id))
+        self._set(entries)
+
+    def remove(self, id):
+        self._set([entry for entry in self.entries if entry[2] != id])
+
+    def conflicts(self, start, end):
+        '''
+        True when [start, end) overlaps a reservation, None when the
+        window reaches back before what was loaded.
+        '''
+        if start < self.horizon:
+            return None
+        starts, max_ends = self.index
+        i = bisect.bisect_left(starts, end)
+        return i > 0 and max_ends[i - 1] > start
+
+
+class TimelineCache(object):
+    '''
+    LRU cache of Timelines by tenant and user id, updated in place by add_res and
+    delete_res and dropped whenever reservations change in bulk.
+    '''
+    def __init__(self):
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every change, a timeline loaded while a change went
+        # through may already be stale and is not kept
+        self._version = 0
+
+    def load(self, user_id):
+        now = datetime.now()
+        rows = db.session.query(Reservation.start_time,
+                                Reservation.end_time,
+                                Reservation.id) \
+            .filter(Reservation.user_id == user_id) \
+            .filter(Reservation.end_time > now)
+        return Timeline([tuple(row) for row in rows], now,
+                        time.time() + app.config['TIMELINE_CACHE_TTL'])
+
+    def get(self, user_id):
+        key = tenant_key(user_id)
+        with self._lock:
+            timeline = self._timelines.pop(key, None)
+            if timeline is not None and timeline.expires > time.time():
+                self._timelines[key] = timeline
+                cache_lookups.inc(cache='timeline', result='hit')
+                return timeline
+            version = self._version
+        cache_lookups.inc(cache='timeline', result='miss')
+        timeline = self.load(user_id)
+        with self._lock:
+            if version != self._version:
+                return timeline
+            self._timelines[key] = timeline
+            while len(self._timelines) > app.config['TIMELINE_CACHE_SIZE']:
+                self._timelines.popitem(last=False)
+        return timeline
+
+    def conflicts(self, user_id, start, end):
+        if not app.config['TIMELINE_CACHE_ENABLED']:
+            return None
+        return self.get(user_id).conflicts(start, end)
+
+    def add(self, user_id, reservation):
+        with self._lock:
+            self._version += 1
+            timeline = self._timelines.get(tenant_key(user_id))
+            if timeline is not None:
+                timeline.add(reservation.start_time, reservation.end_time,
+                             reservation.id)
+
+    def remove(self, user_id, reservation_id):
+        with self._lock:
+            self._version += 1
+            timeline = self._timelines.get(tenant_key(user_id))
+            if timeline is not None:
+                timeline.remove(reservation_id)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._version += 1
+            for user_id in user_ids:
+                self._timelines.pop(tenant_key(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._timelines.clear()
+
+
+timelines = TimelineCache()
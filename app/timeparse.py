@@ -0,0 +1,143 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import wraps
+
+TIME_RE = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*$')
+# resource availability must be written as hh:mm
+STRICT_TIME_RE = re.compile(r'^(\d{2}):(\d{2})$')
+DATE_RE = re.compile(r'^\s*(\d{4})-(\d{1,2})-(\d{1,2})\s*$')
+
+MINUTES_PER_DAY = 24 * 60
+
+def lru_cache(maxsize=1024):
+    '''
+    Least recently used cache for functions of hashable arguments,
+    functools.lru_cache only exists on python 3.
+    '''
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+        stats = {'hits': 0, 'misses': 0}
+
+        @wraps(func)
+        def wrapper(*args):
+            with lock:
+                if args in cache:
+                    stats['hits'] += 1
+                    value = cache.pop(args)
+                    cache[args] = value
+                    return value
+                stats['misses'] += 1
+            value = func(*args)
+            with lock:
+                cache[args] = value
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats.update(hits=0, misses=0)
+
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_info = lambda: dict(stats, size=len(cache))
+        return wrapper
+    return decorator
+
+######################################################################
+# Scalar parsing
+######################################################################
+@lru_cache(maxsize=4096)
+def to_minutes(value):
+    '''
+    "hh:mm" to minutes after midnight, "h:mm" is accepted as well.
+    Raises ValueError for anything else.
+    '''
+    match = TIME_RE.match(value)
+    if not match:
+        raise ValueError("invalid time '{}'".format(value))
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if minute >= 60:
+        raise ValueError("invalid time '{}'".format(value))
+    return hour * 60 + minute
+
+def parse_date(value):
+    match = DATE_RE.match(value)
+    if not match:
+        raise ValueError("invalid date '{}'".format(value))
+    return date(*[int(x) for x in match.groups()])
+
+def parse_window(d, s, du):
+    '''
+    Date, start "hh:mm" and duration "hh:mm" to (start, end) datetimes.
+    The duration is added as minutes so 10:45 + 00:30 ends at 11:15,
+    and a window running past midnight ends on the next day.
+    '''
+    start_minutes = to_minutes(s)
+    if start_minutes >= MINUTES_PER_DAY:
+        raise ValueError("invalid time '{}'".format(s))
+    midnight = datetime.combine(parse_date(d), datetime.min.time())
+    start = midnight + timedelta(minutes=start_minutes)
+    return start, start + timedelta(minutes=to_minutes(du))
+
+def window_minutes(start, end):
+    '''
+    start and end as minutes after midnight of the start day, end can
+    go past MINUTES_PER_DAY.
+    '''
+    midnight = datetime.combine(start.date(), datetime.min.time())
+    return (int((start - midnight).total_seconds() // 60),
+            int((end - midnight).total_seconds() // 60))
+
+def valid_availability(start, end):
+    '''
+    Error message for a resource's available_start / available_end,
+    empty when they are fine.
+    '''
+    if not STRICT_TIME_RE.match(start) or not STRICT_TIME_RE.match(end):
+        return "Input Invalid"
+    try:
+        start_minutes, end_minutes = to_minutes(start), to_minutes(end)
+    except ValueError:
+        return "Input Invalid"
+    if start_minutes >= MINUTES_PER_DAY or end_minutes >= MINUTES_PER_DAY:
+        return "Input Invalid"
+    if start_minutes >= end_minutes:
+        return "Start time should be before End time"
+    return ""
+
+######################################################################
+# Batched checks
+######################################################################
+def availability_windows(pairs):
+    '''
+    [(available_start, available_end)] to [(open, close)] in minutes,
+    the strings repeat a lot so the cache does most of the work.
+    '''
+    return [(to_minutes(open_), to_minutes(close)) for open_, close in pairs]
+
+def fitting_windows(start_minutes, end_minutes, windows):
+    '''
+    Indexes of the (open, close) windows the requested window fits in,
+    one pass over the list.
+    '''
+    return [i for i, (open_, close) in enumerate(windows)
+            if open_ <= start_minutes and end_minutes <= close]
@@ -0,0 +1,46 @@
+######################################################################
+# Copyright 2017 Jiwei Xu. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+# gunicorn -c gunicorn_config.py run:app
+#
+# WORKER_CLASS=gevent runs every request in a greenlet, a request
+# waiting on the database or on /resources/<id>/events then costs a
+# few kilobytes instead of a whole worker. It needs gevent, and
+# psycogreen for postgresql; pymysql is pure python and cooperates once
+# gevent has patched the socket module. sqlite calls still block.
+import os
+
+bind = '0.0.0.0:' + os.getenv('PORT', '8080')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = os.getenv('WORKER_CLASS', 'sync')
+# requests in flight per async worker
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+# event streams stay open for EVENTS_STREAM_TIMEOUT, async workers only
+# stream, sync workers keep gunicorn's default to be killed when stuck
+timeout = 330 if worker_class != 'sync' else 30
+
+def on_starting(server):
+    # counters of the workers of an earlier run would be added to ours
+    directory = os.getenv('METRICS_DIR')
+    if directory:
+        for name in os.listdir(directory):
+            if name.startswith('metrics-'):
+                os.remove(os.path.join(directory, name))
+
+def post_fork(server, worker):
+    if worker_class == 'gevent' and \
+        os.getenv('HEROKU_POSTGRESQL_CYAN_URL'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,98 @@
+import unittest
+import json
+from datetime import date, timedelta
+import app
+from app.models import db, User, Resource, Reservation
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(SERVER_NAME='localhost')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "08:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        self.test_resource_id = resource.id
+        self.day = (date.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/login',
+                         data={ 'email': "a@a.com",
+                                'password': "hard_to_guess_pw"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def book(self, start, duration="01:00"):
+        return self.client.post(
+            '/api/resources/{}/reservations'.format(self.test_resource_id),
+            data=json.dumps({'date': self.day, 'start': start,
+                             'duration': duration}),
+            content_type='application/json')
+
+    def search(self, start, duration="01:00"):
+        return self.client.get('/api/search?date={}&start={}&duration={}'
+                               .format(self.day, start, duration))
+
+    def test_search(self):
+        response = self.search("10:00")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([res['name'] for res in
+                          json.loads(response.data)['resources']],
+                         ["test_res"])
+        response = self.search("16:30")
+        self.assertEqual(json.loads(response.data)['resources'], [])
+
+    def test_search_invalid_input(self):
+        response = self.client.get('/api/search?date=tomorrow')
+        self.assertEqual(response.status_code, 400)
+
+    def test_book(self):
+        response = self.book("10:00")
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)['reservation']
+        self.assertEqual(data['start_time'], self.day + " 10:00")
+        self.assertEqual(Reservation.query.count(), 1)
+        # the user already has a reservation then
+        self.assertEqual(self.search("10:30").status_code, 409)
+
+    def test_book_conflict(self):
+        self.book("10:00")
+        response = self.book("10:30")
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue("error" in json.loads(response.data))
+        self.assertEqual(Reservation.query.count(), 1)
+
+    def test_book_with_form_body(self):
+        response = self.client.post(
+            '/api/resources/{}/reservations'.format(self.test_resource_id),
+            data={'date': self.day, 'start': "9:00", 'duration': "00:30"})
+        self.assertEqual(response.status_code, 201)
+
+    def test_book_unknown_resource(self):
+        response = self.client.post('/api/resources/999/reservations',
+                                    data={'date': self.day})
+        self.assertEqual(response.status_code, 404)
+
+    def test_free_slots(self):
+        self.book("10:00")
+        response = self.client.get(
+            '/api/resources/{}/free_slots?date={}'
+            .format(self.test_resource_id, self.day))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['slots']), 2)
+
+if __name__ == '__main__':
+    unittest.main()
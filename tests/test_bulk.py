@@ -0,0 +1,151 @@
+import unittest
+import json
+from StringIO import StringIO
+from datetime import datetime
+import app
+from app import bulk
+from app.models import db, User, Reservation, Resource, Tag, Change
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(SERVER_NAME='localhost')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        self.test_user_id = user.id
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        self.app.config['ADMIN_EMAILS'] = []
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login_as_admin(self):
+        self.app.config['ADMIN_EMAILS'] = ["a@a.com"]
+        self.client.post('/login',
+                         data={ 'email': "a@a.com",
+                                'password': "hard_to_guess_pw"})
+
+    def resources_csv(self, count):
+        lines = ["name,owner_id,available_start,available_end"]
+        for i in range(count):
+            lines.append("res_{},{},08:00,17:00".format(i, self.test_user_id))
+        return "\n".join(lines) + "\n"
+
+    def test_import_resources_csv_in_chunks(self):
+        result = bulk.import_rows('resources', StringIO(self.resources_csv(25)),
+                                  'csv', chunk_size=10)
+        self.assertEqual(result.inserted, 25)
+        self.assertEqual(result.error_count, 0)
+        self.assertEqual(Resource.query.count(), 25)
+        self.assertEqual(Resource.query.filter_by(name='res_24').first()
+                         .available_end, '17:00')
+
+    def test_import_records_reset_per_chunk(self):
+        bulk.import_rows('resources', StringIO(self.resources_csv(25)),
+                         'csv', chunk_size=10)
+        # one per chunk, a mirror reloading mid-import sees the next one
+        self.assertEqual([(c.kind, c.op) for c in Change.query],
+                         [('resource', 'reset')] * 3)
+        data = ("name,owner_id,available_start,available_end\n"
+                "bad_owner,99999,08:00,17:00\n")
+        result = bulk.import_rows('resources', StringIO(data), 'csv')
+        self.assertEqual(result.error_count, 1)
+        self.assertEqual(Change.query.count(), 3)
+
+    def test_import_reports_row_errors(self):
+        data = ("name,owner_id,available_start,available_end\n"
+                "ok,{0},08:00,17:00\n"
+                "bad_time,{0},18:00,17:00\n"
+                "bad_owner,99999,08:00,17:00\n"
+                ",{0},08:00,17:00\n").format(self.test_user_id)
+        result = bulk.import_rows('resources', StringIO(data), 'csv')
+        self.assertEqual(result.inserted, 1)
+        self.assertEqual(result.error_count, 3)
+        self.assertEqual([e['line'] for e in result.errors], [3, 5, 4])
+        self.assertTrue("owner_id '99999' does not exist" in
+                        result.errors[2]['error'])
+
+    def test_import_upserts_by_id(self):
+        bulk.import_rows('resources', StringIO(self.resources_csv(1)), 'csv')
+        resource = Resource.query.first()
+        data = ('{{"id": {}, "name": "renamed", "owner_id": {}, '
+                '"available_start": "09:00", "available_end": "10:00"}}\n'
+                'not json\n').format(resource.id, self.test_user_id)
+        result = bulk.import_rows('resources', StringIO(data), 'jsonl')
+        self.assertEqual(result.updated, 1)
+        self.assertEqual(result.inserted, 0)
+        self.assertEqual(result.error_count, 1)
+        db.session.expire_all()
+        self.assertEqual(Resource.query.get(resource.id).name, "renamed")
+
+    def test_import_tags_by_natural_key(self):
+        db.session.add(Tag("room"))
+        db.session.commit()
+        result = bulk.import_rows('tags', StringIO("value\nRoom\ncar\ncar\n"),
+                                  'csv')
+        self.assertEqual(result.inserted, 1)
+        self.assertEqual(result.skipped, 2)
+        self.assertEqual(sorted(t.value for t in Tag.query), ["car", "room"])
+
+    def test_import_tag_resources_and_reservations(self):
+        bulk.import_rows('resources', StringIO(self.resources_csv(1)), 'csv')
+        bulk.import_rows('tags', StringIO("value\nroom\n"), 'csv')
+        resource, tag = Resource.query.first(), Tag.query.first()
+        data = "resource_id,tag_id\n{0},{1}\n{0},{1}\n".format(resource.id, tag.id)
+        result = bulk.import_rows('tag_resources', StringIO(data), 'csv')
+        self.assertEqual((result.inserted, result.skipped), (1, 1))
+        data = ("resource_id,resource_name,user_id,start_time,end_time,duration\n"
+                "{},res_0,{},2017-05-21 10:00,2017-05-21T11:00:00,01:00\n"
+                ).format(resource.id, self.test_user_id)
+        result = bulk.import_rows('reservations', StringIO(data), 'csv')
+        self.assertEqual(result.inserted, 1)
+        reservation = Reservation.query.first()
+        self.assertEqual(reservation.end_time, datetime(2017, 5, 21, 11))
+        self.assertTrue(reservation.create_time is not None)
+
+    def test_export_round_trip(self):
+        bulk.import_rows('resources', StringIO(self.resources_csv(3)), 'csv')
+        exported = "".join(bulk.export_rows('resources', 'jsonl'))
+        rows = [json.loads(line) for line in exported.splitlines()]
+        self.assertEqual([row['name'] for row in rows],
+                         ['res_0', 'res_1', 'res_2'])
+        exported = "".join(bulk.export_rows('resources', 'csv'))
+        self.assertEqual(exported.splitlines()[0],
+                         "id,name,owner_id,available_start,available_end,"
+                         "last_reserve_time")
+        self.assertEqual(len(exported.splitlines()), 4)
+
+    def test_http_export_and_import(self):
+        self.login_as_admin()
+        response = self.client.post('/import/resources',
+                                    data={'file': (StringIO(self.resources_csv(2)),
+                                                   'resources.csv')})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['inserted'], 2)
+        response = self.client.get('/export/resources?format=jsonl')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data.splitlines()), 2)
+
+    def test_http_bulk_requires_admin(self):
+        self.client.post('/login',
+                         data={ 'email': "a@a.com",
+                                'password': "hard_to_guess_pw"})
+        response = self.client.get('/export/resources')
+        self.assertEqual(response.status_code, 403)
+
+    def test_http_unknown_table_or_format(self):
+        self.login_as_admin()
+        response = self.client.get('/export/users')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/import/resources',
+                                    data={'file': (StringIO(""), 'resources.xls')})
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
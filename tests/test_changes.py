@@ -0,0 +1,100 @@
+import json
+import unittest
+from datetime import date, timedelta
+import app
+from app.models import db, User, Change
+
+class TestChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config['ADMIN_EMAILS'] = ["a@a.com"]
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        for email in ("a@a.com", "b@b.com"):
+            db.session.add(User(email, "hard_to_guess_pw"))
+        db.session.commit()
+        self.client = self.login("a@a.com")
+        self.day = (date.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    def tearDown(self):
+        self.app.config['ADMIN_EMAILS'] = []
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, email):
+        client = self.app.test_client(use_cookies=True)
+        client.post('/login', data={'email': email,
+                                    'password': "hard_to_guess_pw"})
+        return client
+
+    def add_resource(self):
+        self.client.post('/resources/add', data={'name': "res",
+                                                 'available_start': "08:00",
+                                                 'available_end': "17:00",
+                                                 'tag': "room"})
+
+    def book(self, start):
+        return self.client.post('/resources/1/add_reservation',
+                                data={'date': self.day, 'start': start,
+                                      'duration': "01:00"})
+
+    def changes(self, query=''):
+        response = self.client.get('/changes' + query)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_mutations_are_logged_in_order(self):
+        self.add_resource()
+        self.client.post('/resources/1/edit', data={'available_start': "09:00",
+                                                    'available_end': "17:00",
+                                                    'tag': "room big"})
+        self.book("10:00")
+        self.client.post('/reservations/1/delete')
+        self.client.get('/resources/1/delete')
+        body = self.changes()
+        self.assertEqual([(c['kind'], c['op'], c['id'])
+                          for c in body['changes']],
+                         [('resource', 'insert', 1),
+                          ('resource', 'update', 1),
+                          ('reservation', 'insert', 1),
+                          ('reservation', 'delete', 1),
+                          ('resource', 'delete', 1)])
+        self.assertEqual(body['changes'][1]['data']['tags'],
+                         ["room", "big"])
+        self.assertEqual(body['changes'][2]['data']['start_time'],
+                         self.day + " 10:00")
+        seqs = [c['seq'] for c in body['changes']]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(body['next'], seqs[-1])
+        self.assertFalse(body['more'])
+
+    def test_cursor(self):
+        self.add_resource()
+        self.book("10:00")
+        self.book("12:00")
+        first = self.changes('?since=0&limit=2')
+        self.assertEqual(len(first['changes']), 2)
+        self.assertTrue(first['more'])
+        rest = self.changes('?since={}'.format(first['next']))
+        self.assertEqual([c['op'] for c in rest['changes']], ['insert'])
+        self.assertFalse(rest['more'])
+        last = self.changes('?since={}'.format(rest['next']))
+        self.assertEqual(last['changes'], [])
+        self.assertEqual(last['next'], rest['next'])
+
+    def test_rejected_change_is_not_logged(self):
+        self.add_resource()
+        self.book("10:00")
+        self.book("10:30")
+        self.assertEqual(Change.query.count(), 2)
+
+    def test_admins_only(self):
+        other = self.login("b@b.com")
+        self.assertEqual(other.get('/changes').status_code, 403)
+        self.assertEqual(self.client.get('/changes?since=-1').status_code,
+                         400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import gzip
+import zlib
+from StringIO import StringIO
+import app
+from app import compress
+from app.models import db, User, Resource
+
+class TestCompress(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(SERVER_NAME='localhost')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.setup_dummy_data()
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/login',
+                         data={ 'email': "a@a.com",
+                                'password': "hard_to_guess_pw"})
+        compress.reset_stats()
+
+    def tearDown(self):
+        self.app.config['COMPRESS_MIN_SIZE'] = 500
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_home_page_is_gzipped(self):
+        response = self.client.get('/home',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertTrue('Accept-Encoding' in response.headers['Vary'])
+        body = gzip.GzipFile(fileobj=StringIO(response.data)).read()
+        self.assertTrue("test_res" in body)
+        stats = compress.get_stats()
+        self.assertEqual(stats['responses'], 1)
+        self.assertTrue(stats['bytes_out'] < stats['bytes_in'])
+
+    def test_no_accept_encoding_is_not_compressed(self):
+        response = self.client.get('/home')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('Content-Encoding' not in response.headers)
+        self.assertTrue("test_res" in response.data)
+
+    def test_refused_encoding_is_not_compressed(self):
+        response = self.client.get('/home',
+                                   headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertTrue('Content-Encoding' not in response.headers)
+
+    def test_small_response_is_not_compressed(self):
+        self.app.config['COMPRESS_MIN_SIZE'] = 10 ** 6
+        response = self.client.get('/home',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue('Content-Encoding' not in response.headers)
+        self.assertEqual(compress.get_stats()['skipped'], 1)
+
+    def test_rss_feed_is_gzipped(self):
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/rss',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        body = gzip.GzipFile(fileobj=StringIO(response.data)).read()
+        self.assertTrue("All reservations for test_res" in body)
+
+    def test_static_file_is_not_compressed(self):
+        response = self.client.get('/static/jquery.timepicker.css',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('Content-Encoding' not in response.headers)
+        response.close()
+
+    def test_compress_stream(self):
+        chunks = ["a" * 1000, "", "b" * 1000]
+        out = "".join(compress.compress_stream(iter(chunks), 'gzip'))
+        self.assertEqual(zlib.decompress(out, 16 + zlib.MAX_WBITS),
+                         "a" * 1000 + "b" * 1000)
+        self.assertEqual(compress.get_stats()['bytes_in'], 2000)
+
+    def test_choose_encoding(self):
+        from werkzeug.datastructures import Accept
+        self.assertEqual(compress.choose_encoding(Accept([('gzip', 1)])), 'gzip')
+        self.assertEqual(compress.choose_encoding(Accept([('deflate', 1)])), None)
+
+    # ---------------------- SET UP --------------------------------------------
+    def setup_dummy_data(self):
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "5:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        self.test_resource_id = resource.id
+
+if __name__ == '__main__':
+    unittest.main()
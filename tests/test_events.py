@@ -0,0 +1,134 @@
+import unittest
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+import app
+from app import events
+from app.events import Hub
+from app.models import db, User, Resource
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(SERVER_NAME='localhost')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "5:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        self.test_resource_id = resource.id
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/login',
+                         data={ 'email': "a@a.com",
+                                'password': "hard_to_guess_pw"})
+
+    def tearDown(self):
+        self.app.config.update(EVENTS_POLL_TIMEOUT=25, EVENTS_STREAM=False)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # ---------------------- Hub tests -----------------------------------------
+    def test_publish_and_since(self):
+        hub = Hub(history=10)
+        first = hub.publish('a', 'added', {'id': 1})
+        hub.publish('b', 'added', {'id': 2})
+        second = hub.publish('a', 'deleted', {'id': 1})
+        self.assertEqual(hub.since('a', 0),
+                         [(first, 'added', {'id': 1}),
+                          (second, 'deleted', {'id': 1})])
+        self.assertEqual(hub.since('a', first), [(second, 'deleted', {'id': 1})])
+        self.assertEqual(hub.since('a', second), [])
+
+    def test_wait_times_out(self):
+        hub = Hub()
+        started = time.time()
+        self.assertEqual(hub.wait('a', 0, 0.05), [])
+        self.assertTrue(time.time() - started >= 0.05)
+
+    def test_wait_wakes_up_on_publish(self):
+        hub = Hub()
+        timer = threading.Timer(0.05, hub.publish, ('a', 'added', {}))
+        timer.start()
+        events = hub.wait('a', 0, 5)
+        timer.join()
+        self.assertEqual([e[1] for e in events], ['added'])
+
+    def test_reset_when_events_were_evicted(self):
+        hub = Hub(history=2)
+        for i in range(4):
+            hub.publish('a', 'added', {'id': i})
+        self.assertEqual([e[1] for e in hub.since('a', 1)], [events.RESET])
+        self.assertEqual(len(hub.since('a', 2)), 2)
+
+    def test_reset_when_id_is_from_the_future(self):
+        hub = Hub()
+        self.assertEqual([e[1] for e in hub.since('a', 42)], [events.RESET])
+
+    # ---------------------- Endpoint tests ------------------------------------
+    def test_long_poll_sees_new_reservation(self):
+        last_id = events.hub.last_id
+        self.client.post('/resources/'+str(self.test_resource_id)+'/add_reservation',
+                         data={ 'date': (datetime.now()+timedelta(days=1)).strftime('%Y-%m-%d'),
+                                'start': '10:00',
+                                'duration': '01:00'})
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/events',
+                                   query_string={'poll': 1, 'last_id': last_id})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([e['event'] for e in data['events']], ['reservation_added'])
+        self.assertEqual(data['events'][0]['data']['start_time'][11:], '10:00')
+        reservation_id = data['events'][0]['data']['id']
+        self.client.get('/reservations/'+str(reservation_id)+'/delete')
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/events',
+                                   query_string={'poll': 1, 'last_id': data['last_id']})
+        data = json.loads(response.data)
+        self.assertEqual(data['events'][0]['event'], 'reservation_deleted')
+        self.assertEqual(data['events'][0]['data'], {'id': reservation_id})
+
+    def test_long_poll_times_out_empty(self):
+        self.app.config['EVENTS_POLL_TIMEOUT'] = 0
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/events',
+                                   query_string={'poll': 1})
+        self.assertEqual(json.loads(response.data)['events'], [])
+
+    def test_event_stream(self):
+        last_id = events.hub.last_id
+        events.hub.publish(events.resource_channel(self.test_resource_id),
+                           'reservation_deleted', {'id': 7})
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/events',
+                                   headers={'Last-Event-ID': str(last_id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), 'retry: 3000\n\n')
+        self.assertEqual(next(chunks),
+                         'id: {}\nevent: reservation_deleted\ndata: {{"id": 7}}\n\n'
+                         .format(last_id + 1))
+        response.close()
+
+    def test_pages_stream_only_when_enabled(self):
+        url = '/resources/'+str(self.test_resource_id)
+        for page in ('/add_reservation', '/get_reservations'):
+            self.assertFalse('EventSource' in self.client.get(url+page).data)
+        self.app.config['EVENTS_STREAM'] = True
+        for page in ('/add_reservation', '/get_reservations'):
+            self.assertTrue('EventSource' in self.client.get(url+page).data)
+
+    def test_events_for_invalid_resource_id(self):
+        response = self.client.get('/resources/'+str(99999)+'/events')
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
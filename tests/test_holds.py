@@ -0,0 +1,200 @@
+import unittest
+import json
+from datetime import date, datetime, timedelta
+import app
+from app import holds, server
+from app.models import db, User, Resource, Reservation, Hold
+
+class TestHoldBook(unittest.TestCase):
+
+    def setUp(self):
+        self.book = holds.HoldBook()
+        self.now = datetime(2030, 1, 1, 8, 0)
+
+    def hold(self, id, user_id, hour, expires_in):
+        start = self.now.replace(hour=hour)
+        return Hold(id=id, resource_id=1, user_id=user_id, start_time=start,
+                    end_time=start + timedelta(hours=1),
+                    expires_at=self.now + timedelta(seconds=expires_in))
+
+    def test_conflict_with_other_users_only(self):
+        self.book.add(self.hold(1, 1, 10, 60))
+        start = self.now.replace(hour=10, minute=30)
+        end = start + timedelta(hours=1)
+        self.assertEqual(self.book.conflict(1, start, end, 2, self.now),
+                         self.now + timedelta(seconds=60))
+        self.assertEqual(self.book.conflict(1, start, end, 1, self.now), None)
+        self.assertEqual(self.book.conflict(2, start, end, 2, self.now), None)
+        self.assertEqual(self.book.conflict(
+            1, end, end + timedelta(hours=1), 2, self.now), None)
+
+    def test_expired_holds_are_dropped(self):
+        self.book.add(self.hold(1, 1, 10, 60))
+        self.book.add(self.hold(2, 1, 12, 600))
+        later = self.now + timedelta(seconds=61)
+        start = self.now.replace(hour=10)
+        self.assertEqual(self.book.conflict(
+            1, start, start + timedelta(hours=1), 2, later), None)
+        self.assertEqual(len(self.book._heap), 1)
+
+    def test_remove_user(self):
+        self.book.add(self.hold(1, 1, 10, 60))
+        self.book.remove_user(1)
+        start = self.now.replace(hour=10)
+        self.assertEqual(self.book.conflict(
+            1, start, start + timedelta(hours=1), 2, self.now), None)
+
+
+class TestHolds(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(SERVER_NAME='localhost')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        for email in ("a@a.com", "b@b.com"):
+            db.session.add(User(email, "hard_to_guess_pw"))
+        db.session.commit()
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : 1,
+                'available_start': "08:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        self.hold_url = '/api/resources/{}/holds'.format(resource.id)
+        self.day = (date.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+        self.a = self.client_for("a@a.com")
+        self.b = self.client_for("b@b.com")
+
+    def tearDown(self):
+        self.app.config['HOLD_TTL'] = 120
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def client_for(self, email):
+        client = self.app.test_client(use_cookies=True)
+        client.post('/login', data={'email': email,
+                                    'password': "hard_to_guess_pw"})
+        return client
+
+    def window(self, start, duration="01:00"):
+        return {'date': self.day, 'start': start, 'duration': duration}
+
+    def place(self, client, start):
+        return client.post(self.hold_url, data=self.window(start))
+
+    def test_hold_then_confirm(self):
+        response = self.place(self.a, "10:00")
+        self.assertEqual(response.status_code, 201)
+        hold_id = json.loads(response.data)['hold']['id']
+        response = self.a.post('/api/holds/{}/confirm'.format(hold_id))
+        self.assertEqual(response.status_code, 201)
+        reservation = Reservation.query.one()
+        self.assertEqual(reservation.duration, "01:00")
+        self.assertEqual(Hold.query.count(), 0)
+        response = self.a.post('/api/holds/{}/confirm'.format(hold_id))
+        self.assertEqual(response.status_code, 409)
+
+    def test_held_window_turns_others_away(self):
+        self.place(self.a, "10:00")
+        response = self.place(self.b, "10:30")
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue("held by another user" in
+                        json.loads(response.data)['error'])
+        response = self.b.post('/resources/1/add_reservation',
+                               data=self.window("10:30"))
+        self.assertTrue("held by another user" in response.data)
+        self.assertEqual(Reservation.query.count(), 0)
+        self.assertEqual(self.place(self.b, "11:00").status_code, 201)
+
+    def test_holds_of_other_processes_come_from_the_table(self):
+        self.place(self.a, "10:00")
+        holds.book.clear()
+        self.assertEqual(self.place(self.b, "10:30").status_code, 409)
+
+    def test_expired_hold(self):
+        self.app.config['HOLD_TTL'] = -1
+        hold_id = json.loads(self.place(self.a, "10:00").data)['hold']['id']
+        self.assertEqual(self.place(self.b, "10:00").status_code, 201)
+        response = self.a.post('/api/holds/{}/confirm'.format(hold_id))
+        self.assertEqual(response.status_code, 409)
+
+    def test_new_hold_replaces_old(self):
+        self.place(self.a, "10:00")
+        self.place(self.a, "13:00")
+        self.assertEqual(Hold.query.count(), 1)
+        self.assertEqual(self.place(self.b, "10:00").status_code, 201)
+
+    def test_release(self):
+        hold_id = json.loads(self.place(self.a, "10:00").data)['hold']['id']
+        self.assertEqual(self.b.delete('/api/holds/{}'.format(hold_id))
+                         .status_code, 404)
+        self.assertEqual(self.a.delete('/api/holds/{}'.format(hold_id))
+                         .status_code, 204)
+        self.assertEqual(self.place(self.b, "10:00").status_code, 201)
+
+    def test_form_confirms_hold(self):
+        hold_id = json.loads(self.place(self.a, "10:00").data)['hold']['id']
+        data = self.window("10:00")
+        data['hold_id'] = str(hold_id)
+        response = self.a.post('/resources/1/add_reservation', data=data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Reservation.query.count(), 1)
+        self.assertEqual(Hold.query.count(), 0)
+
+    def test_confirm_checks_the_user_again(self):
+        other = Resource()
+        other.deserialize({'name': "other_res", 'owner_id': 2,
+                           'available_start': "08:00",
+                           'available_end': "17:00"})
+        db.session.add(other)
+        db.session.commit()
+        other_url = '/resources/{}/add_reservation'.format(other.id)
+        hold_id = json.loads(self.place(self.a, "10:00").data)['hold']['id']
+        self.a.post(other_url,
+                    data=self.window("10:30"))
+        self.assertEqual(Reservation.query.count(), 1)
+        response = self.a.post('/api/holds/{}/confirm'.format(hold_id))
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue("one reservation at a time" in
+                        json.loads(response.data)['error'])
+        self.assertEqual(Reservation.query.count(), 1)
+
+    def test_confirm_after_start_passed(self):
+        hold_id = json.loads(self.place(self.a, "10:00").data)['hold']['id']
+        hold = Hold.query.get(hold_id)
+        hold.start_time = datetime.now() - timedelta(minutes=5)
+        db.session.commit()
+        response = self.a.post('/api/holds/{}/confirm'.format(hold_id))
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue("past" in json.loads(response.data)['error'])
+        self.assertEqual(Reservation.query.count(), 0)
+
+    def test_deleting_resource_drops_its_holds(self):
+        self.place(self.b, "10:00")
+        response = self.a.get('/resources/1/delete')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Resource.query.count(), 0)
+        self.assertEqual(Hold.query.count(), 0)
+        self.assertEqual(holds.book._holds, {})
+
+    def test_conditional_insert(self):
+        start = datetime.combine(date.today() + timedelta(days=1),
+                                 datetime.min.time()) + timedelta(hours=10)
+        values = {'resource_id': 1, 'resource_name': "test_res",
+                  'user_id': 1, 'start_time': start,
+                  'end_time': start + timedelta(hours=1),
+                  'create_time': datetime.now(), 'duration': "01:00"}
+        self.assertTrue(server.insert_reservation_if_free(values))
+        values['start_time'] += timedelta(minutes=30)
+        values['end_time'] += timedelta(minutes=30)
+        self.assertFalse(server.insert_reservation_if_free(values))
+        db.session.commit()
+        self.assertEqual(Reservation.query.count(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+from datetime import date, timedelta
+import app
+from app import ics
+from app.models import db, User, Resource
+
+class TestIcs(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(SERVER_NAME='localhost')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        self.test_user_id = user.id
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "08:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        self.test_resource_id = resource.id
+        self.resource_url = '/resources/{}/reservations.ics'.format(resource.id)
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        self.client.post('/login',
+                         data={ 'email': "a@a.com",
+                                'password': "hard_to_guess_pw"})
+
+    def book(self, start):
+        day = date.today() + timedelta(days=1)
+        self.client.post(
+            '/resources/{}/add_reservation'.format(self.test_resource_id),
+            data={'date': day.strftime('%Y-%m-%d'),
+                  'start': start,
+                  'duration': "01:00"})
+
+    def test_fold_long_lines(self):
+        folded = ics.fold('SUMMARY:' + 'x' * 200)
+        lines = folded.split('\r\n')
+        self.assertTrue(all(len(line) <= 75 for line in lines))
+        self.assertEqual(''.join(line[1:] if i else line
+                                 for i, line in enumerate(lines)),
+                         'SUMMARY:' + 'x' * 200)
+
+    def test_escape(self):
+        self.assertEqual(ics.escape('a,b;c\\d\ne'), 'a\\,b\\;c\\\\d\\ne')
+
+    def test_feed_needs_login_or_token(self):
+        self.assertEqual(self.client.get(self.resource_url).status_code, 403)
+        token = ics.serializer().dumps(['resource', self.test_resource_id])
+        response = self.client.get(self.resource_url + '?token=' + token)
+        self.assertEqual(response.status_code, 200)
+        token = ics.serializer().dumps(['user', self.test_resource_id])
+        response = self.client.get(self.resource_url + '?token=' + token)
+        self.assertEqual(response.status_code, 403)
+
+    def test_resource_feed(self):
+        self.login()
+        self.book("10:00")
+        response = self.client.get(self.resource_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/calendar')
+        self.assertTrue(response.data.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(response.data.count('BEGIN:VEVENT'), 1)
+        self.assertTrue('UID:reservation-1@localhost' in response.data)
+
+    def test_unchanged_feed_is_not_modified(self):
+        self.login()
+        etag = self.client.get(self.resource_url).headers['ETag']
+        response = self.client.get(self.resource_url,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.book("10:00")
+        response = self.client.get(self.resource_url,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        # the booking itself didn't write to the resource row
+        self.assertEqual(db.session.query(Resource.version).scalar(), 0)
+
+    def test_user_feed(self):
+        self.login()
+        self.book("10:00")
+        url = '/users/{}/reservations.ics'.format(self.test_user_id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('SUMMARY:Reservation with test_res' in response.data)
+        other = User("b@b.com", "hard_to_guess_pw")
+        db.session.add(other)
+        db.session.commit()
+        response = self.client.get('/users/{}/reservations.ics'
+                                   .format(other.id))
+        self.assertEqual(response.status_code, 403)
+
+    def test_deleting_changes_user_feed(self):
+        self.login()
+        self.book("10:00")
+        url = '/users/{}/reservations.ics'.format(self.test_user_id)
+        etag = self.client.get(url).headers['ETag']
+        self.client.post('/reservations/1/delete')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count('BEGIN:VEVENT'), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+import app
+from app import jobs
+from app.models import db, User, Resource
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app.config['JOBS_DATABASE'] = self.path
+        self.queue = jobs.JobQueue()
+        self.queue.init_app(self.app)
+        self.queue.create_table()
+        self.calls = []
+        self.queue.register('record', lambda **kw: self.calls.append(kw))
+        self.queue.register('explode', self.explode)
+
+    def tearDown(self):
+        self.queue.stop()
+        os.remove(self.path)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def explode(self, **kw):
+        raise RuntimeError('boom')
+
+    def test_enqueue_and_run(self):
+        self.queue.enqueue('record', {'a': 1})
+        self.assertEqual(self.queue.pending_count(), 1)
+        self.assertEqual(self.queue.run_pending(), 1)
+        self.assertEqual(self.calls, [{'a': 1}])
+        self.assertEqual(self.queue.pending_count(), 0)
+
+    def test_unknown_job(self):
+        self.assertRaises(KeyError, self.queue.enqueue, 'nope')
+
+    def test_delayed_job_waits(self):
+        self.queue.enqueue('record', {}, delay=60)
+        self.assertEqual(self.queue.run_pending(), 0)
+        self.assertEqual(self.calls, [])
+
+    def test_failed_job_is_retried_then_failed(self):
+        self.queue.retry_delay = 0
+        self.queue.enqueue('explode', {}, max_attempts=2)
+        self.assertEqual(self.queue.run_pending(), 2)
+        conn = self.queue.connect()
+        row = conn.execute('SELECT * FROM job').fetchone()
+        conn.close()
+        self.assertEqual(row['status'], 'failed')
+        self.assertEqual(row['attempts'], 2)
+        self.assertTrue('boom' in row['last_error'])
+
+    def test_retry_is_backed_off(self):
+        self.queue.retry_delay = 60
+        self.queue.enqueue('explode', {})
+        self.assertEqual(self.queue.run_pending(), 1)
+        self.assertEqual(self.queue.pending_count(), 1)
+
+    def test_queue_full(self):
+        self.queue.max_pending = 2
+        self.queue.enqueue('record', {})
+        self.queue.enqueue('record', {})
+        self.assertRaises(jobs.QueueFull, self.queue.enqueue, 'record', {})
+
+    def test_defer_runs_inline_when_full(self):
+        self.queue.eager = False
+        self.queue.max_pending = 0
+        self.queue.defer('record', b=2)
+        self.assertEqual(self.calls, [{'b': 2}])
+
+    def test_periodic_job_enqueued_once_per_period(self):
+        self.queue.every(60, 'record', {'tick': True})
+        now = time.time()
+        self.queue.schedule_periodic(now)
+        self.queue.schedule_periodic(now)
+        self.assertEqual(self.queue.pending_count(), 1)
+
+    def test_lost_job_is_requeued(self):
+        self.queue.lock_timeout = -1
+        self.queue.enqueue('record', {})
+        self.queue.claim()
+        self.assertEqual(self.queue.pending_count(), 0)
+        self.queue.requeue_lost()
+        self.assertEqual(self.queue.pending_count(), 1)
+
+    def test_worker_threads_run_jobs(self):
+        self.queue.workers = 1
+        self.queue.poll_interval = 0.01
+        self.queue.start()
+        self.queue.enqueue('record', {'c': 3})
+        deadline = time.time() + 5
+        while not self.calls and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.calls, [{'c': 3}])
+
+    def test_stop_at_exit_registered_once(self):
+        registered = []
+        register, jobs.atexit.register = jobs.atexit.register, \
+            lambda *args: registered.append(args)
+        try:
+            self.queue.workers = 1
+            for i in range(3):
+                self.queue.start()
+                self.queue.stop()
+        finally:
+            jobs.atexit.register = register
+        self.assertEqual(registered, [(self.queue.stop, 5)])
+
+    def test_touch_resource_moves_forward_only(self):
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "5:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        later = datetime.now() + timedelta(days=1)
+        earlier = datetime.now() - timedelta(days=1)
+        jobs.defer('touch_resource', id=resource.id,
+                   time=later.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        jobs.defer('touch_resource', id=resource.id,
+                   time=earlier.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        db.session.expire_all()
+        # times are stored with second precision
+        self.assertEqual(db.session.query(Resource).get(resource.id)
+                         .last_reserve_time, later.replace(microsecond=0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from datetime import date, timedelta
+import app
+from app import metrics
+from app.models import db, User
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(ADMIN_EMAILS=["a@a.com"],
+                               METRICS_TOKEN="scraper")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        for metric in metrics.registry:
+            metric.clear()
+        for email in ("a@a.com", "b@b.com"):
+            db.session.add(User(email, "hard_to_guess_pw"))
+        db.session.commit()
+        self.client = self.login("a@a.com")
+        self.day = (date.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    def tearDown(self):
+        self.app.config.update(ADMIN_EMAILS=[], METRICS_TOKEN=None,
+                               METRICS_DIR=None)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, email):
+        client = self.app.test_client(use_cookies=True)
+        client.post('/login', data={'email': email,
+                                    'password': "hard_to_guess_pw"})
+        return client
+
+    def scrape(self):
+        response = self.app.test_client().get(
+            '/metrics', headers={'Authorization': 'Bearer scraper'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'],
+                         metrics.CONTENT_TYPE)
+        return response.data.splitlines()
+
+    def test_request_latency(self):
+        self.client.get('/home')
+        self.client.get('/home')
+        self.client.get('/no/such/page')
+        lines = self.scrape()
+        self.assertTrue('http_requests_total{endpoint="list",status="200"} 2'
+                        in lines)
+        self.assertTrue('http_requests_total{endpoint="unmatched",'
+                        'status="404"} 1' in lines)
+        self.assertTrue('http_request_duration_seconds_count'
+                        '{endpoint="list"} 2' in lines)
+        self.assertTrue('http_request_duration_seconds_bucket'
+                        '{endpoint="list",le="+Inf"} 2' in lines)
+        self.assertTrue('# TYPE http_request_duration_seconds histogram'
+                        in lines)
+        # the scrape itself is in flight
+        self.assertTrue('http_requests_in_flight 1' in lines)
+
+    def test_booking_rejections_and_bcrypt(self):
+        self.client.post('/resources/add', data={'name': "res",
+                                                 'available_start': "08:00",
+                                                 'available_end': "17:00",
+                                                 'tag': "room"})
+        window = {'date': self.day, 'start': "10:00", 'duration': "01:00"}
+        self.client.post('/resources/1/add_reservation', data=window)
+        self.client.post('/resources/1/add_reservation', data=window)
+        self.client.post('/resources/1/add_reservation',
+                         data=dict(window, start="07:00"))
+        lines = self.scrape()
+        self.assertTrue('booking_rejections_total{check="valid_res"} 2'
+                        in lines)
+        self.assertTrue('bcrypt_duration_seconds_count{op="hash"} 2'
+                        in lines)
+        self.assertTrue('bcrypt_duration_seconds_count{op="check"} 1'
+                        in lines)
+        self.assertTrue(any(line.startswith(
+            'cache_lookups_total{cache="to_minutes",result="miss"}')
+            for line in lines))
+
+    def test_admins_or_token_only(self):
+        self.assertEqual(self.app.test_client().get('/metrics').status_code,
+                         403)
+        self.assertEqual(self.login("b@b.com").get('/metrics').status_code,
+                         403)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_workers_are_added_up(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.app.config['METRICS_DIR'] = directory
+            metrics.booking_rejections.inc(check='valid_user_time')
+            metrics.requests_in_flight.inc(3)
+            worker = metrics.snapshot()
+            gone = subprocess.Popen(['true'])
+            gone.wait()
+            for pid in (os.getppid(), gone.pid):
+                with open(metrics.worker_path(directory, pid), 'w') as f:
+                    json.dump(dict(worker, pid=pid), f)
+            metrics.requests_in_flight.dec(3)
+            lines = self.scrape()
+            # the exited worker's counters moved to one file for all
+            self.assertFalse(os.path.exists(
+                metrics.worker_path(directory, gone.pid)))
+            self.assertTrue(os.path.exists(
+                os.path.join(directory, 'metrics-exited.json')))
+            # and are counted once, not once per scrape
+            self.assertTrue('booking_rejections_total'
+                            '{check="valid_user_time"} 3' in self.scrape())
+        finally:
+            shutil.rmtree(directory)
+        self.assertTrue('booking_rejections_total{check="valid_user_time"} 3'
+                        in lines)
+        # gauges of a worker that has exited are left out
+        self.assertTrue('http_requests_in_flight 4' in lines)
+
+    def test_exposition(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('path',),
+                                      'METRICS_BCRYPT_BUCKETS')
+        metrics.registry.remove(histogram)
+        histogram.observe(0.003, path='a"b')
+        histogram.observe(2, path='a"b')
+        merged = metrics.merge([{'metrics': {'test_seconds': {
+            'kind': 'histogram', 'help': 'Test.', 'labels': ['path'],
+            'buckets': histogram.buckets,
+            'values': list(histogram.values().items())}}}])
+        lines = metrics.exposition(merged).splitlines()
+        self.assertEqual(lines[2], 'test_seconds_bucket{path="a\\"b",'
+                                   'le="0.001"} 0')
+        self.assertEqual(lines[3], 'test_seconds_bucket{path="a\\"b",'
+                                   'le="0.005"} 1')
+        self.assertEqual(lines[-3], 'test_seconds_bucket{path="a\\"b",'
+                                    'le="+Inf"} 2')
+        self.assertEqual(lines[-2], 'test_seconds_sum{path="a\\"b"} 2.003')
+        self.assertEqual(lines[-1], 'test_seconds_count{path="a\\"b"} 2')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,48 @@
 import unittest
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, tzinfo
+from sqlalchemy import inspect
 import app
-from app import models, server
+from app import models, server, migrate
 from app.models import db, User, Reservation, Resource, Tag
+from transactional import TransactionalTestCase
 
-class TestModels(unittest.TestCase):
+class DummyData(object):
 
-    def setUp(self):
-        self.app = app.get_app("TEST")
+    def setup_dummy_data(self):
+        self.add_one_user()
+        self.add_one_resource()
+        user = User.query.filter_by(email="a@a.com").first()
+        resource = [res for res in user.resources][0]
+        tag = Tag("tag_1")
+        tag_2 = Tag("tag_2")
+        resource.tags.append(tag)
+        resource.tags.append(tag_2)
+        db.session.add(tag)
+        db.session.add(tag_2)
+        db.session.add(resource)
+        db.session.commit()
+        return user, resource, tag, tag_2
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
+    def add_one_user(self):
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+
+    # must call add_one_user before using this method, should not called twice in one test
+    def add_one_resource(self):
+        user = User.query.filter_by(email="a@a.com").first()
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "5:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+
+
+class TestModels(DummyData, TransactionalTestCase):
 
     def test_create_a_user(self):
         users = [user for user in User.query.all()]
@@ -142,38 +173,107 @@ class TestModels(unittest.TestCase):
         self.assertTrue(tag_2 in tags)
         self.assertEqual(len(tags), 2)
 
-    def setup_dummy_data(self):
-        self.add_one_user()
-        self.add_one_resource()
-        user = User.query.filter_by(email="a@a.com").first()
-        resource = [res for res in user.resources][0]
-        tag = Tag("tag_1")
-        tag_2 = Tag("tag_2")
-        resource.tags.append(tag)
-        resource.tags.append(tag_2)
-        db.session.add(tag)
-        db.session.add(tag_2)
-        db.session.add(resource)
+    def test_times_are_stored_as_epoch_seconds(self):
+        user, resource, tag, tag_2 = self.setup_dummy_data()
+        start = datetime(2017, 5, 21, 10, 0)
+        reservation = Reservation()
+        reservation.deserialize({
+                'resource_id' : resource.id,
+                'resource_name' : resource.name,
+                'user_id' : user.id,
+                'start_time' : start,
+                'end_time': start + timedelta(minutes=30),
+                'duration': '00:30'
+                })
+        db.session.add(reservation)
         db.session.commit()
-        return user, resource, tag, tag_2
+        raw = db.session.execute(
+            "SELECT start_time, typeof(start_time) FROM reservation").first()
+        self.assertEqual(raw[1], 'integer')
+        self.assertEqual(datetime.fromtimestamp(raw[0]), start)
+        db.session.expire_all()
+        self.assertEqual(Reservation.query.first().start_time, start)
+        self.assertEqual(Reservation.query.filter(
+            Reservation.end_time > start + timedelta(minutes=29)).count(), 1)
 
-    def add_one_user(self):
-        user = User("a@a.com", "hard_to_guess_pw")
-        db.session.add(user)
+    def test_aware_datetime_is_stored_as_utc(self):
+        class UTC(tzinfo):
+            def utcoffset(self, dt):
+                return timedelta(0)
+        epoch = models.EpochDateTime().process_bind_param(
+            datetime(1970, 1, 2, tzinfo=UTC()), None)
+        self.assertEqual(epoch, 24 * 3600)
+
+
+class TestMigrations(DummyData, unittest.TestCase):
+    '''Migrations run on db.engine, outside of a test transaction.'''
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        migrate.metadata.drop_all(db.engine)
+
+    def test_migrate_text_times_to_epoch(self):
+        user, resource, tag, tag_2 = self.setup_dummy_data()
+        db.session.execute(
+            "INSERT INTO reservation (resource_id, user_id, start_time, "
+            "end_time, create_time) VALUES (:r, :u, '2017-05-21 10:00:00.000000', "
+            "'2017-05-21 10:30:00', NULL)", {'r': resource.id, 'u': user.id})
         db.session.commit()
+        migrate.convert_times_to_epoch(db.engine)
+        migrate.convert_times_to_epoch(db.engine)
+        reservation = Reservation.query.first()
+        self.assertEqual(reservation.start_time, datetime(2017, 5, 21, 10, 0))
+        self.assertEqual(reservation.end_time, datetime(2017, 5, 21, 10, 30))
+        self.assertEqual(reservation.create_time, None)
 
-    # must call add_one_user before using this method, should not called twice in one test
-    def add_one_resource(self):
-        user = User.query.filter_by(email="a@a.com").first()
-        resource = Resource()
-        resource.deserialize({
-                'name' : "test_res",
-                'owner_id' : user.id,
-                'available_start': "5:00",
-                'available_end' : "17:00"
-                })
-        db.session.add(resource)
+    def test_reservation_indexes_exist(self):
+        self.assertEqual(migrate.create_missing_indexes(db.engine), [])
+        names = [index['name'] for index in
+                 inspect(db.engine).get_indexes('reservation')]
+        self.assertTrue('ix_reservation_resource_end' in names)
+        self.assertTrue('ix_reservation_user_end' in names)
+
+    def test_lookup_indexes_exist(self):
+        self.assertEqual(migrate.create_missing_indexes(db.engine), [])
+        inspector = inspect(db.engine)
+        self.assertEqual(
+            [index['unique'] for index in inspector.get_indexes('user')
+             if index['name'] == 'ix_user_email'], [1])
+        names = [index['name'] for index in inspector.get_indexes('tag')]
+        self.assertTrue('ix_tag_value' in names)
+
+    def test_upgrade_merges_duplicates_then_indexes(self):
+        user, resource, tag, tag_2 = self.setup_dummy_data()
+        db.session.execute("DROP INDEX ix_tag_value")
+        db.session.execute("DROP INDEX ix_tag_resource_tag_resource")
+        db.session.execute("INSERT INTO tag (value) VALUES ('tag_1')")
+        db.session.execute(
+            "INSERT INTO tag_resource (resource_id, tag_id) VALUES (:r, :t)",
+            {'r': resource.id, 't': tag_2.id})
+        db.session.execute(
+            "INSERT INTO tag_resource (resource_id, tag_id) "
+            "SELECT :r, MAX(id) FROM tag", {'r': resource.id})
+        db.session.commit()
+        self.assertEqual(migrate.upgrade(db.engine), [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(migrate.upgrade(db.engine), [])
+        self.assertEqual(Tag.query.filter_by(value='tag_1').count(), 1)
+        self.assertEqual(
+            sorted(tag.value for tag in resource.tags), ['tag_1', 'tag_2'])
+        names = [index['name'] for index in inspect(db.engine)
+                 .get_indexes('tag_resource')]
+        self.assertTrue('ix_tag_resource_tag_resource' in names)
+
+    def test_duplicate_emails_stop_upgrade(self):
+        self.add_one_user()
+        db.session.execute("DROP INDEX ix_user_email")
+        db.session.add(User("a@a.com", "another_pw"))
         db.session.commit()
+        self.assertRaises(migrate.MigrationError, migrate.upgrade, db.engine)
+        self.assertEqual(migrate.pending_migrations(db.engine)[0][0], 5)
 
 if __name__ == '__main__':
     unittest.main()
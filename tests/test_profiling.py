@@ -0,0 +1,110 @@
+import json
+import os
+import pstats
+import tempfile
+import time
+import unittest
+import app
+from app import profiling
+from app.models import db, User
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(ADMIN_EMAILS=["a@a.com"],
+                               PROFILING_INTERVAL=0.001)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        for email in ("a@a.com", "b@b.com"):
+            db.session.add(User(email, "hard_to_guess_pw"))
+        db.session.commit()
+        profiling.profiles.clear()
+        self.admin = self.login("a@a.com")
+
+    def tearDown(self):
+        self.app.config.update(ADMIN_EMAILS=[], PROFILING_INTERVAL=0.005)
+        profiling.profiles.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, email):
+        client = self.app.test_client(use_cookies=True)
+        client.post('/login', data={'email': email,
+                                    'password': "hard_to_guess_pw"})
+        return client
+
+    def test_no_header_no_profile(self):
+        response = self.admin.get('/home')
+        self.assertFalse('X-Profile-Id' in response.headers)
+        self.assertEqual(profiling.profiles.all(), [])
+
+    def test_cpu_profile(self):
+        response = self.admin.get('/home', headers={'X-Profile': 'cpu'})
+        id = response.headers['X-Profile-Id']
+        listed = json.loads(self.admin.get('/profiles').data)['profiles']
+        self.assertEqual(listed[0]['label'], 'GET /home')
+        self.assertEqual(listed[0]['downloads'], ['pstats', 'collapsed'])
+        data = self.admin.get('/profiles/{}.pstats'.format(id)).data
+        handle, path = tempfile.mkstemp()
+        try:
+            os.write(handle, data)
+            os.close(handle)
+            stats = pstats.Stats(path)
+        finally:
+            os.remove(path)
+        self.assertTrue(any(name == 'list' for (filename, line, name)
+                            in stats.stats))
+        response = self.admin.get('/profiles/{}.collapsed'.format(id))
+        self.assertEqual(response.mimetype, 'text/plain')
+        self.assertEqual(self.admin.get('/profiles/{}.memory'.format(id))
+                         .status_code, 404)
+
+    def test_memory_profile(self):
+        response = self.admin.get('/home', headers={'X-Profile': 'memory'})
+        id = response.headers['X-Profile-Id']
+        report = self.admin.get('/profiles/{}.memory'.format(id)).data
+        self.assertTrue(report.startswith('maxrss_kb'))
+
+    def test_collapse(self):
+        def inner():
+            return profiling.collapse(profiling.sys._getframe())
+        stack = inner()
+        self.assertTrue(stack.endswith(
+            'tests/test_profiling.py:test_collapse;'
+            'tests/test_profiling.py:inner'))
+
+    def test_window(self):
+        response = self.admin.post('/profiles/window?seconds=0.05')
+        self.assertEqual(response.status_code, 202)
+        id = json.loads(response.data)['id']
+        # a busy machine, or parallel test processes, delay the timer
+        deadline = time.time() + 5
+        while profiling.profiles.get(id) is None and time.time() < deadline:
+            time.sleep(0.05)
+        response = self.admin.get('/profiles/{}.collapsed'.format(id))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data.strip())
+        self.assertEqual(self.admin.post('/profiles/window?seconds=3600')
+                         .status_code, 400)
+
+    def test_admins_only(self):
+        other = self.login("b@b.com")
+        response = other.get('/home', headers={'X-Profile': 'cpu'})
+        self.assertFalse('X-Profile-Id' in response.headers)
+        self.assertEqual(other.get('/profiles').status_code, 403)
+        self.assertEqual(other.post('/profiles/window').status_code, 403)
+
+    def test_oldest_profiles_dropped(self):
+        self.app.config['PROFILING_KEEP'] = 2
+        try:
+            ids = [int(self.admin.get('/home', headers={'X-Profile': 'cpu'})
+                       .headers['X-Profile-Id']) for i in range(3)]
+        finally:
+            self.app.config['PROFILING_KEEP'] = 20
+        self.assertEqual([profile.id for profile in
+                          profiling.profiles.all()], ids[1:])
+
+if __name__ == '__main__':
+    unittest.main()
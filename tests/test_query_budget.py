@@ -0,0 +1,209 @@
+import re
+import unittest
+from datetime import date, datetime, timedelta
+from sqlalchemy import event
+import app
+from app import timeline, holds
+from app.changes import record_reservation
+from app.models import db, User, Resource, Reservation, Tag
+
+# 'SCAN reservation', 'SCAN TABLE reservation' before sqlite 3.36
+FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)')
+
+class QueryRecorder(object):
+    '''Statements sent to the database while it is active.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        # the plan of an executemany is the plan of its first row
+        self.statements.append(
+            (statement, parameters[0] if executemany else parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute',
+                     self.before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute',
+                     self.before_cursor_execute)
+
+
+class TestQueryBudget(unittest.TestCase):
+    '''
+    Every endpoint runs against a small and a large seeded dataset. It
+    has to send the same number of statements to both, within its
+    budget, and the statements on the hot tables have to use an index.
+    '''
+    SIZES = (2, 20)
+    # tables that grow with every booking, never scanned in full
+    HOT_TABLES = ('reservation', 'hold', 'change_log')
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config['ADMIN_EMAILS'] = ["a@a.com"]
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.day = date.today() + timedelta(days=1)
+
+    def tearDown(self):
+        self.app.config['ADMIN_EMAILS'] = []
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def seed(self, size):
+        '''
+        size resources with two tags and size reservations each spread
+        over the coming days, user 1 holds one reservation per resource.
+        '''
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        timeline.timelines.clear()
+        holds.book.clear()
+        users = [User("a@a.com", "hard_to_guess_pw"),
+                 User("b@b.com", "hard_to_guess_pw")]
+        db.session.add_all(users)
+        tags = [Tag("room"), Tag("big")]
+        db.session.add_all(tags)
+        db.session.flush()
+        for i in range(size):
+            resource = Resource()
+            resource.deserialize({'name': "res_{}".format(i),
+                                  'owner_id': users[0].id,
+                                  'available_start': "08:00",
+                                  'available_end': "17:00"})
+            resource.tags.extend(tags)
+            db.session.add(resource)
+            db.session.flush()
+            for j in range(size):
+                # days 2.. are left to the requests under test, which
+                # book on day 1
+                start = datetime.combine(self.day + timedelta(days=j + 1),
+                                         datetime.min.time()) + \
+                    timedelta(hours=8 + i % 8)
+                reservation = Reservation()
+                reservation.deserialize({
+                    'resource_id': resource.id,
+                    'resource_name': resource.name,
+                    'user_id': users[0 if i == j else 1].id,
+                    'start_time': start,
+                    'end_time': start + timedelta(hours=1),
+                    'duration': "01:00"})
+                db.session.add(reservation)
+                db.session.flush()
+                record_reservation(reservation, 'insert')
+        db.session.commit()
+        db.session.remove()
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/login', data={'email': "a@a.com",
+                                         'password': "hard_to_guess_pw"})
+
+    def record(self, method, url, data=None):
+        with QueryRecorder(db.engine) as recorder:
+            response = self.client.open(url, method=method, data=data,
+                                        buffered=True)
+        self.assertTrue(response.status_code in (200, 201, 302),
+                        '{} {}: {}'.format(method, url, response.status))
+        return recorder.statements
+
+    def full_scans(self, statements):
+        '''(table, statement) of the hot tables a statement scans.'''
+        scans = []
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            for statement, parameters in statements:
+                if not statement.lstrip().upper().startswith(
+                        ('SELECT', 'INSERT', 'UPDATE', 'DELETE')):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+                for row in cursor.fetchall():
+                    match = FULL_SCAN.search(row[-1])
+                    if match and match.group(1) in self.HOT_TABLES:
+                        scans.append((match.group(1), statement))
+        finally:
+            conn.close()
+        return scans
+
+    def assertBudget(self, budget, method, url, data=None):
+        counts = []
+        for size in self.SIZES:
+            self.seed(size)
+            statements = self.record(method, url, data)
+            counts.append(len(statements))
+            self.assertEqual(self.full_scans(statements), [])
+        self.assertEqual(counts[0], counts[-1],
+                         '{} {} sends {} statements'.format(
+                             method, url, ' vs '.join(map(str, counts))))
+        self.assertTrue(counts[-1] <= budget,
+                        '{} {} sends {} statements, budget {}'.format(
+                            method, url, counts[-1], budget))
+
+    def window(self, start="10:00"):
+        return {'date': self.day.strftime('%Y-%m-%d'), 'start': start,
+                'duration': "01:00"}
+
+    ##################################################################
+    # Pages
+    ##################################################################
+    def test_list(self):
+        self.assertBudget(6, 'GET', '/home')
+
+    def test_get_resource(self):
+        self.assertBudget(4, 'GET', '/resources/1')
+
+    def test_resource_reservations(self):
+        self.assertBudget(3, 'GET', '/resources/1/get_reservations')
+
+    def test_get_user(self):
+        self.assertBudget(4, 'GET', '/users/1')
+
+    def test_tag(self):
+        self.assertBudget(4, 'GET', '/tags/1')
+
+    def test_rss(self):
+        self.assertBudget(3, 'GET', '/resources/1/rss')
+
+    def test_search(self):
+        self.assertBudget(4, 'POST', '/search', self.window())
+
+    def test_add_reservation(self):
+        self.assertBudget(19, 'POST', '/resources/1/add_reservation',
+                          self.window())
+
+    def test_delete_reservation(self):
+        self.assertBudget(12, 'POST', '/reservations/1/delete')
+
+    def test_free_slots(self):
+        self.assertBudget(3, 'GET', '/resources/1/free_slots?date={}'
+                          .format(self.day.strftime('%Y-%m-%d')))
+
+    def test_schedule(self):
+        self.assertBudget(4, 'GET', '/schedule?resource=1&resource=2'
+                          '&date={}&duration=01:00'
+                          .format(self.day.strftime('%Y-%m-%d')))
+
+    def test_ics(self):
+        self.assertBudget(3, 'GET', '/resources/1/reservations.ics')
+
+    ##################################################################
+    # JSON
+    ##################################################################
+    def test_api_search(self):
+        self.assertBudget(4, 'GET', '/api/search?date={date}&start={start}'
+                          '&duration={duration}'.format(**self.window()))
+
+    def test_api_hold(self):
+        self.assertBudget(9, 'POST', '/api/resources/1/holds', self.window())
+
+    def test_changes(self):
+        self.assertBudget(2, 'GET', '/changes?since=0')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import threading
+import app
+from app import ratelimit
+from app.ratelimit import MemoryStore, ConcurrencyLimiter
+from app.models import db, User
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.session.add(User("a@a.com", "hard_to_guess_pw"))
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+        self.saved = dict((key, self.app.config[key]) for key in
+                          ('RATELIMITS', 'CONCURRENCY_LIMITS',
+                           'RATELIMIT_TRUST_PROXY'))
+        self.app.config['RATELIMIT_ENABLED'] = True
+        ratelimit.reset()
+
+    def tearDown(self):
+        self.app.config['RATELIMIT_ENABLED'] = False
+        self.app.config.update(self.saved)
+        ratelimit.reset()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, ip='1.1.1.1'):
+        return self.client.post('/login',
+                                data={ 'email': "a@a.com",
+                                       'password': "wrong_password"},
+                                environ_base={'REMOTE_ADDR': ip})
+
+    def test_token_bucket(self):
+        store = MemoryStore()
+        self.assertEqual(store.take('k', 1.0, 2, now=100), 0)
+        self.assertEqual(store.take('k', 1.0, 2, now=100), 0)
+        self.assertEqual(store.take('k', 1.0, 2, now=100), 1.0)
+        self.assertEqual(store.take('k', 1.0, 2, now=100.5), 0.5)
+        self.assertEqual(store.take('k', 1.0, 2, now=101), 0)
+
+    def test_store_drops_least_recently_used_keys(self):
+        store = MemoryStore(max_keys=2)
+        store.take('a', 1.0, 1, now=100)
+        store.take('b', 1.0, 1, now=100)
+        store.take('c', 1.0, 1, now=100)
+        self.assertEqual(store.take('a', 1.0, 1, now=100), 0)
+
+    def test_concurrency_limiter(self):
+        limiter = ConcurrencyLimiter(1, 0)
+        self.assertTrue(limiter.acquire(0))
+        self.assertFalse(limiter.acquire(0))
+        limiter.release()
+        self.assertTrue(limiter.acquire(0))
+
+    def test_concurrency_limiter_queued_request_gets_slot(self):
+        limiter = ConcurrencyLimiter(1, 1)
+        self.assertTrue(limiter.acquire(0))
+        timer = threading.Timer(0.05, limiter.release)
+        timer.start()
+        self.assertTrue(limiter.acquire(5))
+        timer.join()
+        self.assertEqual(limiter.waiting, 0)
+
+    def test_login_is_rate_limited_per_ip(self):
+        self.app.config['RATELIMITS'] = {'login': (2, 60)}
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 200)
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertEqual(self.login(ip='2.2.2.2').status_code, 200)
+
+    def test_get_is_not_limited(self):
+        self.app.config['RATELIMITS'] = {'login': (1, 60)}
+        for i in range(3):
+            self.assertEqual(self.client.get('/login').status_code, 200)
+
+    def test_forwarded_ip_is_used_behind_proxy(self):
+        self.app.config['RATELIMITS'] = {'register': (1, 60)}
+        self.app.config['RATELIMIT_TRUST_PROXY'] = True
+        for ip in ('3.3.3.3', '4.4.4.4'):
+            response = self.client.post('/register',
+                                        data={ 'email': "a@a.com",
+                                               'password': "pw"},
+                                        headers={'X-Forwarded-For': ip})
+            self.assertEqual(response.status_code, 200)
+
+    def test_load_is_shed_when_queue_is_full(self):
+        self.app.config['RATELIMITS'] = {}
+        self.app.config['CONCURRENCY_LIMITS'] = {'login': (0, 0)}
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import json
+from datetime import date, datetime, timedelta
+import app
+from app import reports
+from app.models import db, User, Resource, Reservation, HourlyUsage, \
+    DailyUserUsage
+
+class TestReports(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(SERVER_NAME='localhost')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        self.test_user_id = user.id
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "08:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        self.test_resource_id = resource.id
+        self.day = date.today() + timedelta(days=1)
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/login',
+                         data={ 'email': "a@a.com",
+                                'password': "hard_to_guess_pw"})
+
+    def tearDown(self):
+        self.app.config['ADMIN_EMAILS'] = []
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def book(self, start, duration):
+        return self.client.post(
+            '/resources/{}/add_reservation'.format(self.test_resource_id),
+            data={'date': self.day.strftime('%Y-%m-%d'),
+                  'start': start,
+                  'duration': duration})
+
+    def test_hour_minutes(self):
+        start = datetime(2017, 5, 21, 10, 30)
+        self.assertEqual(
+            list(reports.hour_minutes(start, start + timedelta(minutes=95))),
+            [(10, 30), (11, 60), (12, 5)])
+
+    def test_booking_refreshes_rollups(self):
+        self.book("10:30", "01:00")
+        self.assertEqual(
+            sorted((row.hour, row.minutes) for row in HourlyUsage.query),
+            [(10, 30), (11, 30)])
+        usage = DailyUserUsage.query.one()
+        self.assertEqual((usage.day, usage.reservations, usage.minutes),
+                         (self.day, 1, 60))
+
+    def test_deleting_refreshes_rollups(self):
+        self.book("10:30", "01:00")
+        reservation = Reservation.query.one()
+        self.client.post('/reservations/{}/delete'.format(reservation.id))
+        self.assertEqual(HourlyUsage.query.count(), 0)
+        self.assertEqual(DailyUserUsage.query.count(), 0)
+
+    def test_reports(self):
+        self.book("10:30", "01:30")
+        self.assertEqual(reports.utilization(self.day, self.day), [{
+            'resource_id': self.test_resource_id,
+            'name': "test_res",
+            'booked_minutes': 90,
+            'available_minutes': 540,
+            'utilization': round(90.0 / 540, 4)}])
+        grid = reports.heatmap(self.day, self.day)
+        self.assertEqual(grid[self.day.weekday()][10:13], [30, 60, 0])
+        self.assertEqual(sum(sum(row) for row in grid), 90)
+        self.assertEqual(reports.top_users(self.day, self.day, 10), [{
+            'user_id': self.test_user_id, 'email': "a@a.com",
+            'reservations': 1, 'minutes': 90}])
+
+    def test_rebuild_matches_incremental(self):
+        self.book("09:00", "02:00")
+        before = sorted((row.day, row.hour, row.minutes)
+                        for row in HourlyUsage.query)
+        db.session.query(HourlyUsage).delete()
+        db.session.commit()
+        self.assertEqual(reports.rebuild_usage(), 1)
+        self.assertEqual(sorted((row.day, row.hour, row.minutes)
+                                for row in HourlyUsage.query), before)
+
+    def test_deleted_resource_leaves_reports(self):
+        self.book("09:00", "02:00")
+        self.client.get('/resources/{}/delete'.format(self.test_resource_id))
+        self.assertEqual(HourlyUsage.query.count(), 0)
+        self.assertEqual(DailyUserUsage.query.count(), 0)
+
+    def test_report_endpoint(self):
+        response = self.client.get('/reports/usage')
+        self.assertEqual(response.status_code, 403)
+        self.app.config['ADMIN_EMAILS'] = ["a@a.com"]
+        self.book("10:00", "01:00")
+        day = self.day.strftime('%Y-%m-%d')
+        response = self.client.get(
+            '/reports/usage?from={0}&to={0}'.format(day))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['utilization'][0]['booked_minutes'], 60)
+        self.assertEqual(data['top_users'][0]['minutes'], 60)
+        response = self.client.get('/reports/usage?from=2017-5-2&to=2017-5-1')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/reports/usage?from=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
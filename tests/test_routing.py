@@ -0,0 +1,82 @@
+import unittest
+import os
+from sqlalchemy.orm import sessionmaker
+import app
+from app import routing
+from app.models import db, User, Resource
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        app.app.config['SQLALCHEMY_REPLICAS'] = ['sqlite:///db/replica.db']
+        app.app.config['REPLICA_STICKY_SECONDS'] = 0
+        self.app = app.get_app("TEST")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.replica = db.get_engine(self.app, bind='_replica0')
+        db.Model.metadata.create_all(self.replica)
+        # the replica lags: it has the user but an older resource name
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        self.add_resource(db.session, user.id, "primary_res")
+        replica_session = sessionmaker(bind=self.replica)()
+        replica_session.add(User("a@a.com", "hard_to_guess_pw"))
+        replica_session.commit()
+        self.add_resource(replica_session, user.id, "replica_res")
+        replica_session.close()
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/login', data={'email': "a@a.com",
+                                         'password': "hard_to_guess_pw"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.Model.metadata.drop_all(self.replica)
+        self.app.config['SQLALCHEMY_REPLICAS'] = []
+        self.app.config['REPLICA_STICKY_SECONDS'] = 10
+        routing.init_app(self.app)
+        self.app_context.pop()
+        os.remove(os.path.join(self.app.root_path, 'db', 'replica.db'))
+
+    def add_resource(self, session, owner_id, name):
+        resource = Resource()
+        resource.deserialize({
+                'name' : name,
+                'owner_id' : owner_id,
+                'available_start': "05:00",
+                'available_end' : "17:00"
+                })
+        session.add(resource)
+        session.commit()
+
+    def test_read_only_views_use_replica(self):
+        response = self.client.get('/home')
+        self.assertTrue("replica_res" in response.data)
+        self.assertFalse("primary_res" in response.data)
+        response = self.client.get('/resources/1')
+        self.assertTrue("replica_res" in response.data)
+
+    def test_other_views_use_primary(self):
+        response = self.client.get('/resources/1/edit')
+        self.assertTrue("primary_res" in response.data)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.app.config['REPLICA_STICKY_SECONDS'] = 60
+        self.client.post('/resources/add', data={
+                'name': "new_res",
+                'available_start': "05:00",
+                'available_end': "17:00",
+                'tag': ""})
+        response = self.client.get('/home')
+        self.assertTrue("new_res" in response.data)
+        self.assertTrue("primary_res" in response.data)
+
+    def test_no_replicas(self):
+        self.app.config['SQLALCHEMY_REPLICAS'] = []
+        routing.init_app(self.app)
+        response = self.client.get('/home')
+        self.assertTrue("primary_res" in response.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from datetime import datetime, timedelta
+import app
+from app import rows
+from app.models import db, User, Resource, Reservation, Tag
+
+class TestRows(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        for name, tag_values in (("res_1", ["room", "big"]), ("res_2", [])):
+            resource = Resource()
+            resource.deserialize({
+                    'name' : name,
+                    'owner_id' : user.id,
+                    'available_start': "08:00",
+                    'available_end' : "17:00"
+                    })
+            for value in tag_values:
+                resource.tags.append(Tag(value))
+            db.session.add(resource)
+            db.session.commit()
+        self.resource_id = Resource.query.filter_by(name="res_1").one().id
+        now = datetime.now().replace(microsecond=0)
+        for start in (now + timedelta(days=2), now - timedelta(days=2),
+                      now + timedelta(days=1)):
+            reservation = Reservation()
+            reservation.deserialize({
+                    'resource_id' : self.resource_id,
+                    'resource_name' : "res_1",
+                    'user_id' : user.id,
+                    'start_time' : start,
+                    'end_time': start + timedelta(hours=1),
+                    'duration': '01:00'
+                    })
+            db.session.add(reservation)
+        db.session.commit()
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_resource_rows_carry_tags(self):
+        resources = rows.resource_rows(order_by=Resource.name)
+        self.assertEqual([row.name for row in resources], ["res_1", "res_2"])
+        self.assertEqual([tag.value for tag in resources[0].tags],
+                         ["room", "big"])
+        self.assertEqual(resources[1].tags, [])
+        self.assertEqual(resources[0].available_end, "17:00")
+
+    def test_rows_are_not_tracked(self):
+        rows.resource_rows()
+        rows.upcoming_rows()
+        self.assertEqual(len(db.session.identity_map), 0)
+
+    def test_rows_have_no_dict(self):
+        row = rows.resource_rows(tags=False)[0]
+        self.assertFalse(hasattr(row, '__dict__'))
+        self.assertRaises(AttributeError, setattr, row, 'other', 1)
+
+    def test_upcoming_rows_soonest_first(self):
+        reservations = rows.upcoming_rows(
+            [Reservation.resource_id == self.resource_id])
+        self.assertEqual(len(reservations), 2)
+        self.assertTrue(reservations[0].start_time <
+                        reservations[1].start_time)
+        self.assertTrue(isinstance(reservations[0].start_time, datetime))
+
+if __name__ == '__main__':
+    unittest.main()
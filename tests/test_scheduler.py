@@ -0,0 +1,55 @@
+import unittest
+from datetime import date, datetime, timedelta
+from app.scheduler import closed_intervals, earliest_common_slots
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.day = datetime(2017, 5, 21)
+
+    def at(self, hour, minute=0):
+        return self.day + timedelta(hours=hour, minutes=minute)
+
+    def test_closed_intervals(self):
+        self.assertEqual(closed_intervals(8 * 60, 17 * 60,
+                                          date(2017, 5, 21), date(2017, 5, 22)),
+                         [(self.at(0), self.at(8)),
+                          (self.at(17), self.at(24)),
+                          (self.at(24), self.at(32)),
+                          (self.at(41), self.at(48))])
+
+    def test_common_slot_of_two_resources(self):
+        room = [(self.at(9), self.at(10)), (self.at(12), self.at(13))]
+        projector = [(self.at(10), self.at(11))]
+        slots = earliest_common_slots([room, projector], self.at(9),
+                                      self.at(14), timedelta(hours=1), 5)
+        self.assertEqual(slots, [(self.at(11), self.at(12), self.at(12)),
+                                 (self.at(13), self.at(14), self.at(14))])
+
+    def test_overlapping_busy_intervals_are_merged(self):
+        a = [(self.at(9), self.at(12))]
+        b = [(self.at(10), self.at(11)), (self.at(11, 30), self.at(12, 30))]
+        slots = earliest_common_slots([a, b], self.at(9), self.at(14),
+                                      timedelta(minutes=30), 5)
+        self.assertEqual(slots[0][0], self.at(12, 30))
+
+    def test_short_gaps_are_skipped(self):
+        a = [(self.at(9), self.at(10)), (self.at(10, 15), self.at(11))]
+        slots = earliest_common_slots([a], self.at(9), self.at(12),
+                                      timedelta(minutes=30), 5)
+        self.assertEqual(slots, [(self.at(11), self.at(11, 30), self.at(12))])
+
+    def test_limit(self):
+        a = [(self.at(h), self.at(h, 30)) for h in range(9, 17)]
+        slots = earliest_common_slots([a], self.at(9), self.at(17),
+                                      timedelta(minutes=30), 3)
+        self.assertEqual([s[0] for s in slots],
+                         [self.at(9, 30), self.at(10, 30), self.at(11, 30)])
+
+    def test_no_slot(self):
+        a = [(self.at(9), self.at(17))]
+        self.assertEqual(earliest_common_slots([a, []], self.at(9), self.at(17),
+                                               timedelta(minutes=30), 3), [])
+
+if __name__ == '__main__':
+    unittest.main()
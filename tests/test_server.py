@@ -1,26 +1,27 @@
+import os
+import tempfile
 import unittest
 from datetime import datetime, timedelta
 import app
-from app import models, server
-from app.models import db, User, Reservation, Resource, Tag
-from flask import url_for
+from app import models, server, jobs
+from app.models import db, User, Reservation, Resource, Tag, Tag_Resource
+from flask import url_for, json
+from transactional import TransactionalTestCase
 
-class TestModels(unittest.TestCase):
+class TestModels(TransactionalTestCase):
 
     def setUp(self):
-        self.app = app.get_app("TEST")
+        super(TestModels, self).setUp()
         self.app.config.update(SERVER_NAME='localhost')
-        self.app_context = self.app.app_context()
-        self.app_context.push()
         self.setup_dummy_data()
         self.client = self.app.test_client(use_cookies=True)
         self.user_data = {  'email': "a@a.com",
                             'password': "hard_to_guess_pw"}
 
     def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
+        self.app.config['DELETE_INLINE_LIMIT'] = 5000
+        self.app.config['DELETE_BATCH_SIZE'] = 1000
+        super(TestModels, self).tearDown()
 
     # ---------------------- User tests ----------------------------------------
     def test_can_access_login_page(self):
@@ -222,6 +223,62 @@ class TestModels(unittest.TestCase):
         self.assertEqual(response.location, url_for('list'))
         response = self.client.get('/resources/'+str(self.test_resource_id))
         self.assertEqual(response.status_code, 404)
+
+    def test_delete_resource_removes_reservations_and_tags(self):
+        for i in range(5):
+            self.add_one_reservation(self.test_resource_id,
+                                     self.test_resource_name,
+                                     self.test_user_id)
+        self.client.post('/login',
+                         data=self.user_data)
+        self.client.get('/resources/'+str(self.test_resource_id)+'/delete')
+        self.assertEqual(Reservation.query.filter_by(
+            resource_id=self.test_resource_id).count(), 0)
+        self.assertEqual(Tag_Resource.query.filter_by(
+            resource_id=self.test_resource_id).count(), 0)
+        self.assertEqual(Tag.query.count(), 2)
+
+    def test_delete_resource_with_many_reservations_is_deferred(self):
+        self.app.config['DELETE_INLINE_LIMIT'] = 2
+        self.app.config['DELETE_BATCH_SIZE'] = 2
+        for i in range(5):
+            self.add_one_reservation(self.test_resource_id,
+                                     self.test_resource_name,
+                                     self.test_user_id)
+        self.client.post('/login',
+                         data=self.user_data)
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        queue = jobs.queue
+        eager, queue_path = queue.eager, queue.path
+        queue.eager, queue.path = False, path
+        try:
+            queue.create_table()
+            response = self.client.get('/resources/'+str(self.test_resource_id)+'/delete')
+            self.assertEqual(response.status_code, 302)
+            # the resource goes after its reservations, they point at it
+            self.assertNotEqual(Resource.query.get(self.test_resource_id),
+                                None)
+            self.assertEqual(queue.run_pending(), 1)
+        finally:
+            queue.eager, queue.path = eager, queue_path
+            os.remove(path)
+        db.session.expire_all()
+        self.assertEqual(Reservation.query.filter_by(
+            resource_id=self.test_resource_id).count(), 0)
+        self.assertEqual(Resource.query.get(self.test_resource_id), None)
+        self.assertEqual(Tag_Resource.query.filter_by(
+            resource_id=self.test_resource_id).count(), 0)
+
+    def test_delete_resource_by_non_owner(self):
+        self.client.post('/register',
+                         data={ 'email': "b@b.com",
+                                'password': "hard_to_guess_pw"})
+        self.client.post('/login',
+                         data={ 'email': "b@b.com",
+                                'password': "hard_to_guess_pw"})
+        self.client.get('/resources/'+str(self.test_resource_id)+'/delete')
+        self.assertNotEqual(Resource.query.get(self.test_resource_id), None)
     # ----------------------End Resource tests ---------------------------------
 
     # ----------------------Reservation tests ----------------------------------
@@ -254,6 +311,27 @@ class TestModels(unittest.TestCase):
                                            'duration': '01:00'})
         self.assertEqual(response.status_code, 302)
 
+    def test_add_new_reservation_minutes_carry_over(self):
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.post('/resources/'+str(self.test_resource_id)+'/add_reservation',
+                                    data={ 'date': (datetime.now()+timedelta(days=1)).strftime('%Y-%m-%d'),
+                                           'start': '10:45',
+                                           'duration': '00:30'})
+        self.assertEqual(response.status_code, 302)
+        reservation = Reservation.query.order_by(Reservation.id.desc()).first()
+        self.assertEqual(reservation.end_time.strftime('%H:%M'), '11:15')
+
+    def test_add_new_reservation_past_midnight(self):
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.post('/resources/'+str(self.test_resource_id)+'/add_reservation',
+                                    data={ 'date': (datetime.now()+timedelta(days=1)).strftime('%Y-%m-%d'),
+                                           'start': '16:00',
+                                           'duration': '10:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("End time is after the resource available end" in response.data)
+
     def test_add_new_reservation_invalid_time(self):
         self.client.post('/login',
                          data=self.user_data)
@@ -315,8 +393,125 @@ class TestModels(unittest.TestCase):
         self.assertEqual(response.location, url_for('list'))
         response = self.client.get('/reservations/'+str(self.test_reservation_id))
         self.assertEqual(response.status_code, 404)
+
+    def test_add_reservation_conflict_suggests_free_slots(self):
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.post('/resources/'+str(self.test_resource_id)+'/add_reservation',
+                                    data={ 'date': (datetime.now()+timedelta(days=1)).strftime('%Y-%m-%d'),
+                                           'start': '18:00',
+                                           'duration': '01:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("From 05:00" in response.data)
+        self.assertTrue("To 17:00" in response.data)
     # ----------------------End Reservation tests ------------------------------
 
+    # ----------------------Free slot tests ------------------------------------
+    def test_get_free_slots(self):
+        tomorrow = datetime.now().replace(hour=0, minute=0, second=0,
+                                          microsecond=0) + timedelta(days=1)
+        self.add_reservation_at(tomorrow + timedelta(hours=10),
+                                tomorrow + timedelta(hours=11))
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/free_slots',
+                                   query_string={'date': tomorrow.strftime('%Y-%m-%d')})
+        self.assertEqual(response.status_code, 200)
+        slots = json.loads(response.data)['slots']
+        self.assertEqual([(s['start'], s['end']) for s in slots],
+                         [('05:00', '10:00'), ('11:00', '17:00')])
+        self.assertEqual(slots[0]['minutes'], 300)
+
+    def test_get_free_slots_for_date_range_and_duration(self):
+        tomorrow = datetime.now().replace(hour=0, minute=0, second=0,
+                                          microsecond=0) + timedelta(days=1)
+        self.add_reservation_at(tomorrow + timedelta(hours=5, minutes=30),
+                                tomorrow + timedelta(hours=16, minutes=30))
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/free_slots',
+                                   query_string={'date': tomorrow.strftime('%Y-%m-%d'),
+                                                 'end_date': (tomorrow+timedelta(days=1)).strftime('%Y-%m-%d'),
+                                                 'duration': '00:45'})
+        slots = json.loads(response.data)['slots']
+        self.assertEqual([(s['date'], s['start'], s['end']) for s in slots],
+                         [((tomorrow+timedelta(days=1)).strftime('%Y-%m-%d'),
+                           '05:00', '17:00')])
+
+    def test_get_free_slots_invalid_input(self):
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/free_slots',
+                                   query_string={'date': 'not_date'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/resources/'+str(self.test_resource_id)+'/free_slots',
+                                   query_string={'date': '2017-1-1', 'end_date': '2018-1-1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_free_slots_invalid_resource_id(self):
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.get('/resources/'+str(99999)+'/free_slots',
+                                   query_string={'date': '2017-1-1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_sweep_free_slots_starts_from_now(self):
+        day = datetime(2017, 5, 21)
+        windows = [(day + timedelta(hours=8), day + timedelta(hours=12))]
+        now = day + timedelta(hours=9)
+        booked = Reservation()
+        booked.start_time = day + timedelta(hours=10)
+        booked.end_time = day + timedelta(hours=11)
+        self.assertEqual(server.sweep_free_slots(windows, [booked], now),
+                         [(now, booked.start_time),
+                          (booked.end_time, day + timedelta(hours=12))])
+    # ----------------------End Free slot tests --------------------------------
+
+    # ----------------------Schedule tests -------------------------------------
+    def test_schedule_common_slot(self):
+        tomorrow = datetime.now().replace(hour=0, minute=0, second=0,
+                                          microsecond=0) + timedelta(days=1)
+        other = Resource()
+        other.deserialize({
+                'name' : "projector",
+                'owner_id' : self.test_user_id,
+                'available_start': "09:00",
+                'available_end' : "17:00"
+                })
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+        self.add_reservation_at(tomorrow + timedelta(hours=9),
+                                tomorrow + timedelta(hours=10))
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.get('/schedule',
+                                   query_string=[('resource', self.test_resource_id),
+                                                 ('resource', other_id),
+                                                 ('date', tomorrow.strftime('%Y-%m-%d')),
+                                                 ('duration', '01:00'),
+                                                 ('limit', '1')])
+        self.assertEqual(response.status_code, 200)
+        slots = json.loads(response.data)['slots']
+        self.assertEqual(slots, [{
+            'start': tomorrow.strftime('%Y-%m-%d') + ' 10:00',
+            'end': tomorrow.strftime('%Y-%m-%d') + ' 11:00',
+            'free_until': tomorrow.strftime('%Y-%m-%d') + ' 17:00'}])
+
+    def test_schedule_invalid_input(self):
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.get('/schedule',
+                                   query_string={'date': '2017-1-1',
+                                                 'duration': '01:00'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/schedule',
+                                   query_string={'resource': 99999,
+                                                 'date': '2017-1-1',
+                                                 'duration': '01:00'})
+        self.assertEqual(response.status_code, 404)
+    # ----------------------End Schedule tests ---------------------------------
+
     # ----------------------Tag tests ------------------------------------------
     def test_retrieve_tag_by_id(self):
         self.client.post('/login',
@@ -375,6 +570,41 @@ class TestModels(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(("test_res") not in response.data)
 
+    def test_search_resource_skips_booked_and_closed_resources(self):
+        day = datetime.now() + timedelta(days=2)
+        for name, start, end in [("late_res", "12:00", "20:00"),
+                                 ("booked_res", "05:00", "17:00")]:
+            resource = Resource()
+            resource.deserialize({
+                    'name' : name,
+                    'owner_id' : self.test_user_id,
+                    'available_start': start,
+                    'available_end' : end
+                    })
+            db.session.add(resource)
+            db.session.commit()
+            booked_id = resource.id
+        reservation = Reservation()
+        reservation.deserialize({
+                'resource_id' : booked_id,
+                'resource_name' : "booked_res",
+                'user_id' : self.test_user_id + 1,
+                'start_time' : day.replace(hour=6, minute=30),
+                'end_time': day.replace(hour=7, minute=30),
+                'duration': '01:00'
+                })
+        db.session.add(reservation)
+        db.session.commit()
+        self.client.post('/login',
+                         data=self.user_data)
+        response = self.client.post('/search',
+                                    data={ 'date': day.strftime('%Y-%m-%d'),
+                                           'start': '6:00',
+                                           'duration': '01:00'})
+        self.assertTrue("test_res" in response.data)
+        self.assertTrue("late_res" not in response.data)
+        self.assertTrue("booked_res" not in response.data)
+
     def test_search_resource_invalid_input(self):
         self.client.post('/login',
                          data=self.user_data)
@@ -449,5 +679,19 @@ class TestModels(unittest.TestCase):
         db.session.commit()
         return reservation.id
 
+    def add_reservation_at(self, start, end):
+        reservation = Reservation()
+        reservation.deserialize({
+                'resource_id' : self.test_resource_id,
+                'resource_name' : self.test_resource_name,
+                'user_id' : self.test_user_id,
+                'start_time' : start,
+                'end_time': end,
+                'duration': '00:00'
+                })
+        db.session.add(reservation)
+        db.session.commit()
+        return reservation.id
+
 if __name__ == '__main__':
     unittest.main()
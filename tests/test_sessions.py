@@ -0,0 +1,110 @@
+import os
+import time
+import unittest
+from datetime import datetime, timedelta
+import app
+from app import sessions
+from app.models import db, User
+
+class TestSessions(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.session.add(User("a@a.com", "hard_to_guess_pw"))
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+        self.path = os.path.join(self.app.root_path, 'db',
+                                 'test_sessions.db')
+
+    def tearDown(self):
+        self.app.config.update(SESSION_STORE=None, SESSION_REFRESH_AFTER=0.5)
+        sessions.init_app(self.app)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def use_store(self, store):
+        self.app.config.update(SESSION_STORE=store,
+                               SESSION_SQLITE_PATH=self.path)
+        sessions.init_app(self.app)
+
+    def login(self):
+        return self.client.post('/login',
+                                data={'email': "a@a.com",
+                                      'password': "hard_to_guess_pw"})
+
+    def cookies(self, response):
+        return response.headers.getlist('Set-Cookie')
+
+    def test_unchanged_session_is_not_written(self):
+        self.assertEqual(len(self.cookies(self.login())), 1)
+        response = self.client.get('/home')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cookies(response), [])
+
+    def test_cookie_renewed_near_expiry(self):
+        self.login()
+        self.app.config['SESSION_REFRESH_AFTER'] = 0
+        response = self.client.get('/home')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.cookies(response)), 1)
+        self.assertTrue('Expires=' in self.cookies(response)[0])
+
+    def test_needs_refresh(self):
+        now = datetime.utcnow()
+        self.assertTrue(sessions.needs_refresh(self.app, None))
+        self.assertFalse(sessions.needs_refresh(self.app, now))
+        self.assertTrue(sessions.needs_refresh(
+            self.app, now - timedelta(minutes=6)))
+
+    def test_server_side_session(self):
+        self.use_store('memory')
+        cookie = self.cookies(self.login())[0]
+        # the cookie only carries the signed id
+        self.assertTrue(len(cookie.split(';')[0]) < 120)
+        response = self.client.get('/home')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cookies(response), [])
+        store = self.app.session_interface.store
+        self.assertEqual(len(store._sessions), 1)
+        self.client.get('/logout')
+        self.assertTrue("You need to log in" in self.client.get('/home').data)
+
+    def test_memory_store_evicts_least_recent(self):
+        store = sessions.MemoryStore(2)
+        expires = time.time() + 60
+        store.set('a', '{}', expires)
+        store.set('b', '{}', expires)
+        store.get('a')
+        store.set('c', '{}', expires)
+        self.assertEqual(store.get('b'), None)
+        self.assertEqual(store.get('a'), '{}')
+        store.set('d', '{}', time.time() - 1)
+        self.assertEqual(store.get('d'), None)
+
+    def test_sqlite_store(self):
+        store = sessions.SqliteStore(self.path)
+        store.set('a', '{"x": 1}', time.time() + 60)
+        store.set('b', '{}', time.time() - 1)
+        self.assertEqual(store.get('a'), '{"x": 1}')
+        self.assertEqual(store.get('b'), None)
+        store.purge()
+        store.delete('a')
+        conn = store.connect()
+        try:
+            count = conn.execute('SELECT COUNT(*) FROM session').fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(count, 0)
+
+    def test_sqlite_sessions_log_in(self):
+        self.use_store('sqlite')
+        self.login()
+        self.assertFalse("You need to log in" in self.client.get('/home').data)
+
+if __name__ == '__main__':
+    unittest.main()
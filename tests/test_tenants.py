@@ -0,0 +1,122 @@
+import os
+import unittest
+import app
+from app import jobs, tenants
+from app.models import db, User, Resource
+
+TENANT_DATABASES = {'east': 'sqlite:///db/tenant_east.db',
+                    'west': 'sqlite:///db/tenant_west.db'}
+
+class TestTenants(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app.config.update(
+            TENANT_DATABASES=TENANT_DATABASES,
+            TENANT_DOMAINS={'east.com': 'east', 'west.com': 'west'},
+            TENANT_POOL_SIZES={'west': 2})
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.dispose_tenant_engines()
+        for name in TENANT_DATABASES:
+            path = os.path.join(self.app.root_path, 'db',
+                                'tenant_{}.db'.format(name))
+            if os.path.exists(path):
+                os.remove(path)
+        self.app.config.update(TENANT_DATABASES={}, TENANT_DOMAINS={},
+                               TENANT_POOL_SIZES={}, RATELIMIT_ENABLED=False)
+        self.app_context.pop()
+
+    def client_for(self, email, password="hard_to_guess_pw"):
+        client = self.app.test_client(use_cookies=True)
+        client.post('/register', data={'email': email,
+                                       'password': password})
+        client.post('/login', data={'email': email,
+                                    'password': password})
+        return client
+
+    def add_resource(self, client, name):
+        client.post('/resources/add', data={'name': name,
+                                            'available_start': "08:00",
+                                            'available_end': "17:00",
+                                            'tag': "room"})
+
+    def test_tenant_for_email(self):
+        self.assertEqual(tenants.tenant_for_email("a@East.com"), 'east')
+        self.assertEqual(tenants.tenant_for_email("a@other.com"), None)
+        self.app.config['TENANT_DOMAINS']['gone.com'] = 'gone'
+        self.assertEqual(tenants.tenant_for_email("a@gone.com"), None)
+        self.assertRaises(KeyError, tenants.use_tenant, 'gone')
+
+    def test_tenants_see_only_their_data(self):
+        east = self.client_for("a@east.com")
+        west = self.client_for("b@west.com")
+        self.add_resource(east, "east_room")
+        self.add_resource(west, "west_room")
+        page = east.get('/home').data
+        self.assertTrue("east_room" in page)
+        self.assertFalse("west_room" in page)
+        page = west.get('/home').data
+        self.assertTrue("west_room" in page)
+        self.assertFalse("east_room" in page)
+        # nothing went to the default database, the requests ran in this
+        # app context and left their tenant behind
+        tenants.use_tenant(None)
+        self.assertEqual(User.query.count(), 0)
+        self.assertEqual(Resource.query.count(), 0)
+        tenants.use_tenant('east')
+        self.assertEqual([user.email for user in User.query],
+                         ["a@east.com"])
+
+    def test_default_domain_stays_in_default_database(self):
+        self.add_resource(self.client_for("c@other.com"), "other_room")
+        tenants.use_tenant(None)
+        self.assertEqual(Resource.query.one().name, "other_room")
+
+    def test_login_to_other_tenant_checks_its_user(self):
+        # the rate limit loads the logged in user before the login view
+        self.app.config['RATELIMIT_ENABLED'] = True
+        self.client_for("victim@west.com")
+        east = self.client_for("a@east.com", "attackers_pw")
+        response = east.post('/login', data={'email': "victim@west.com",
+                                             'password': "attackers_pw"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("invalid" in response.data)
+        self.add_resource(east, "stolen_room")
+        tenants.use_tenant('west')
+        self.assertEqual(Resource.query.count(), 0)
+        tenants.use_tenant('east')
+        self.assertEqual(Resource.query.count(), 0)
+
+    def test_engines_are_cached_with_own_pools(self):
+        engine = db.get_tenant_engine(self.app, 'west')
+        self.assertTrue(db.get_tenant_engine(self.app, 'west') is engine)
+        self.assertFalse(db.get_tenant_engine(self.app, 'east') is engine)
+        self.assertEqual(engine.pool.size(), 2)
+        self.assertEqual(db.get_tenant_engine(self.app, 'east').pool.size(),
+                         self.app.config['TENANT_POOL_SIZE'])
+
+    def test_jobs_run_for_their_tenant(self):
+        seen = []
+        jobs.queue.register('record_tenant',
+                            lambda: seen.append(tenants.current_tenant()))
+        try:
+            tenants.use_tenant('east')
+            jobs.defer('record_tenant')
+            jobs.queue.run_handler('record_tenant',
+                                   {jobs.TENANT_KEY: 'west'})
+        finally:
+            del jobs.queue.handlers['record_tenant']
+        self.assertEqual(seen, ['east', 'west'])
+
+    def test_cache_keys_carry_tenant(self):
+        self.assertEqual(tenants.tenant_key(1), 1)
+        tenants.use_tenant('east')
+        self.assertEqual(tenants.tenant_key(1), ('east', 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import unittest
+import time
+from datetime import datetime, timedelta
+import app
+from app import timeline
+from app.models import db, User, Resource, Reservation
+
+class TestTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2030, 1, 1, 8, 0)
+        self.timeline = timeline.Timeline(
+            [(self.at(10), self.at(11), 1), (self.at(9), self.at(12), 2),
+             (self.at(14), self.at(15), 3)],
+            self.now, time.time() + 60)
+
+    def at(self, hour, minute=0):
+        return self.now.replace(hour=hour, minute=minute)
+
+    def test_overlap(self):
+        self.assertTrue(self.timeline.conflicts(self.at(11, 30), self.at(13)))
+        self.assertTrue(self.timeline.conflicts(self.at(13), self.at(14, 30)))
+
+    def test_touching_windows_are_free(self):
+        self.assertFalse(self.timeline.conflicts(self.at(12), self.at(14)))
+        self.assertFalse(self.timeline.conflicts(self.at(8), self.at(9)))
+
+    def test_before_horizon_is_unknown(self):
+        self.assertEqual(self.timeline.conflicts(self.at(7), self.at(8)), None)
+
+    def test_add_and_remove(self):
+        self.timeline.add(self.at(12), self.at(13), 4)
+        self.assertTrue(self.timeline.conflicts(self.at(12), self.at(14)))
+        self.timeline.remove(4)
+        self.timeline.remove(2)
+        self.assertFalse(self.timeline.conflicts(self.at(11), self.at(14)))
+
+
+class TestTimelineCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.get_app("TEST")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.cache = timeline.TimelineCache()
+        user = User("a@a.com", "hard_to_guess_pw")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        resource = Resource()
+        resource.deserialize({
+                'name' : "test_res",
+                'owner_id' : user.id,
+                'available_start': "00:00",
+                'available_end' : "23:59"
+                })
+        db.session.add(resource)
+        db.session.commit()
+        self.resource_id = resource.id
+        self.start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+
+    def tearDown(self):
+        self.app.config['TIMELINE_CACHE_SIZE'] = 10000
+        self.app.config['TIMELINE_CACHE_TTL'] = 60
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def reserve(self, start, end, user_id=None):
+        reservation = Reservation()
+        reservation.deserialize({
+                'resource_id' : self.resource_id,
+                'resource_name' : "test_res",
+                'user_id' : user_id or self.user_id,
+                'start_time' : start,
+                'end_time': end,
+                'duration': '01:00'
+                })
+        db.session.add(reservation)
+        db.session.commit()
+        return reservation
+
+    def test_loads_upcoming_reservations(self):
+        self.reserve(self.start, self.start + timedelta(hours=1))
+        self.assertTrue(self.cache.conflicts(
+            self.user_id, self.start, self.start + timedelta(minutes=30)))
+        self.assertFalse(self.cache.conflicts(
+            self.user_id + 1, self.start, self.start + timedelta(minutes=30)))
+
+    def test_write_through(self):
+        end = self.start + timedelta(hours=1)
+        self.assertFalse(self.cache.conflicts(self.user_id, self.start, end))
+        reservation = self.reserve(self.start, end)
+        self.cache.add(self.user_id, reservation)
+        self.assertTrue(self.cache.conflicts(self.user_id, self.start, end))
+        self.cache.remove(self.user_id, reservation.id)
+        self.assertFalse(self.cache.conflicts(self.user_id, self.start, end))
+
+    def test_expired_timeline_is_reloaded(self):
+        end = self.start + timedelta(hours=1)
+        self.app.config['TIMELINE_CACHE_TTL'] = -1
+        self.assertFalse(self.cache.conflicts(self.user_id, self.start, end))
+        self.reserve(self.start, end)
+        self.assertTrue(self.cache.conflicts(self.user_id, self.start, end))
+
+    def test_least_recently_used_is_dropped(self):
+        self.app.config['TIMELINE_CACHE_SIZE'] = 1
+        first = self.cache.get(self.user_id)
+        self.cache.get(self.user_id + 1)
+        self.assertFalse(self.cache.get(self.user_id) is first)
+
+    def test_disabled(self):
+        self.app.config['TIMELINE_CACHE_ENABLED'] = False
+        try:
+            self.assertEqual(self.cache.conflicts(
+                self.user_id, self.start, self.start), None)
+        finally:
+            self.app.config['TIMELINE_CACHE_ENABLED'] = True
+
+    def test_booking_confirms_with_database(self):
+        # a booking made by another process isn't in this cache yet
+        end = self.start + timedelta(hours=1)
+        self.assertEqual(app.server.valid_user_time(
+            self.start, end, db.session.query(User).get(self.user_id)), "")
+        self.reserve(self.start, end)
+        user = db.session.query(User).get(self.user_id)
+        self.assertEqual(app.server.valid_user_time(self.start, end, user), "")
+        self.assertNotEqual(app.server.valid_user_time(
+            self.start, end, user, confirm=True), "")
+
+    def test_conflict_confirmed_with_database(self):
+        # a cancellation made by another process isn't in this cache yet
+        end = self.start + timedelta(hours=1)
+        self.reserve(self.start, end)
+        user = db.session.query(User).get(self.user_id)
+        self.assertNotEqual(app.server.valid_user_time(
+            self.start, end, user), "")
+        Reservation.query.delete()
+        db.session.commit()
+        user = db.session.query(User).get(self.user_id)
+        self.assertTrue(timeline.timelines.conflicts(
+            self.user_id, self.start, end))
+        self.assertEqual(app.server.valid_user_time(self.start, end, user), "")
+        self.assertEqual(app.server.valid_user_time(
+            self.start, end, user, confirm=True), "")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from datetime import date, datetime
+from app import timeparse
+from app.timeparse import to_minutes, parse_date, parse_window, \
+    window_minutes, valid_availability, availability_windows, fitting_windows
+
+class TestTimeParse(unittest.TestCase):
+
+    def test_to_minutes(self):
+        self.assertEqual(to_minutes("00:00"), 0)
+        self.assertEqual(to_minutes("5:30"), 330)
+        self.assertEqual(to_minutes("17:00"), 1020)
+        for value in ("", "not_time", "10:60", "10:5", "1000"):
+            self.assertRaises(ValueError, to_minutes, value)
+
+    def test_to_minutes_is_cached(self):
+        to_minutes.cache_clear()
+        to_minutes("08:00")
+        to_minutes("08:00")
+        info = to_minutes.cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 1, 1))
+
+    def test_lru_cache_evicts_oldest(self):
+        calls = []
+        @timeparse.lru_cache(maxsize=2)
+        def double(x):
+            calls.append(x)
+            return x * 2
+        double(1), double(2), double(1), double(3), double(2)
+        self.assertEqual(calls, [1, 2, 3, 2])
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date("2017-5-21"), date(2017, 5, 21))
+        self.assertRaises(ValueError, parse_date, "21/5/2017")
+        self.assertRaises(ValueError, parse_date, "2017-13-1")
+
+    def test_parse_window_minute_overflow(self):
+        self.assertEqual(parse_window("2017-5-21", "10:45", "00:30"),
+                         (datetime(2017, 5, 21, 10, 45),
+                          datetime(2017, 5, 21, 11, 15)))
+        self.assertEqual(parse_window("2017-5-21", "9:30", "1:30"),
+                         (datetime(2017, 5, 21, 9, 30),
+                          datetime(2017, 5, 21, 11, 0)))
+
+    def test_parse_window_past_midnight(self):
+        start, end = parse_window("2017-5-21", "23:00", "02:00")
+        self.assertEqual(end, datetime(2017, 5, 22, 1, 0))
+        self.assertEqual(window_minutes(start, end), (1380, 1500))
+        self.assertRaises(ValueError, parse_window, "2017-5-21", "24:00", "01:00")
+
+    def test_valid_availability(self):
+        self.assertEqual(valid_availability("08:00", "17:00"), "")
+        self.assertEqual(valid_availability("9:00", "17:00"), "Input Invalid")
+        self.assertEqual(valid_availability("08:00", "25:00"), "Input Invalid")
+        self.assertEqual(valid_availability("10:00", "09:00"),
+                         "Start time should be before End time")
+
+    def test_fitting_windows(self):
+        windows = availability_windows([("08:00", "17:00"), ("5:00", "9:00"),
+                                        ("12:00", "23:00")])
+        self.assertEqual(fitting_windows(to_minutes("08:00"), to_minutes("09:00"),
+                                         windows), [0, 1])
+        self.assertEqual(fitting_windows(to_minutes("16:00"), 1500, windows), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from sqlalchemy import event, orm
+import app
+from app import timeline, holds
+from app.models import db
+
+def restart_savepoint(session, transaction):
+    # the app committed or rolled back its savepoint, the test's
+    # transaction goes on under a new one
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
+
+
+class TransactionalTestCase(unittest.TestCase):
+    '''
+    The schema is created once per class, every test runs in a
+    transaction that tearDown rolls back. The default in memory database
+    is one per nosetests --processes worker. Tests that need db.engine
+    itself, to migrate or from other threads, don't belong here.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = app.get_app("TEST")
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        timeline.timelines.clear()
+        holds.book.clear()
+        self.connection = db.engine.connect()
+        self.sqlite = self.connection.dialect.name == 'sqlite'
+        if self.sqlite:
+            # pysqlite commits by itself before a SAVEPOINT, it has to
+            # leave BEGIN and COMMIT to us
+            self.connection.connection.connection.isolation_level = None
+        self.transaction = self.connection.begin()
+        if self.sqlite:
+            self.connection.execute('BEGIN')
+        self.app_session = db.session
+        db.session = orm.scoped_session(self.create_session)
+
+    def tearDown(self):
+        db.session.remove()
+        db.session = self.app_session
+        self.transaction.rollback()
+        if self.sqlite:
+            self.connection.connection.connection.isolation_level = ''
+        self.connection.close()
+        self.app_context.pop()
+
+    def create_session(self):
+        '''A session of the test's connection, inside a savepoint.'''
+        # every table, as db.get_binds would send them to the engine
+        binds = dict.fromkeys(db.get_binds(self.app), self.connection)
+        session = db.create_session({'bind': self.connection,
+                                     'binds': binds})
+        event.listen(session, 'after_transaction_end', restart_savepoint)
+        session.begin_nested()
+        return session